@@ -0,0 +1,91 @@
+"""Window reads of uncompressed GeoTIFFs: GDAL vs numpy.memmap.
+
+Writes uncompressed striped and tiled test rasters, then reads every
+block window in row-major and in random order through rasterio and
+through rio_toa.memmap_reader, running the radiance kernel on each
+window so that mapped pages are actually touched.
+
+    python benchmarks/memmap_reads.py --size 8192 --runs 3
+"""
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import click
+import numpy as np
+import rasterio
+
+from rio_toa.kernels import radiance
+from rio_toa.memmap_reader import MemmapReader
+
+
+LAYOUTS = [
+    ('striped', {}),
+    ('tiled', {'tiled': True, 'blockxsize': 512, 'blockysize': 512})
+]
+
+
+def _write(path, size, **kwargs):
+    with rasterio.open(path, 'w', driver='GTiff', width=size, height=size,
+                       count=1, dtype='uint16', **kwargs) as dst:
+        for _, window in dst.block_windows(1):
+            dst.write(np.random.randint(
+                1, 60000, (1, window.height, window.width)).astype(
+                    np.uint16), window=window)
+
+
+def _windows(path, tile):
+    with rasterio.open(path) as src:
+        height, width = src.shape
+
+    return [rasterio.windows.Window(col, row, min(tile, width - col),
+                                    min(tile, height - row))
+            for row in range(0, height, tile)
+            for col in range(0, width, tile)]
+
+
+def _time(src, windows, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        for window in windows:
+            radiance(src.read(1, window=window), 0.01, -50.0)
+        times.append(time.time() - start)
+
+    return min(times)
+
+
+@click.command()
+@click.option('--size', type=int, default=8192,
+              help="Raster width and height")
+@click.option('--tile', type=int, default=512,
+              help="Window size")
+@click.option('--runs', type=int, default=3)
+def main(size, tile, runs):
+    tmpdir = tempfile.mkdtemp(prefix='rio_toa_bench_')
+    try:
+        for name, kwargs in LAYOUTS:
+            path = os.path.join(tmpdir, '%s.tif' % name)
+            _write(path, size, **kwargs)
+            windows = _windows(path, tile)
+            shuffled = list(windows)
+            random.Random(0).shuffle(shuffled)
+
+            for order, wins in [('sequential', windows),
+                                ('random', shuffled)]:
+                with rasterio.open(path) as src:
+                    gdal = _time(src, wins, runs)
+                with MemmapReader(path) as src:
+                    mapped = _time(src, wins, runs)
+
+                click.echo('{:<8} {:<10} gdal {:.3f}s  memmap {:.3f}s  '
+                           '{:.1f}x'.format(name, order, gdal, mapped,
+                                            gdal / mapped))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
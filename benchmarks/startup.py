@@ -0,0 +1,55 @@
+"""Startup time of the rio toa plugin.
+
+rio loads every rasterio.rio_plugins entry point on every command, so
+the cost of importing rio_toa.scripts.cli lands on e.g. `rio info` too.
+
+    python benchmarks/startup.py --runs 10 --budget 0.5
+"""
+import subprocess
+import sys
+import time
+
+import click
+
+
+CASES = [
+    ('import rio_toa', [sys.executable, '-c', 'import rio_toa']),
+    ('import rio_toa.kernels', [sys.executable, '-c', 'import rio_toa.kernels']),
+    ('import rio_toa.scripts.cli',
+     [sys.executable, '-c', 'import rio_toa.scripts.cli']),
+    ('rio toa --help', ['rio', 'toa', '--help']),
+    ('python baseline', [sys.executable, '-c', 'pass'])
+]
+
+
+def _time(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call(cmd, stdout=subprocess.PIPE)
+        times.append(time.time() - start)
+
+    return sorted(times)
+
+
+@click.command()
+@click.option('--runs', type=int, default=10)
+@click.option('--budget', type=float, default=None,
+              help="Fail if the median `rio toa --help` time in seconds "
+                   "exceeds this")
+def main(runs, budget):
+    results = {}
+    for name, cmd in CASES:
+        times = _time(cmd, runs)
+        results[name] = times[len(times) // 2]
+        click.echo('{:<28} median {:.3f}s  min {:.3f}s'.format(
+            name, results[name], times[0]))
+
+    if budget is not None and results['rio toa --help'] > budget:
+        raise click.ClickException(
+            '`rio toa --help` took {:.3f}s, over the {:.3f}s budget'.format(
+                results['rio toa --help'], budget))
+
+
+if __name__ == '__main__':
+    main()
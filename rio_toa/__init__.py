@@ -4,3 +4,12 @@ __version__ = "0.3.0"
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
+
+
+def __getattr__(name):
+    # rio_toa.Scene needs rasterio; import it on first use so that the
+    # numpy only kernels stay importable, and fast to import, without it
+    if name == 'Scene':
+        from rio_toa.scene import Scene
+        return Scene
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
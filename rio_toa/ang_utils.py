@@ -0,0 +1,194 @@
+import re
+
+import numpy as np
+
+from rio_toa import toa_utils
+
+
+def _parse_ang_txt(angtxt):
+    """
+    Parse a Landsat 8 ANG angle coefficient file. Coefficient lists
+    span several lines and are returned as lists of floats.
+
+    Parameters
+    -----------
+    angtxt: str
+        contents of an *_ANG.txt file
+
+    Returns
+    --------
+    dict
+        parsed ANG metadata, grouped like a parsed MTL
+    """
+    lines = []
+    pending = ''
+    for line in angtxt.splitlines():
+        pending = '%s %s' % (pending, line.strip()) if pending else line
+        if pending.count('(') <= pending.count(')'):
+            lines.append(pending)
+            pending = ''
+
+    return _cast_tuples(toa_utils._parse_mtl_txt('\n'.join(lines) + '\n'))
+
+
+def _cast_tuples(ang):
+    for k, v in ang.items():
+        if isinstance(v, dict):
+            _cast_tuples(v)
+        elif isinstance(v, str) and v.startswith('('):
+            ang[k] = [float(c) for c in re.findall(r'[^\s\(\),]+', v)]
+
+    return ang
+
+
+def load_ang(src_ang):
+    with open(src_ang) as src:
+        return _parse_ang_txt(src.read())
+
+
+def sun_vector(ang):
+    """
+    Scene-centre unit vector towards the sun in Earth-centered,
+    Earth-fixed coordinates, from the ANG SOLAR_VECTOR samples
+
+    Parameters
+    -----------
+    ang: dict
+        parsed ANG metadata
+
+    Returns
+    --------
+    ndarray
+        (3,) unit vector
+    """
+    solar = ang['SOLAR_VECTOR']
+    sun = np.array([np.mean(solar['SOLAR_ECEF_%s' % axis])
+                    for axis in 'XYZ'])
+
+    return sun / np.linalg.norm(sun)
+
+
+def solar_angles(lng, lat, sun):
+    """
+    Solar zenith and azimuth angles for geodetic coordinates.
+    The sun is far enough away that the direction from the Earth's
+    centre is used for every point.
+
+    Parameters
+    -----------
+    lng: ndarray or float
+        longitudes in degrees
+    lat: ndarray or float
+        latitudes in degrees
+    sun: ndarray
+        (3,) ECEF unit vector towards the sun
+
+    Returns
+    --------
+    (zenith, azimuth): tuple of ndarrays
+        angles in degrees, azimuth clockwise from north
+    """
+    lng = np.deg2rad(lng)
+    lat = np.deg2rad(lat)
+    sx, sy, sz = sun
+
+    up = (np.cos(lat) * np.cos(lng) * sx +
+          np.cos(lat) * np.sin(lng) * sy +
+          np.sin(lat) * sz)
+    east = -np.sin(lng) * sx + np.cos(lng) * sy
+    north = (-np.sin(lat) * np.cos(lng) * sx -
+             np.sin(lat) * np.sin(lng) * sy +
+             np.cos(lat) * sz)
+
+    zenith = np.rad2deg(np.arccos(np.clip(up, -1.0, 1.0)))
+    azimuth = np.rad2deg(np.arctan2(east, north)) % 360.0
+
+    return zenith, azimuth
+
+
+def _poly_terms(degree):
+    return [(n - j, j) for n in range(degree + 1) for j in range(n + 1)]
+
+
+def zenith_poly(ang, crs, transform, shape, lattice=17, degree=3):
+    """
+    Fit a per-scene polynomial of solar zenith over pixel coordinates.
+    Exact angles are computed on a lattice x lattice grid of pixels;
+    the fitted terms are cheap to pass to workers and evaluate per window.
+
+    Parameters
+    -----------
+    ang: dict
+        parsed ANG metadata
+    crs: CRS or dict
+        raster coordinate reference system
+    transform: Affine
+        raster geotransform
+    shape: tuple
+        (rows, cols) of the raster
+    lattice: int
+        number of lattice points along each axis
+    degree: int
+        polynomial degree
+
+    Returns
+    --------
+    dict
+        polynomial terms, coefficients and the raster shape
+    """
+    from rasterio import warp
+
+    rows, cols = shape
+    v, u = np.meshgrid(np.linspace(0.0, 1.0, lattice),
+                       np.linspace(0.0, 1.0, lattice),
+                       indexing='ij')
+    v, u = v.ravel(), u.ravel()
+
+    xs, ys = transform * (u * cols, v * rows)
+    lngs, lats = warp.transform(crs, {'init': u'epsg:4326'},
+                                list(xs), list(ys))
+    zenith, _ = solar_angles(np.array(lngs), np.array(lats),
+                             sun_vector(ang))
+
+    terms = _poly_terms(degree)
+    A = np.column_stack([u ** i * v ** j for i, j in terms])
+    coefs = np.linalg.lstsq(A, zenith, rcond=None)[0]
+
+    return {
+        'shape': (rows, cols),
+        'terms': terms,
+        'coefs': coefs
+        }
+
+
+def eval_zenith_poly(poly, window):
+    """
+    Evaluate a zenith_poly for every pixel of a window
+
+    Parameters
+    -----------
+    poly: dict
+        output of zenith_poly
+    window: tuple or Window
+        window of the raster the polynomial was fitted on
+
+    Returns
+    --------
+    ndarray
+        (rows, cols) solar zenith in degrees at pixel centres
+    """
+    (row_start, row_stop), (col_start, col_stop) = \
+        toa_utils._window_ranges(window)
+    rows, cols = poly['shape']
+
+    v = (np.arange(row_start, row_stop) + 0.5) / rows
+    u = (np.arange(col_start, col_stop) + 0.5) / cols
+
+    # sum over j of v ** j * (polynomial in u): one (rows, d) x (d, cols)
+    # matrix product instead of one pass over the window per term
+    degree = max(j for _, j in poly['terms'])
+    u_terms = np.zeros((degree + 1, len(u)), dtype=np.float64)
+    for (i, j), c in zip(poly['terms'], poly['coefs']):
+        u_terms[j] += c * u ** i
+
+    return np.vander(v, degree + 1, increasing=True).dot(u_terms)
@@ -0,0 +1,279 @@
+"""Per-band statistics and histograms accumulated window by window.
+
+Workers summarise each window they compute (valid count, mean, sum of
+squared deviations, min, max and a fixed-bin histogram per band), the
+writer merges the summaries, and the result is written to the output as
+GDAL's STATISTICS_* band metadata, with the histogram in a TOA_HISTOGRAM
+band tag. write_aux_xml() also writes them to a .aux.xml sidecar, where
+`gdalinfo -hist` finds the histograms.
+"""
+import json
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import rasterio
+
+
+BUCKETS = 256
+
+
+def hist_range(dtype, float_range=(0.0, 1.0)):
+    """
+    Histogram range for an output data type: every value of integer
+    types, float_range for floats
+
+    Parameters
+    -----------
+    dtype: numpy dtype
+    float_range: tuple
+        (min, max) expected for floating point outputs
+
+    Returns
+    --------
+    (min, max): tuple of floats
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return float(info.min) - 0.5, float(info.max) + 0.5
+
+    return float(float_range[0]), float(float_range[1])
+
+
+def window_stats(arr, nodata=None, buckets=BUCKETS, bounds=(0.0, 1.0)):
+    """
+    Summarise the valid pixels of one window
+
+    Parameters
+    -----------
+    arr: ndarray
+        (bands, rows, cols) output window
+    nodata: number
+        output nodata value; NaN is never valid
+    buckets: int
+    bounds: tuple
+        histogram (min, max); values outside it are counted in the
+        first or last bucket
+
+    Returns
+    --------
+    list
+        per band (count, mean, m2, min, max, histogram) tuples
+    """
+    partials = []
+    for band in arr.reshape(arr.shape[0], -1):
+        valid = band
+        if np.issubdtype(band.dtype, np.floating):
+            valid = valid[~np.isnan(valid)]
+        if nodata is not None and not np.isnan(nodata):
+            valid = valid[valid != nodata]
+
+        if not valid.size:
+            partials.append((0, 0.0, 0.0, np.inf, -np.inf,
+                             np.zeros(buckets, dtype=np.int64)))
+            continue
+
+        values = valid.astype(np.float64)
+        mean = values.mean()
+        hist = np.bincount(
+            np.clip(((values - bounds[0]) * buckets /
+                     (bounds[1] - bounds[0])).astype(np.int64),
+                    0, buckets - 1),
+            minlength=buckets)
+
+        partials.append((values.size, mean, ((values - mean) ** 2).sum(),
+                         values.min(), values.max(), hist))
+
+    return partials
+
+
+def _merge(a, b):
+    count = a[0] + b[0]
+    if not count:
+        return a
+
+    delta = b[1] - a[1]
+    mean = a[1] + delta * b[0] / count
+    m2 = a[2] + b[2] + delta ** 2 * a[0] * b[0] / count
+
+    return (count, mean, m2, min(a[3], b[3]), max(a[4], b[4]), a[5] + b[5])
+
+
+class BandStats(object):
+    """Merges window_stats partials into per-band statistics"""
+
+    def __init__(self, count, pixels, buckets=BUCKETS, bounds=(0.0, 1.0)):
+        self.pixels = pixels
+        self.buckets = buckets
+        self.bounds = bounds
+        self.partials = [(0, 0.0, 0.0, np.inf, -np.inf,
+                          np.zeros(buckets, dtype=np.int64))] * count
+
+    def add(self, partials):
+        self.partials = [_merge(a, b)
+                         for a, b in zip(self.partials, partials)]
+
+    def result(self):
+        """
+        Returns
+        --------
+        list
+            per band dicts of min, max, mean, stddev, count (valid
+            pixels), valid_percent and histogram (min, max, buckets,
+            counts)
+        """
+        stats = []
+        for count, mean, m2, vmin, vmax, hist in self.partials:
+            stats.append({
+                'min': float(vmin) if count else None,
+                'max': float(vmax) if count else None,
+                'mean': float(mean) if count else None,
+                'stddev': float(np.sqrt(m2 / count)) if count else None,
+                'count': int(count),
+                'valid_percent': 100.0 * count / self.pixels
+                if self.pixels else 0.0,
+                'histogram': {'min': self.bounds[0], 'max': self.bounds[1],
+                              'buckets': self.buckets,
+                              'counts': [int(c) for c in hist]}})
+
+        return stats
+
+
+def stats_tags(band):
+    """STATISTICS_* and TOA_HISTOGRAM band metadata of one band's
+    statistics"""
+    tags = {'TOA_HISTOGRAM': json.dumps(band['histogram'])}
+    if band['count']:
+        tags.update(STATISTICS_MINIMUM=repr(band['min']),
+                    STATISTICS_MAXIMUM=repr(band['max']),
+                    STATISTICS_MEAN=repr(band['mean']),
+                    STATISTICS_STDDEV=repr(band['stddev']),
+                    STATISTICS_VALID_PERCENT=repr(band['valid_percent']))
+    return tags
+
+
+def write_stats(dst, stats):
+    """Write STATISTICS_* and TOA_HISTOGRAM band metadata to an open
+    dataset"""
+    for bidx, band in enumerate(stats, 1):
+        dst.update_tags(bidx, **stats_tags(band))
+
+
+def merge_stats(stats, pixels):
+    """
+    Statistics of a whole output from those of its parts
+
+    Parameters
+    -----------
+    stats: list
+        per part lists of per band dicts, as read_stats()
+    pixels: int
+        pixels of the whole output, per band
+
+    Returns
+    --------
+    list
+        per band dicts, as BandStats.result(); None when a part has no
+        histograms
+    """
+    if not stats or any(band['histogram'] is None
+                        for part in stats for band in part):
+        return None
+
+    merged = []
+    for bands in zip(*stats):
+        hist = bands[0]['histogram']
+        accumulator = BandStats(1, pixels, hist['buckets'],
+                                (hist['min'], hist['max']))
+        for band in bands:
+            count = band['count']
+            if not count:
+                continue
+            accumulator.add([(count, band['mean'],
+                              band['stddev'] ** 2 * count,
+                              band['min'], band['max'],
+                              np.array(band['histogram']['counts'],
+                                       dtype=np.int64))])
+        merged.extend(accumulator.result())
+
+    return merged
+
+
+def aux_path(path):
+    return path + '.aux.xml'
+
+
+def write_aux_xml(path, stats):
+    """
+    Write histograms and statistics to path's .aux.xml, as GDAL's
+    persistent auxiliary metadata
+
+    Parameters
+    -----------
+    path: string
+        output raster
+    stats: list
+        BandStats.result()
+
+    Returns
+    --------
+    None
+    """
+    root = ET.Element('PAMDataset')
+    for bidx, band in enumerate(stats, 1):
+        el = ET.SubElement(root, 'PAMRasterBand', band=str(bidx))
+        hist = band['histogram']
+        item = ET.SubElement(ET.SubElement(el, 'Histograms'), 'HistItem')
+        for tag, value in [('HistMin', repr(hist['min'])),
+                           ('HistMax', repr(hist['max'])),
+                           ('BucketCount', str(hist['buckets'])),
+                           ('IncludeOutOfRange', '1'),
+                           ('Approximate', '0'),
+                           ('HistCounts',
+                            '|'.join(str(c) for c in hist['counts']))]:
+            ET.SubElement(item, tag).text = value
+
+        if band['count']:
+            md = ET.SubElement(el, 'Metadata')
+            for key in ['min', 'max', 'mean', 'stddev', 'valid_percent']:
+                name = {'min': 'MINIMUM', 'max': 'MAXIMUM'}.get(
+                    key, key.upper())
+                ET.SubElement(md, 'MDI',
+                              key='STATISTICS_' + name).text = \
+                    repr(band[key])
+
+    ET.ElementTree(root).write(aux_path(path))
+
+
+def read_stats(path):
+    """
+    Read statistics written by write_stats
+
+    Parameters
+    -----------
+    path: string
+        output raster
+
+    Returns
+    --------
+    list
+        per band dicts, as BandStats.result()
+    """
+    stats = []
+    with rasterio.open(path) as src:
+        for bidx in src.indexes:
+            tags = src.tags(bidx)
+            band = {}
+            for key, name in [('min', 'MINIMUM'), ('max', 'MAXIMUM'),
+                              ('mean', 'MEAN'), ('stddev', 'STDDEV'),
+                              ('valid_percent', 'VALID_PERCENT')]:
+                value = tags.get('STATISTICS_' + name)
+                band[key] = float(value) if value is not None else None
+
+            band['count'] = int(round(
+                (band['valid_percent'] or 0) * src.width * src.height / 100))
+            hist = tags.get('TOA_HISTOGRAM')
+            band['histogram'] = json.loads(hist) if hist else None
+            stats.append(band)
+
+    return stats
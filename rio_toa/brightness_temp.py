@@ -1,65 +1,14 @@
-import json
 import numpy as np
 import rasterio as rio
-import collections
-from rasterio.coords import BoundingBox
-import riomucho
-from rasterio import warp
 
-from rio_toa import radiance
+from rio_toa import band_stats
+from rio_toa import bundle
+from rio_toa import preview
 from rio_toa import toa_utils
-from rio_toa import sun_utils
-
-
-def brightness_temp(img, ML, AL, K1, K2, src_nodata=0):
-    """Calculate brightness temperature of Landsat 8
-    as outlined here: http://landsat.usgs.gov/Landsat8_Using_Product.php
-
-    T = K2 / np.log((K1 / L)  + 1)
-
-    and
-
-    L = ML * Q + AL
-
-    where:
-        T  = At-satellite brightness temperature (degrees kelvin)
-        L  = TOA spectral radiance (Watts / (m2 * srad * mm))
-        ML = Band-specific multiplicative rescaling factor from the metadata
-             (RADIANCE_MULT_BAND_x, where x is the band number)
-        AL = Band-specific additive rescaling factor from the metadata
-             (RADIANCE_ADD_BAND_x, where x is the band number)
-        Q  = Quantized and calibrated standard product pixel values (DN)
-             (ndarray img)
-        K1 = Band-specific thermal conversion constant from the metadata
-             (K1_CONSTANT_BAND_x, where x is the thermal band number)
-        K2 = Band-specific thermal conversion constant from the metadata
-             (K1_CONSTANT_BAND_x, where x is the thermal band number)
-
-
-    Parameters
-    -----------
-    img: ndarray
-        array of input pixels
-    ML: float
-        multiplicative rescaling factor from scene metadata
-    AL: float
-        additive rescaling factor from scene metadata
-    K1: float
-        thermal conversion constant from scene metadata
-    K2: float
-        thermal conversion constant from scene metadata
-
-    Returns
-    --------
-    ndarray:
-        float32 ndarray with shape == input shape
-    """
-    L = radiance.radiance(img, ML, AL, src_nodata=0)
-    L[img == src_nodata] = np.NaN
-
-    T = K2 / np.log((K1 / L) + 1)
-
-    return T
+from rio_toa.kernels import brightness_temp
+from rio_toa import qa_utils
+from rio_toa import reproject
+from rio_toa.executor import Executor
 
 
 def _brightness_temp_worker(data, window, ij, g_args):
@@ -77,10 +26,16 @@ def _brightness_temp_worker(data, window, ij, g_args):
     out: None
         Output is written to dst_path
     """
+    if g_args['qa_flags']:
+        mask = qa_utils.qa_mask(data[-1][0], g_args['qa_flags'])
+        if mask.all():
+            return np.full((g_args['bands'],) + mask.shape,
+                           g_args['dst_nodata'], dtype=g_args['dst_dtype'])
+        data = data[:-1]
 
     output = toa_utils.temp_rescale(
                     brightness_temp(
-                        data[0],
+                        np.concatenate(data),
                         g_args['M'],
                         g_args['A'],
                         g_args['K1'],
@@ -88,70 +43,155 @@ def _brightness_temp_worker(data, window, ij, g_args):
                         g_args['src_nodata']),
                     g_args['temp_scale'])
 
+    if g_args['qa_flags']:
+        output = qa_utils.apply_qa_mask(output, mask, g_args['dst_nodata'])
+
     return output.astype(g_args['dst_dtype'])
 
 
 def calculate_landsat_brightness_temperature(
         src_path, src_mtl, dst_path, temp_scale,
-        creation_options, band, dst_dtype, processes):
+        creation_options, band, dst_dtype, processes,
+        qa_path=None, qa_flags=None, prefetch=0, shard=None, cache=None,
+        stats=False, aux_xml=False, preview_scale=None, dst_crs=None,
+        dst_res=None, target_aligned_pixels=False, driver=None,
+        scene=None):
 
     """Parameters
     ------------
-    src_path: list
-              list of src_paths(strings)
-    src_mtl: string
-             mtl file path
+    src_path: string or list
+              single band or stacked multiband thermal files, or a
+              USGS .tar.gz bundle (see rio_toa.bundle)
+    src_mtl: string or dict
+             mtl file path, or the bundle (or None) to parse its MTL,
+             or an MTL already parsed
     dst_path: string
               destination file path
     rescale_factor: float [default] float(55000.0/2**16)
                     rescale post-TOA tifs to 55,000 or to full 16-bit
     creation_options: dictionary
                       rio.options.creation_options
-    band: list
-          list of integers
+    band: integer or list
+          L8 band numbers of every input band, in order, e.g. [10, 11];
+          all of them are computed in one pass, as one band each of the
+          output
     dst_dtype: strings [default] uint16
                destination data dtype
+    qa_path: string
+             BQA band path, required with qa_flags
+    qa_flags: list
+              BQA flags (see qa_utils.QA_FLAGS) to write as nodata
+    prefetch: integer
+              number of coalesced window reads to prefetch concurrently
+              (for remote inputs); 0 reads in the workers
+    shard: tuple
+           (i, n) to compute only shard i of n as a partial output, to be
+           assembled with rio_toa.shards.merge_shards
+    cache: rio_toa.cache.OutputCache
+           serve the output from this cache when the same job ran before
+    stats: boolean
+           accumulate per-band statistics and histograms while computing,
+           and write them to the output's band metadata
+    aux_xml: boolean
+           also write the statistics and histograms to a .aux.xml
+    preview_scale: int
+           compute a preview at 1/preview_scale of the input resolution,
+           read from the input's overviews (see rio_toa.preview)
+    dst_crs: string or CRS
+           compute the output reprojected to this CRS, reading the inputs
+           through a WarpedVRT
+    dst_res: float or tuple
+           output resolution in dst_crs units (Default: as gdalwarp)
+    target_aligned_pixels: boolean
+           align the output bounds to multiples of dst_res, as gdalwarp -tap
+    driver: string
+           output format, "GTiff", "Zarr" (see rio_toa.zarr_output) or
+           "VRT" over per-window tiles (see rio_toa.tiles)
+           (Default: the input's)
+    scene: rio_toa.Scene
+           the scene of src_path and src_mtl, whose memoized
+           coefficients, datasets and profiles are used instead of
+           setting them up again
 
     Returns
     ---------
-    out: None
-        Output is written to dst_path
+    out: list
+        per band statistics (see rio_toa.band_stats.BandStats.result),
+        or None without stats; output is written to dst_path
     """
-    mtl = toa_utils._load_mtl(src_mtl)
-
-    M = toa_utils._load_mtl_key(mtl,
-                                ['L1_METADATA_FILE',
-                                 'RADIOMETRIC_RESCALING',
-                                 'RADIANCE_MULT_BAND_'],
-                                band)
-    A = toa_utils._load_mtl_key(mtl,
-                                ['L1_METADATA_FILE',
-                                 'RADIOMETRIC_RESCALING',
-                                 'RADIANCE_ADD_BAND_'],
-                                band)
-
-    K1 = toa_utils._load_mtl_key(mtl,
-                                 ['L1_METADATA_FILE',
-                                  'TIRS_THERMAL_CONSTANTS',
-                                  'K1_CONSTANT_BAND_'],
-                                 band)
-    K2 = toa_utils._load_mtl_key(mtl,
-                                 ['L1_METADATA_FILE',
-                                  'TIRS_THERMAL_CONSTANTS',
-                                  'K2_CONSTANT_BAND_'],
-                                 band)
+    src_paths = toa_utils._as_list(src_path)
+    bands = toa_utils._as_list(band)
+    if scene is not None:
+        M, A = scene.rescaling('RADIANCE', bands)
+        K1, K2 = scene.thermal_constants(bands)
+    else:
+        src_paths, src_mtl = bundle.resolve(src_paths, src_mtl, bands)
+        mtl = toa_utils._load_mtl(src_mtl)
+
+        M = toa_utils._band_constants(mtl,
+                                      ['L1_METADATA_FILE',
+                                       'RADIOMETRIC_RESCALING',
+                                       'RADIANCE_MULT_BAND_'],
+                                      bands)
+        A = toa_utils._band_constants(mtl,
+                                      ['L1_METADATA_FILE',
+                                       'RADIOMETRIC_RESCALING',
+                                       'RADIANCE_ADD_BAND_'],
+                                      bands)
+
+        K1 = toa_utils._band_constants(mtl,
+                                       ['L1_METADATA_FILE',
+                                        'TIRS_THERMAL_CONSTANTS',
+                                        'K1_CONSTANT_BAND_'],
+                                       bands)
+        K2 = toa_utils._band_constants(mtl,
+                                       ['L1_METADATA_FILE',
+                                        'TIRS_THERMAL_CONSTANTS',
+                                        'K2_CONSTANT_BAND_'],
+                                       bands)
 
     dst_dtype = np.__dict__[dst_dtype]
 
-    with rio.open(src_path) as src:
-        dst_profile = src.profile.copy()
-
-        src_nodata = src.nodata
+    if scene is not None:
+        dst_profile = scene.profile(bands, dst_dtype, creation_options,
+                                    driver).copy()
+        src_counts = [scene.dataset(b).count for b in bands]
+    else:
+        src_counts = []
+        for path in src_paths:
+            with rio.open(path) as src:
+                dst_profile = src.profile.copy()
+                src_counts.append(src.count)
 
         for co in creation_options:
             dst_profile[co] = creation_options[co]
 
-        dst_profile['dtype'] = dst_dtype
+        dst_profile.update(dtype=dst_dtype, count=len(bands))
+        if driver:
+            dst_profile['driver'] = driver
+
+    # checks that every input band has an L8 band number
+    toa_utils._read_plan(src_counts, bands)
+
+    if dst_crs:
+        dst_profile = reproject.warped_profile(dst_profile, dst_crs, dst_res,
+                                               target_aligned_pixels)
+
+    tags = {}
+    if preview_scale:
+        dst_profile = preview.preview_profile(dst_profile, preview_scale)
+        tags['TOA_PREVIEW_SCALE'] = str(preview_scale)
+
+    warp_opts = reproject.warp_options(dst_profile) if dst_crs else None
+
+    dst_nodata = None
+    if qa_flags:
+        src_paths.append(qa_path)
+        if np.issubdtype(dst_dtype, np.floating):
+            dst_nodata = np.nan
+        else:
+            dst_nodata = 0
+        dst_profile['nodata'] = dst_nodata
 
     global_args = {
         'M': M,
@@ -160,13 +200,32 @@ def calculate_landsat_brightness_temperature(
         'K2': K2,
         'src_nodata': 0,
         'temp_scale': temp_scale,
-        'dst_dtype': dst_dtype
+        'dst_dtype': dst_dtype,
+        'dst_nodata': dst_nodata,
+        'qa_flags': qa_flags,
+        'bands': len(bands)
         }
 
-    with riomucho.RioMucho([src_path],
-                           dst_path,
-                           _brightness_temp_worker,
-                           options=dst_profile,
-                           global_args=global_args) as rm:
+    with Executor(src_paths,
+                  dst_path,
+                  _brightness_temp_worker,
+                  options=dst_profile,
+                  global_args=global_args,
+                  prefetch=prefetch,
+                  shard=shard,
+                  cache=cache,
+                  stats=band_stats.hist_range(
+                      dst_dtype, toa_utils.temp_rescale(
+                          np.array([150.0, 350.0]), temp_scale))
+                  if stats else None,
+                  aux_xml=aux_xml,
+                  tags=tags,
+                  band_tags=[{'TOA_BAND': str(b)} for b in bands],
+                  preview=preview_scale,
+                  warp=warp_opts,
+                  first_src=scene.dataset(bands[0])
+                  if scene is not None else None) as rm:
 
         rm.run(processes)
+
+    return rm.band_stats
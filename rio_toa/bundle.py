@@ -0,0 +1,164 @@
+"""Landsat scenes read directly from USGS .tar.gz bundles.
+
+A bundle's members are listed, and its MTL parsed, in a single
+streaming pass over the archive, which is remembered per bundle path and
+modification time. Bands are read in place through GDAL's /vsitar/
+filesystem: GDAL keeps a seek index of the gzip stream after its first
+pass, so the scene is never extracted to disk.
+"""
+import json
+import os
+import re
+import tarfile
+
+from rio_toa import toa_utils
+
+
+BAND_TEMPLATE = r'.*_B{b}\.TIF'
+
+_BUNDLE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar')
+_MTL_MEMBER = re.compile(r'.*_MTL\.(txt|json)$', re.I)
+
+# (abspath, mtime) -> (member names, MTL member, MTL text)
+_index_cache = {}
+
+
+def is_bundle(path):
+    return isinstance(path, str) and \
+        path.lower().endswith(_BUNDLE_EXTENSIONS) and \
+        os.path.isfile(path)
+
+
+def vsi_path(path, member):
+    """GDAL /vsitar/ path of a bundle member"""
+    return '/vsitar/%s/%s' % (os.path.abspath(path), member)
+
+
+def split_vsi_path(path):
+    """(bundle, member) of a /vsitar/ path, or None"""
+    if not path.startswith('/vsitar/'):
+        return None
+    rest = path[len('/vsitar/'):]
+    for ext in _BUNDLE_EXTENSIONS:
+        i = rest.lower().find(ext + '/')
+        if i != -1:
+            return rest[:i + len(ext)], rest[i + len(ext) + 1:]
+    return None
+
+
+def _index(path):
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    if key not in _index_cache:
+        names, mtl_name, mtl_text = [], None, None
+        with tarfile.open(path, 'r:*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                names.append(member.name)
+                if mtl_name is None and _MTL_MEMBER.match(member.name):
+                    mtl_name = member.name
+                    mtl_text = tar.extractfile(member).read().decode('utf-8')
+        _index_cache[key] = (names, mtl_name, mtl_text)
+
+    return _index_cache[key]
+
+
+def members(path):
+    """File members of a bundle, in archive order"""
+    return list(_index(path)[0])
+
+
+def read_mtl(path):
+    """
+    Parse the MTL of a bundle
+
+    Parameters
+    -----------
+    path: string
+        .tar.gz, .tgz or .tar bundle
+
+    Returns
+    --------
+    dict
+        parsed MTL, as from toa_utils._load_mtl
+    """
+    _, mtl_name, mtl_text = _index(path)
+    if mtl_name is None:
+        raise ValueError('%s has no *_MTL.txt or *_MTL.json member' % path)
+
+    if mtl_name.lower().endswith('.json'):
+        return json.loads(mtl_text)
+    return toa_utils._parse_mtl_txt(mtl_text)
+
+
+def band_members(path, template=BAND_TEMPLATE):
+    """
+    Band files of a bundle, found with a --readtemplate style template
+
+    Parameters
+    -----------
+    path: string
+        .tar.gz, .tgz or .tar bundle
+    template: string
+        regular expression matched against whole member names, with {b}
+        standing for the band number
+
+    Returns
+    --------
+    dict
+        L8 band number: /vsitar/ path of its member
+    """
+    tomatch = re.compile(template.replace('{b}', '([0-9]+?)'))
+    found = {}
+    for name in members(path):
+        match = tomatch.fullmatch(name)
+        if match:
+            found.setdefault(int(match.group(1)), vsi_path(path, name))
+
+    return found
+
+
+def band_paths(path, bands, template=BAND_TEMPLATE):
+    """/vsitar/ paths of the bands of a bundle, in order"""
+    found = band_members(path, template)
+    missing = [b for b in bands if b not in found]
+    if missing:
+        raise ValueError('%s has no member matching %s for band(s) %s'
+                         % (path, template,
+                            ', '.join(str(b) for b in missing)))
+
+    return [found[b] for b in bands]
+
+
+def resolve(src_paths, src_mtl, bands, template=BAND_TEMPLATE):
+    """
+    Band paths and MTL of a job, looking inside a bundle if given one
+
+    Parameters
+    -----------
+    src_paths: string or list
+        band files, or a single bundle
+    src_mtl: string
+        MTL file, or the bundle (None when src_paths is a bundle)
+    bands: list
+        L8 band numbers to read from the bundle
+    template: string
+        band member template (see band_members)
+
+    Returns
+    --------
+    (src_paths, src_mtl)
+        src_mtl may be a bundle, which toa_utils._load_mtl reads
+    """
+    paths = toa_utils._as_list(src_paths)
+    if len(paths) == 1 and is_bundle(paths[0]):
+        if src_mtl is None:
+            src_mtl = paths[0]
+        paths = band_paths(paths[0], toa_utils._as_list(bands), template)
+    elif any(is_bundle(p) for p in paths):
+        raise ValueError('a bundle must be the only input path')
+
+    if src_mtl is None:
+        raise ValueError('src_mtl is required unless reading a bundle')
+
+    return paths, src_mtl
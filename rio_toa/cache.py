@@ -0,0 +1,275 @@
+"""Content-addressed cache of finished outputs.
+
+A job's key hashes the identity of its inputs (path, size and mtime of
+local files), the worker it runs, its destination profile and its
+global_args, which hold the MTL coefficients, dtype, rescale factor,
+clip, sun angle mode and so on, together with the rio-toa version. A job
+whose key is cached is served by linking or copying the stored output.
+Jobs with remote inputs (URLs and /vsi paths other than members of local
+bundles) are not cached, as changes to them would not change the key.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import rio_toa
+from rio_toa import bundle
+
+
+# files stored and restored along with an output
+SIDECARS = ('.aux.xml', )
+
+
+def parse_size(value):
+    """
+    Parse a size like 500M or 20G to bytes
+
+    Parameters
+    -----------
+    value: string or int
+
+    Returns
+    --------
+    int
+    """
+    if isinstance(value, int):
+        return value
+
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$',
+                     str(value).upper())
+    if not match:
+        raise ValueError('invalid size %r' % (value, ))
+
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(unit or ' '))
+
+
+def _canonical(obj):
+    if isinstance(obj, dict):
+        return dict((str(k), _canonical(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    elif isinstance(obj, np.ndarray):
+        return {'shape': list(obj.shape), 'dtype': obj.dtype.str,
+                'sha256': hashlib.sha256(
+                    np.ascontiguousarray(obj).tobytes()).hexdigest()}
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, type):
+        return obj.__name__
+    elif isinstance(obj, float) and obj != obj:
+        return 'nan'
+    elif obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    elif hasattr(obj, 'to_wkt'):
+        return obj.to_wkt()
+    else:
+        return repr(obj)
+
+
+def is_local(path):
+    """Whether path is a local file, or a member of a local bundle,
+    whose changes input_identity sees"""
+    member = bundle.split_vsi_path(path)
+    if member is not None:
+        return is_local(member[0])
+    return os.path.isfile(path)
+
+
+def input_identity(path):
+    """(path, size, mtime) of a local file, or of the bundle holding a
+    /vsitar/ member, the path alone otherwise"""
+    member = bundle.split_vsi_path(path)
+    if member is not None:
+        return input_identity(member[0]) + [member[1]]
+
+    if os.path.exists(path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+    return [path]
+
+
+def job_key(product, inpaths, options, global_args):
+    """
+    Hash everything that determines a job's output
+
+    Parameters
+    -----------
+    product: string
+        name of the worker function
+    inpaths: list
+    options: dict
+        destination profile
+    global_args: dict
+
+    Returns
+    --------
+    string
+        hex digest
+    """
+    job = {'version': rio_toa.__version__,
+           'product': product,
+           'inputs': [input_identity(p) for p in inpaths],
+           'options': _canonical(options),
+           'global_args': _canonical(global_args)}
+
+    return hashlib.sha256(
+        json.dumps(job, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class OutputCache(object):
+    """Outputs stored under path by job key, evicted least recently
+    used first once they exceed max_bytes.
+
+    Parameters
+    ----------
+    path : str
+        cache directory, created when needed
+    max_bytes : int
+        size limit (Default: unlimited)
+    link : bool
+        hard link hits into place instead of copying them, when on the
+        same file system
+    """
+
+    def __init__(self, path, max_bytes=None, link=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.link = link
+
+    def _object(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def fetch(self, key, dst_path):
+        """Place the output cached under key at dst_path; returns
+        False on a miss"""
+        obj = self._object(key)
+        if not os.path.exists(obj):
+            return False
+
+        if os.path.lexists(dst_path):
+            os.remove(dst_path)
+
+        try:
+            if not self.link:
+                raise OSError('copying')
+            os.link(obj, dst_path)
+        except OSError:
+            shutil.copyfile(obj, dst_path)
+
+        for suffix in SIDECARS:
+            if os.path.lexists(dst_path + suffix):
+                os.remove(dst_path + suffix)
+            if os.path.exists(obj + suffix):
+                shutil.copyfile(obj + suffix, dst_path + suffix)
+
+        # mtime tracks last use for eviction
+        os.utime(obj, None)
+        return True
+
+    def store(self, key, src_path, info=None):
+        """Copy src_path into the cache under key, then evict"""
+        obj = self._object(key)
+        objdir = os.path.dirname(obj)
+        if not os.path.isdir(objdir):
+            os.makedirs(objdir)
+
+        fd, tmp = tempfile.mkstemp(dir=objdir, prefix='.tmp.')
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, tmp)
+            with open(tmp + '.json', 'w') as f:
+                json.dump(dict(info or {}, created=time.time()), f)
+            os.rename(tmp + '.json', obj + '.json')
+            for suffix in SIDECARS:
+                if os.path.exists(src_path + suffix):
+                    shutil.copyfile(src_path + suffix, tmp + suffix)
+                    os.rename(tmp + suffix, obj + suffix)
+                elif os.path.exists(obj + suffix):
+                    os.remove(obj + suffix)
+            # the output itself goes last: its presence marks a hit
+            os.rename(tmp, obj)
+        finally:
+            for path in (tmp, tmp + '.json') + tuple(
+                    tmp + suffix for suffix in SIDECARS):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def entries(self):
+        """
+        List cached outputs, least recently used first
+
+        Returns
+        --------
+        list
+            dicts with key, path, size, used (mtime) and the info stored
+            with the output
+        """
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+
+        for prefix in os.listdir(self.path):
+            objdir = os.path.join(self.path, prefix)
+            if not os.path.isdir(objdir):
+                continue
+            for name in os.listdir(objdir):
+                if name.startswith('.') or name.endswith('.json') or \
+                        name.endswith(SIDECARS):
+                    continue
+                obj = os.path.join(objdir, name)
+                stat = os.stat(obj)
+                try:
+                    with open(obj + '.json') as f:
+                        info = json.load(f)
+                except (IOError, ValueError):
+                    info = {}
+                entries.append({'key': name, 'path': obj,
+                                'size': stat.st_size,
+                                'used': stat.st_mtime, 'info': info})
+
+        return sorted(entries, key=lambda e: e['used'])
+
+    def remove(self, key):
+        obj = self._object(key)
+        for path in (obj, obj + '.json') + tuple(
+                obj + suffix for suffix in SIDECARS):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def evict(self, max_bytes):
+        """
+        Remove least recently used outputs until the cache holds at
+        most max_bytes
+
+        Returns
+        --------
+        list
+            removed keys
+        """
+        entries = self.entries()
+        total = sum(e['size'] for e in entries)
+        removed = []
+
+        for e in entries:
+            if total <= max_bytes:
+                break
+            self.remove(e['key'])
+            total -= e['size']
+            removed.append(e['key'])
+
+        return removed
+
+    def clear(self):
+        """Remove every cached output"""
+        return self.evict(0)
@@ -0,0 +1,120 @@
+"""Color operations on 0..1 reflectance, as applied for visual products.
+
+The operations follow rio-color's: gamma, sigmoidal contrast and
+saturation, given as a string like "gamma 1.1 sigmoidal 10 0.15
+saturation 1.3" and applied in order to every band. They are plain
+vectorized numpy expressions over a window's (bands, rows, cols) array,
+so they run in the workers right after the reflectance kernel.
+"""
+import numpy as np
+
+
+# operation: number of arguments
+OPERATIONS = {'gamma': 1, 'sigmoidal': 2, 'saturation': 1}
+
+# Rec. 709 luma weights of red, green and blue
+LUMA = (0.2126, 0.7152, 0.0722)
+
+
+def gamma(arr, g):
+    """Gamma adjustment; g > 1 brightens the midtones"""
+    if g <= 0:
+        raise ValueError('gamma must be positive, got %s' % g)
+    return np.power(arr, 1.0 / g)
+
+
+def sigmoidal(arr, contrast, bias):
+    """
+    Sigmoidal contrast, keeping 0 at 0 and 1 at 1
+
+    Parameters
+    -----------
+    arr: ndarray
+        0..1 values
+    contrast: float
+        steepness of the curve; 0 leaves arr unchanged
+    bias: float
+        0..1 midpoint of the curve
+
+    Returns
+    --------
+    ndarray
+    """
+    if contrast == 0:
+        return arr
+    if not 0 <= bias <= 1:
+        raise ValueError('sigmoidal bias must be in 0..1, got %s' % bias)
+
+    low = 1 / (1 + np.exp(contrast * bias))
+    high = 1 / (1 + np.exp(contrast * (bias - 1)))
+    return (1 / (1 + np.exp(contrast * (bias - arr))) - low) / (high - low)
+
+
+def saturation(rgb, proportion):
+    """Scale the difference of each of red, green and blue from the
+    pixel's luma by proportion; 1 leaves rgb unchanged"""
+    if rgb.shape[0] != 3:
+        raise ValueError('saturation needs 3 (RGB) bands, got %d'
+                         % rgb.shape[0])
+    luma = np.tensordot(LUMA, rgb, axes=1)
+    return luma + (rgb - luma) * proportion
+
+
+def parse_operations(operations):
+    """
+    Parse a rio-color style operations string
+
+    Parameters
+    -----------
+    operations: string
+        e.g. "gamma 1.1 sigmoidal 10 0.15 saturation 1.3"
+
+    Returns
+    --------
+    list
+        (operation, args) tuples, in order
+    """
+    tokens = operations.split()
+    parsed = []
+    while tokens:
+        name = tokens.pop(0).lower()
+        if name not in OPERATIONS:
+            raise ValueError('unknown color operation %r, expected one of '
+                             '%s' % (name, ', '.join(sorted(OPERATIONS))))
+        nargs = OPERATIONS[name]
+        try:
+            args = tuple(float(t) for t in tokens[:nargs])
+        except ValueError:
+            args = ()
+        if len(args) != nargs:
+            raise ValueError('%s takes %d numeric argument(s)'
+                             % (name, nargs))
+        del tokens[:nargs]
+        parsed.append((name, args))
+
+    return parsed
+
+
+def apply_operations(arr, operations):
+    """
+    Apply parsed operations to reflectance, clipped to 0..1 first and
+    after every operation
+
+    Parameters
+    -----------
+    arr: ndarray
+        (bands, rows, cols) reflectance
+    operations: list
+        (operation, args) tuples from parse_operations
+
+    Returns
+    --------
+    ndarray
+    """
+    arr = np.clip(arr, 0.0, 1.0)
+    funcs = {'gamma': gamma, 'sigmoidal': sigmoidal,
+             'saturation': saturation}
+    for name, args in operations:
+        arr = np.clip(funcs[name](arr, *args), 0.0, 1.0)
+
+    return arr
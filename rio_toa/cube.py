@@ -0,0 +1,248 @@
+"""Multi-temporal TOA reflectance stacks.
+
+Scenes of one WRS path/row on a common grid are computed together,
+window by window: each window of every date is read once, and the
+reflectance kernel runs once over the (dates x bands) stack, with the
+per-date MTL coefficients and sun elevations laid out along the band
+axis. The output has one band per date and band, date-major and sorted
+by acquisition time.
+"""
+import os
+import re
+
+import numpy as np
+import rasterio
+from rasterio.coords import BoundingBox
+from rasterio import warp
+from rasterio import windows
+
+from rio_toa import band_stats
+from rio_toa import bundle
+from rio_toa import sun_utils
+from rio_toa import toa_utils
+from rio_toa.executor import Executor
+from rio_toa.kernels import reflectance
+
+
+BAND_TEMPLATE = '{prefix}_B{b}.TIF'
+
+
+def scene_paths(src_mtl, bands, template=BAND_TEMPLATE):
+    """
+    Band file paths of a scene, from its MTL path
+
+    Parameters
+    -----------
+    src_mtl: string
+        path of a *_MTL.txt or *_MTL.json file, or of a USGS .tar.gz
+        bundle, whose band members are found with
+        rio_toa.bundle.BAND_TEMPLATE instead of template
+    bands: list
+        L8 band numbers
+    template: string
+        formatted with prefix (the MTL path without _MTL.*), dir (its
+        directory), scene (its scene id) and b (the band number)
+
+    Returns
+    --------
+    list
+    """
+    if bundle.is_bundle(src_mtl):
+        return bundle.band_paths(src_mtl, bands)
+
+    prefix = re.sub(r'_MTL\.(txt|json)$', '', src_mtl, flags=re.I)
+    return [template.format(prefix=prefix,
+                            dir=os.path.dirname(src_mtl) or '.',
+                            scene=os.path.basename(prefix), b=b)
+            for b in bands]
+
+
+def _load_scene(src_paths, src_mtl, bands):
+    metadata = toa_utils._load_mtl(src_mtl)['L1_METADATA_FILE']
+    rescaling = metadata['RADIOMETRIC_RESCALING']
+
+    return {
+        'src_paths': list(src_paths),
+        'M': [rescaling['REFLECTANCE_MULT_BAND_{}'.format(b)]
+              for b in bands],
+        'A': [rescaling['REFLECTANCE_ADD_BAND_{}'.format(b)]
+              for b in bands],
+        'E': metadata['IMAGE_ATTRIBUTES']['SUN_ELEVATION'],
+        'date': metadata['PRODUCT_METADATA']['DATE_ACQUIRED'],
+        'time': metadata['PRODUCT_METADATA']['SCENE_CENTER_TIME'],
+        'scene': metadata.get('METADATA_FILE_INFO', {}).get(
+            'LANDSAT_SCENE_ID', os.path.basename(src_mtl))}
+
+
+def _check_grid(src_paths):
+    grid = None
+    src_counts = []
+    for path in src_paths:
+        with rasterio.open(path) as src:
+            src_counts.append(src.count)
+            this = (src.crs, src.transform, src.width, src.height)
+            if grid is None:
+                grid, profile = this, src.profile.copy()
+                src_nodata, src_dtype = src.nodata, src.dtypes[0]
+            elif this != grid:
+                raise ValueError('%s is not on the grid of %s'
+                                 % (path, src_paths[0]))
+
+    return profile, src_counts, src_nodata, src_dtype
+
+
+def _cube_worker(open_files, window, ij, g_args):
+    """Reflectance of every date and band of a window, as one
+    (dates * bands, rows, cols) stack"""
+    data = toa_utils._read_window(open_files, g_args['read_plan'],
+                                  window, g_args['src_dtype'])
+    depth, rows, cols = data.shape
+
+    if g_args['src_nodata'] is not None and \
+            np.all(data == g_args['src_nodata']):
+        return np.zeros(data.shape, dtype=g_args['dst_dtype'])
+
+    if g_args['pixel_sunangle']:
+        bbox = BoundingBox(
+            *warp.transform_bounds(
+                g_args['src_crs'],
+                {'init': u'epsg:4326'},
+                *windows.bounds(window, g_args['src_transform'])))
+
+        # (rows, cols, dates), repeated for each band of a date
+        E = np.repeat(np.dstack([
+            sun_utils.sun_elevation(bbox, (rows, cols), date, time)
+            for date, time in zip(g_args['dates'], g_args['times'])]),
+            g_args['bands'], axis=2)
+    else:
+        E = g_args['E']
+
+    return toa_utils.rescale(
+        reflectance(data, g_args['M'], g_args['A'], E, g_args['src_nodata']),
+        g_args['rescale_factor'],
+        g_args['dst_dtype'],
+        clip=g_args['clip'])
+
+
+def calculate_landsat_reflectance_cube(scenes, dst_path, rescale_factor,
+                                       creation_options, bands, dst_dtype,
+                                       processes, pixel_sunangle=False,
+                                       clip=True, shard=None, cache=None,
+                                       stats=False, aux_xml=False,
+                                       driver=None, scale_offset=False):
+    """
+    Parameters
+    ------------
+    scenes: list
+        (src_paths, src_mtl) of every date, where src_paths are single
+        band or stacked files holding bands, on a common grid
+    dst_path: string
+    rescale_factor: float
+    creation_options: dict
+    bands: list
+        L8 band numbers of every input band of a scene, in order
+    dst_dtype: string
+    processes: integer
+    pixel_sunangle: boolean
+    clip: boolean
+    shard: tuple
+        (i, n) to compute only shard i of n as a partial output, to be
+        assembled with rio_toa.shards.merge_shards
+    cache: rio_toa.cache.OutputCache
+        serve the output from this cache when the same job ran before
+    stats: boolean
+        accumulate per-band statistics and histograms while computing,
+        and write them to the output's band metadata
+    aux_xml: boolean
+        also write the statistics and histograms to a .aux.xml
+    driver: string
+        output format, "GTiff", "Zarr" (see rio_toa.zarr_output) or
+        "VRT" over per-window tiles (see rio_toa.tiles)
+        (Default: the inputs')
+    scale_offset: boolean
+        also write the conversion of stored values back to TOA units as
+        the bands' scale and offset; Zarr outputs always keep it, as
+        scale_factor and add_offset attributes
+
+    Returns
+    ---------
+    list
+        per band statistics (see rio_toa.band_stats.BandStats.result),
+        or None without stats; output is written to dst_path, with
+        bands ordered by date, then band, and tagged with both
+    """
+    if not scenes:
+        raise ValueError('no scenes to stack')
+
+    scenes = sorted((_load_scene(paths, mtl, bands) for paths, mtl in scenes),
+                    key=lambda s: (s['date'], s['time']))
+
+    src_paths = [p for s in scenes for p in s['src_paths']]
+    dst_profile, src_counts, src_nodata, src_dtype = _check_grid(src_paths)
+
+    read_plan = []
+    offset = 0
+    for s in scenes:
+        count = len(s['src_paths'])
+        read_plan.extend(
+            (offset + i, indexes) for i, indexes in toa_utils._read_plan(
+                src_counts[offset:offset + count], bands))
+        offset += count
+
+    rescale_factor = toa_utils.normalize_scale(rescale_factor, dst_dtype)
+    dst_dtype = np.__dict__[dst_dtype]
+
+    for co in creation_options:
+        dst_profile[co] = creation_options[co]
+    if 'blockxsize' not in creation_options and \
+            dst_profile['width'] >= 256 and dst_profile['height'] >= 256:
+        dst_profile.update(tiled=True, blockxsize=256, blockysize=256)
+    dst_profile.update(dtype=dst_dtype, count=len(scenes) * len(bands),
+                       photometric='minisblack')
+    if driver:
+        dst_profile['driver'] = driver
+
+    global_args = {
+        'M': np.array([m for s in scenes for m in s['M']]),
+        'A': np.array([a for s in scenes for a in s['A']]),
+        'E': np.repeat([s['E'] for s in scenes], len(bands)),
+        'dates': [s['date'] for s in scenes],
+        'times': [s['time'] for s in scenes],
+        'src_nodata': src_nodata,
+        'src_crs': dst_profile['crs'],
+        'src_transform': dst_profile['transform'],
+        'dst_dtype': dst_dtype,
+        'rescale_factor': rescale_factor,
+        'clip': clip,
+        'pixel_sunangle': pixel_sunangle,
+        'bands': len(bands),
+        'read_plan': read_plan,
+        'src_dtype': src_dtype
+    }
+
+    tags = {'TOA_DATES': ','.join(str(s['date']) for s in scenes),
+            'TOA_BANDS': ','.join(str(b) for b in bands)}
+    band_tags = [{'TOA_DATE': str(s['date']), 'TOA_BAND': str(b),
+                  'TOA_SCENE': s['scene']}
+                 for s in scenes for b in bands]
+
+    with Executor(src_paths,
+                  dst_path,
+                  _cube_worker,
+                  options=dst_profile,
+                  global_args=global_args,
+                  mode='manual_read',
+                  shard=shard,
+                  cache=cache,
+                  stats=band_stats.hist_range(dst_dtype, (0, rescale_factor))
+                  if stats else None,
+                  aux_xml=aux_xml,
+                  tags=tags,
+                  band_tags=band_tags,
+                  scale_offset=toa_utils.scale_offset(rescale_factor)
+                  if scale_offset or dst_profile['driver'] == 'Zarr'
+                  else None) as rm:
+
+        rm.run(processes)
+
+    return rm.band_stats
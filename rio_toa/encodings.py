@@ -0,0 +1,135 @@
+"""Several output encodings of one product, computed in one pass.
+
+Workers compute a product once per window, in float TOA units, and the
+writer encodes it to every output with toa_utils.rescale: each output is
+a (path, dtype, rescale_factor, clip) encoding, e.g. a float32 analysis
+product and a uint8 visual product of the same reflectance. Per-band
+statistics are accumulated for each output from its own encoded values.
+"""
+import numpy as np
+import rasterio
+
+from rio_toa import band_stats
+from rio_toa import toa_utils
+
+
+DTYPES = ('uint16', 'uint8', 'float32')
+
+_CLIP = {'clip': True, 'true': True, '1': True,
+         'noclip': False, 'false': False, '0': False}
+
+
+def parse_output(spec):
+    """
+    Parse a PATH:DTYPE:RESCALE:CLIP output specification
+
+    Parameters
+    -----------
+    spec: string
+        e.g. "visual.tif:uint8:255:clip" or "toa.tif:float32::noclip";
+        an empty RESCALE is the dtype's default rescale factor
+
+    Returns
+    --------
+    (path, dtype, rescale_factor, clip): tuple
+    """
+    parts = spec.rsplit(':', 3)
+    if len(parts) != 4 or not parts[0]:
+        raise ValueError('%r is not PATH:DTYPE:RESCALE:CLIP' % (spec, ))
+    path, dtype, rescale_factor, clip = parts
+
+    if dtype not in DTYPES:
+        raise ValueError('%r: DTYPE must be one of %s'
+                         % (spec, ', '.join(DTYPES)))
+    if clip.lower() not in _CLIP:
+        raise ValueError('%r: CLIP must be clip or noclip' % (spec, ))
+    try:
+        rescale_factor = float(rescale_factor) if rescale_factor else None
+    except ValueError:
+        raise ValueError('%r: RESCALE must be a number' % (spec, ))
+
+    return (path, dtype, toa_utils.normalize_scale(rescale_factor, dtype),
+            _CLIP[clip.lower()])
+
+
+class EncodingWriter(object):
+    """Encodes each window of a float product to several outputs, with
+    the parts of rasterio's writer interface the Executor uses. Each
+    output gets the profile's tags and, optionally, its own scale and
+    offset and band statistics of its own values.
+
+    Parameters
+    ----------
+    outputs : list
+        (path, dtype, rescale_factor, clip) encodings
+    profile : dict
+        destination profile, but for the dtype
+    windows : list
+        [window, ij] pairs of the job
+    stats : bool
+        accumulate per-band statistics of every output
+    scale_offset : bool
+        write the conversion of each output's values back to TOA units
+        as its bands' scale and offset
+    """
+
+    def __init__(self, outputs, profile, windows, stats=False,
+                 scale_offset=False):
+        self.outputs = list(outputs)
+        self.nodata = profile.get('nodata')
+        self.dsts = []
+        self.accumulators = None
+        self.band_stats = None
+
+        for path, dtype, rescale_factor, clip in self.outputs:
+            dst = rasterio.open(path, 'w', **dict(profile, dtype=dtype))
+            self.dsts.append(dst)
+            conversion = toa_utils.scale_offset(rescale_factor)
+            if scale_offset and conversion is not None:
+                dst.scales = [conversion[0]] * profile['count']
+                dst.offsets = [conversion[1]] * profile['count']
+
+        if stats:
+            pixels = sum(int(np.prod(toa_utils._window_shape(w)))
+                         for w, _ in windows)
+            self.accumulators = [
+                band_stats.BandStats(
+                    profile['count'], pixels,
+                    bounds=band_stats.hist_range(dtype, (0, rescale_factor)))
+                for _, dtype, rescale_factor, _ in self.outputs]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.close()
+
+    def write(self, arr, window=None):
+        for i, (_, dtype, rescale_factor, clip) in enumerate(self.outputs):
+            out = toa_utils.rescale(arr, rescale_factor, getattr(np, dtype),
+                                    clip=clip)
+            self.dsts[i].write(out, window=window)
+            if self.accumulators is not None:
+                self.accumulators[i].add(band_stats.window_stats(
+                    out, nodata=self.nodata,
+                    bounds=self.accumulators[i].bounds))
+
+    def update_tags(self, bidx=0, **tags):
+        for dst in self.dsts:
+            dst.update_tags(bidx, **tags)
+
+    def close(self):
+        if self.accumulators is not None and self.band_stats is None:
+            self.band_stats = [acc.result() for acc in self.accumulators]
+            for dst, stats in zip(self.dsts, self.band_stats):
+                band_stats.write_stats(dst, stats)
+        for dst in self.dsts:
+            dst.close()
+
+
+def writer(outputs, stats=False, scale_offset=False):
+    """Executor writer factory encoding to outputs"""
+    def create(path, profile, windows):
+        return EncodingWriter(outputs, profile, windows, stats,
+                              scale_offset)
+    return create
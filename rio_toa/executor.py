@@ -0,0 +1,574 @@
+"""A riomucho.RioMucho compatible window executor.
+
+Workers open the inputs once, compute each window and, when
+multiprocessing.shared_memory is available, copy the result into a
+slot of a shared memory ring buffer instead of pickling it back to the
+writer. The writer reads the slot in place and returns it to the ring.
+Large arrays in global_args are published once through
+rio_toa.shared_state and attached by name in each worker. Windows are
+handed out one at a time, most expensive first (see rio_toa.schedule).
+
+Outputs are rasterio datasets, or writers made by a writer factory (see
+output_writer) for the kinds of output written some other way.
+"""
+import functools
+import logging
+from multiprocessing import Pool
+import os
+import threading
+import time
+
+import numpy as np
+import rasterio
+import riomucho
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from rio_toa import band_stats
+from rio_toa import cache as output_cache
+from rio_toa import memmap_reader
+from rio_toa import preview as toa_preview
+from rio_toa import reproject
+from rio_toa import s3_output
+from rio_toa import schedule
+from rio_toa import shared_state
+from rio_toa import shards
+from rio_toa import tiles
+from rio_toa import toa_utils
+from rio_toa import zarr_output
+from rio_toa.prefetch import Prefetcher
+
+logger = logging.getLogger(__name__)
+
+_srcs = None
+_global_args = None
+_slots = None
+_shm = None
+_dst = None
+
+# writer factories of output drivers that rasterio does not write
+WRITERS = {'Zarr': zarr_output.create, 'VRT': tiles.create}
+
+
+def output_writer(path, driver=None):
+    """
+    Writer factory of an output, or None for a rasterio dataset
+
+    A writer factory is called with (path, profile, windows) and returns
+    a writer with write(arr, window), update_tags(bidx, **tags),
+    set_scale_offset(scale, offset) and close(). Optionally, the writer
+    has a reopen() that opens it again in a worker, which then writes
+    its windows itself, and a band_stats attribute holding statistics it
+    kept. The factory may have a windows(profile) function, giving the
+    output's default windows, and ordered = True when the writer needs
+    the windows in that order.
+
+    Parameters
+    -----------
+    path: string
+    driver: string
+
+    Returns
+    --------
+    function or None
+    """
+    if s3_output.is_s3_uri(path):
+        if driver in WRITERS:
+            raise ValueError('%s outputs cannot be streamed to %s'
+                             % (driver, path))
+        return s3_output.create
+
+    return WRITERS.get(driver)
+
+
+def open_input(path, preview=None, warp=None):
+    """
+    Open an input as workers read it
+
+    Parameters
+    -----------
+    path: string
+    preview: int
+        preview scale (see rio_toa.preview)
+    warp: dict
+        destination grid (see rio_toa.reproject.warp_options); takes
+        precedence over preview, whose grid it already is
+
+    Returns
+    --------
+    dataset with a rasterio compatible read()
+    """
+    if warp:
+        return reproject.open_dataset(path, warp)
+    elif preview:
+        return toa_preview.open_dataset(path, preview)
+    else:
+        return memmap_reader.open_dataset(path)
+
+
+def _init_worker(inpaths, g_args, shm_name=None, slot_bytes=0, nslots=0,
+                 preview=None, warp=None, reopen=None):
+    global _srcs, _global_args, _shm, _slots, _dst
+    _global_args = shared_state.attach(g_args)
+    _srcs = [open_input(p, preview, warp) for p in inpaths]
+    _dst = reopen() if reopen is not None else None
+
+    if shm_name is not None:
+        _shm = shared_memory.SharedMemory(name=shm_name)
+        _slots = _slot_views(_shm, slot_bytes, nslots)
+
+
+def _close_worker():
+    """Close what _init_worker opened, when it ran in this process"""
+    global _srcs, _global_args, _shm, _slots, _dst
+    _global_args = None
+    for src in _srcs or []:
+        close = getattr(src, 'close', None)
+        if close is not None:
+            close()
+    if _shm is not None:
+        _slots = None
+        _shm.close()
+    shared_state.detach()
+    _srcs = _shm = _dst = None
+
+
+def _slot_views(shm, slot_bytes, nslots):
+    buf = np.ndarray((nslots, slot_bytes), dtype=np.uint8, buffer=shm.buf)
+    return [buf[i] for i in range(nslots)]
+
+
+def _read(mode, window):
+    if mode == 'manual_read':
+        return _srcs
+    elif mode == 'array_read':
+        return riomucho.utils.array_stack(
+            [src.read(window=window) for src in _srcs])
+    else:
+        return [src.read(window=window) for src in _srcs]
+
+
+class _task(object):
+    def __init__(self, user_func, mode, stats=None):
+        self.user_func = user_func
+        self.mode = mode
+        self.stats = stats
+
+    def __call__(self, args):
+        window, ij, slot, data = args
+        start = time.time()
+        if data is None:
+            data = _read(self.mode, window)
+
+        out = self.user_func(data, window, ij, _global_args)
+        partials = None
+        if self.stats is not None:
+            partials = band_stats.window_stats(out, **self.stats)
+        elapsed = time.time() - start
+
+        if _dst is not None:
+            # the window is written here, not by the parent
+            _dst.write(out, window)
+            return None, window, slot, elapsed, partials
+
+        if slot is None or out.nbytes > _slots[slot].size:
+            return out, window, slot, elapsed, partials
+
+        out = np.ascontiguousarray(out)
+        _slots[slot][:out.nbytes] = out.reshape(-1).view(np.uint8)
+        return (out.shape, out.dtype.str), window, slot, elapsed, partials
+
+
+class Executor(object):
+    """Maps a riomucho style worker over the windows of the inputs
+    and writes the results to outpath.
+
+    Parameters
+    ----------
+    inpaths : list of str
+    outpath : str
+    run_function : function
+        worker with signature (data, window, ij, global_args)
+    mode : str
+        one of riomucho's "simple_read", "manual_read", "array_read"
+    windows : list
+        [window, ij] pairs (Default: the writer's windows, whole output
+        tiles for JPEG or WEBP compressed outputs, or block windows of
+        the first input)
+    options : dict
+        destination profile (Default: profile of the first input)
+    global_args : dict
+    prefetch : int
+        when > 0, windows are read ahead in the parent by a
+        rio_toa.prefetch.Prefetcher and handed to simple_read workers
+    schedule : str
+        "cost" hands windows to a worker pool most expensive first,
+        when the first input has overviews to estimate costs from;
+        "row" keeps row-major order. Prefetched runs always read in
+        row-major order so that reads coalesce.
+    shard : tuple
+        (i, n) to compute only shard i of n (see rio_toa.shards) and
+        write it as a partial output
+    cache : rio_toa.cache.OutputCache
+        serve the output from, and store it in, this cache
+    stats : tuple
+        (min, max) histogram range to accumulate per-band statistics
+        over; they are written to the output's band metadata
+    aux_xml : bool
+        also write the statistics and histograms to a .aux.xml sidecar
+    tags : dict
+        dataset tags to write to the output
+    band_tags : list
+        tags to write to each band of the output
+    scale_offset : tuple or bool
+        (scale, offset) converting stored values to TOA units, written
+        as the bands' scale and offset, or True to take them from
+        global_args' rescale_factor and stretch
+    auto_rescale : tuple
+        (percentiles, fraction) to derive global_args' stretch from a
+        sample of the scene, on a cache miss (see rio_toa.stretch)
+    preview : int
+        read the inputs at 1/preview of their resolution; options must
+        then be the preview's profile (see rio_toa.preview), and windows
+        default to rio_toa.preview.preview_windows of it
+    warp : dict
+        read the inputs reprojected to this destination grid (see
+        rio_toa.reproject.warp_options), which options must describe;
+        windows default to rio_toa.preview.preview_windows of it
+    writer : function
+        writer factory (see output_writer) to use instead of the
+        output's
+    first_src : dataset
+        open dataset of the first input, to take the default windows and
+        window costs from instead of opening it again
+
+    After run(), stats holds the rio_toa.schedule.latency_summary of
+    the per-window read and compute times, and band_stats the
+    rio_toa.band_stats.BandStats result when stats was given.
+    """
+
+    def __init__(self, inpaths, outpath, run_function, mode='simple_read',
+                 windows=None, options=None, global_args=None, prefetch=0,
+                 schedule='cost', shard=None, cache=None, stats=None,
+                 aux_xml=False, tags=None, band_tags=None, preview=None,
+                 warp=None, scale_offset=None, writer=None,
+                 first_src=None, auto_rescale=None):
+        if mode not in ['simple_read', 'manual_read', 'array_read']:
+            raise ValueError('mode must be one of: '
+                             '["simple_read", "manual_read", "array_read"]')
+        if schedule not in ['cost', 'row']:
+            raise ValueError('schedule must be one of: ["cost", "row"]')
+
+        self.inpaths = list(inpaths)
+        self.outpath = outpath
+        self.run_function = run_function
+        self.mode = mode
+        self.options = options or riomucho.utils.getOptions(self.inpaths[0])
+        self.preview = preview
+        self.warp = warp
+        self.writer = writer or output_writer(outpath,
+                                              self.options.get('driver'))
+        self.ordered = getattr(self.writer, 'ordered', False)
+        if windows:
+            self.windows = windows
+        elif hasattr(self.writer, 'windows'):
+            self.windows = self.writer.windows(self.options)
+        elif toa_preview.lossy(self.options):
+            # partly written tiles would be decoded and encoded again
+            self.windows = toa_preview.preview_windows(
+                self.options, toa_preview.tile_multiple(self.options))
+        elif preview or warp:
+            self.windows = toa_preview.preview_windows(self.options)
+        elif first_src is not None:
+            self.windows = [[window, ij]
+                            for ij, window in first_src.block_windows()]
+        else:
+            self.windows = riomucho.utils.getWindows(self.inpaths[0])
+        self.global_args = global_args or {}
+        self.prefetch = prefetch
+        self.schedule = schedule
+        self.cache = cache
+        self.hist_range = stats
+        self.aux_xml = aux_xml
+        self.stats = None
+        self.band_stats = None
+        self.row_start = 0
+        self.tags = dict(tags or {})
+        self.band_tags = band_tags or []
+        self.scale_offset = scale_offset
+        self.auto_rescale = auto_rescale
+        self.first_src = first_src if first_src is not None else \
+            self.inpaths[0]
+
+        if self.writer is not None and shard is not None:
+            raise ValueError('%s: only rasterio outputs can be sharded'
+                             % outpath)
+        if self.writer is not None and cache is not None:
+            logger.warning('%s: only rasterio outputs are cached', outpath)
+            self.cache = None
+        if self.cache is not None and \
+                not all(output_cache.is_local(p) for p in self.inpaths):
+            logger.warning('%s: outputs of remote inputs are not cached',
+                           outpath)
+            self.cache = None
+
+        if shard is not None:
+            height = self.options['height']
+            self.windows, (self.row_start, row_stop) = \
+                shards.shard_windows(self.windows, *shard)
+            self.options = shards.shard_profile(self.options, self.row_start,
+                                                row_stop)
+            self.tags.update(shards.shard_tags(shard[0], shard[1],
+                                               self.row_start, row_stop,
+                                               height))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        pass
+
+    def cache_key(self):
+        """Key of this job's output in a rio_toa.cache.OutputCache"""
+        return output_cache.job_key(
+            '%s.%s' % (self.run_function.__module__,
+                       self.run_function.__name__),
+            self.inpaths,
+            dict(self.options, tags=self.tags, band_tags=self.band_tags,
+                 stats=self.hist_range,
+                 preview=self.preview, warp=self.warp,
+                 scale_offset=self.scale_offset,
+                 auto_rescale=self.auto_rescale,
+                 windows=[toa_utils._window_ranges(w)
+                          for w, _ in self.windows]),
+            self.global_args)
+
+    def _open_output(self):
+        if self.writer is not None:
+            return self.writer(self.outpath, self.options, self.windows)
+        return rasterio.open(self.outpath, 'w', **self.options)
+
+    def _write(self, dst, out, window):
+        if self.row_start:
+            window = shards.offset_window(window, self.row_start)
+        dst.write(out, window=window)
+
+    def _slot_bytes(self):
+        rows, cols = np.max([toa_utils._window_shape(w)
+                             for w, _ in self.windows], axis=0)
+        return int(rows * cols * self.options['count'] *
+                   np.dtype(self.options['dtype']).itemsize)
+
+    def _reads(self):
+        if self.prefetch:
+            opener = None
+            if self.preview or self.warp:
+                opener = functools.partial(open_input, preview=self.preview,
+                                           warp=self.warp)
+            with Prefetcher(self.inpaths, self.windows, self.prefetch,
+                            opener=opener) as reads:
+                for data, window, ij in reads:
+                    yield window, ij, data
+        else:
+            for window, ij in self.windows:
+                yield window, ij, None
+
+    def run(self, processes=4):
+        if self.cache is not None:
+            key = self.cache_key()
+            if self.cache.fetch(key, self.outpath):
+                logger.info('%s: served from cache %s', self.outpath, key)
+                if self.hist_range is not None:
+                    self.band_stats = band_stats.read_stats(self.outpath)
+                return
+
+            # never write through a hard link into a cached output
+            if os.path.exists(self.outpath) and \
+                    os.stat(self.outpath).st_nlink > 1:
+                os.remove(self.outpath)
+
+        # a stale sidecar would override the new output's metadata
+        if os.path.exists(band_stats.aux_path(self.outpath)):
+            os.remove(band_stats.aux_path(self.outpath))
+
+        if self.auto_rescale is not None:
+            self._derive_stretch()
+        if self.scale_offset is True:
+            self.scale_offset = toa_utils.scale_offset(
+                self.global_args['rescale_factor'],
+                self.global_args.get('stretch'))
+
+        self._run(processes)
+
+        if self.band_stats is not None and self.aux_xml and \
+                self.writer is None:
+            band_stats.write_aux_xml(self.outpath, self.band_stats)
+
+        if self.cache is not None:
+            self.cache.store(key, self.outpath,
+                             {'product': self.run_function.__name__,
+                              'inputs': self.inpaths,
+                              'output': self.outpath})
+
+    def _derive_stretch(self):
+        # rio_toa.stretch runs its sample through this module's workers
+        from rio_toa import stretch
+
+        percentiles, fraction = self.auto_rescale
+        self.global_args['stretch'], tags = stretch.derive_stretch(
+            self.inpaths, self.run_function, self.global_args,
+            mode=self.mode, percentiles=percentiles, fraction=fraction,
+            preview=self.preview, warp=self.warp)
+        self.tags.update(tags)
+
+    def _run(self, processes):
+        accumulator = None
+        task_stats = None
+        if self.hist_range is not None:
+            task_stats = {'nodata': self.options.get('nodata'),
+                          'bounds': self.hist_range}
+            accumulator = band_stats.BandStats(
+                self.options['count'],
+                sum(int(np.prod(toa_utils._window_shape(w)))
+                    for w, _ in self.windows),
+                bounds=self.hist_range)
+
+        task = _task(self.run_function, self.mode, task_stats)
+        seconds = []
+        start = time.time()
+
+        # costs are estimated from overviews, which inputs may lack
+        if processes > 1 and self.schedule == 'cost' and \
+                not self.prefetch and not self.preview and not self.warp \
+                and not self.ordered:
+            costs = schedule.window_costs(self.first_src, self.windows)
+            if costs is not None:
+                self.windows = schedule.order_windows(self.windows, costs)
+
+        with self._open_output() as dst:
+            if self.tags:
+                dst.update_tags(**self.tags)
+            for bidx, band_tags in enumerate(self.band_tags, 1):
+                dst.update_tags(bidx, **band_tags)
+            if self.scale_offset:
+                self._write_scale_offset(dst, *self.scale_offset)
+
+            if processes == 1:
+                _init_worker(self.inpaths, self.global_args,
+                             preview=self.preview, warp=self.warp)
+                try:
+                    for window, ij, data in self._reads():
+                        out, window, _, elapsed, partials = task(
+                            (window, ij, None, data))
+                        self._write(dst, out, window)
+                        seconds.append(elapsed)
+                        if accumulator is not None:
+                            accumulator.add(partials)
+                finally:
+                    _close_worker()
+            else:
+                self._run_pool(task, processes, dst, seconds, accumulator)
+
+            if accumulator is not None:
+                self.band_stats = accumulator.result()
+                band_stats.write_stats(dst, self.band_stats)
+
+        if accumulator is None:
+            self.band_stats = getattr(dst, 'band_stats', None)
+
+        self.stats = schedule.latency_summary(
+            seconds, time.time() - start, processes)
+        logger.info('%(path)s: %(count)d windows, p50 %(p50).3fs, '
+                    'p90 %(p90).3fs, p99 %(p99).3fs, max %(max).3fs, '
+                    'wall %(wall).2fs, utilization %(percent).0f%%',
+                    dict(self.stats, path=self.outpath,
+                         percent=100 * self.stats['utilization']))
+
+    def _write_scale_offset(self, dst, scale, offset):
+        if self.writer is not None:
+            dst.set_scale_offset(scale, offset)
+        else:
+            dst.scales = [scale] * self.options['count']
+            dst.offsets = [offset] * self.options['count']
+
+    def _run_pool(self, task, processes, dst, seconds, accumulator):
+        shm = None
+        reopen = getattr(dst, 'reopen', None)
+        nslots = 2 * processes + (self.prefetch or 0)
+        # the free slots also bound how far reads run ahead of writes
+        free = threading.Semaphore(nslots)
+        slots = list(range(nslots))
+        lock = threading.Lock()
+        # set on errors, so that a feeder waiting for a slot gives up
+        stop = threading.Event()
+
+        global_args, published = shared_state.publish(self.global_args)
+
+        if shared_memory is not None and reopen is None:
+            slot_bytes = self._slot_bytes()
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=slot_bytes * nslots)
+            views = _slot_views(shm, slot_bytes, nslots)
+            initargs = (self.inpaths, global_args,
+                        shm.name, slot_bytes, nslots, self.preview,
+                        self.warp, reopen)
+        else:
+            initargs = (self.inpaths, global_args, None, 0, 0, self.preview,
+                        self.warp, reopen)
+
+        def tasks():
+            for window, ij, data in self._reads():
+                free.acquire()
+                if stop.is_set():
+                    return
+                slot = None
+                if shm is not None:
+                    with lock:
+                        slot = slots.pop()
+                yield window, ij, slot, data
+
+        pool = Pool(processes, _init_worker, initargs)
+        try:
+            imap = pool.imap if self.ordered else pool.imap_unordered
+            for out, window, slot, elapsed, partials in imap(
+                    task, tasks(), chunksize=1):
+                seconds.append(elapsed)
+                if accumulator is not None:
+                    accumulator.add(partials)
+                if out is None:
+                    # written by the worker
+                    pass
+                elif isinstance(out, np.ndarray):
+                    # no slot, or the result did not fit in one
+                    self._write(dst, out, window)
+                else:
+                    shape, dtype = out
+                    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                    self._write(
+                        dst, views[slot][:nbytes].view(dtype).reshape(shape),
+                        window)
+
+                if slot is not None:
+                    with lock:
+                        slots.append(slot)
+                free.release()
+        except BaseException:
+            # terminate() joins the task feeder, which may be waiting
+            # for a free slot that no result will release any more
+            stop.set()
+            for _ in range(nslots):
+                free.release()
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+            published.close()
+            if shm is not None:
+                del views
+                shm.close()
+                shm.unlink()
@@ -0,0 +1,246 @@
+"""Zero-copy window reads of uncompressed GeoTIFFs.
+
+An uncompressed GeoTIFF is mapped into memory with numpy.memmap, and
+windows are returned as views of its strips or tiles instead of passing
+through GDAL's block cache. Any other
+input (compressed, sparse, remote, bit-packed) is opened with rasterio.
+"""
+import os
+
+import numpy as np
+import rasterio
+from rasterio.errors import RasterioError
+
+from rio_toa import toa_utils
+
+
+def _block_layout(src, bidx, nblocks_y, nblocks_x):
+    offsets = []
+    sizes = []
+    for y in range(nblocks_y):
+        for x in range(nblocks_x):
+            offset = src.get_tag_item('BLOCK_OFFSET_%d_%d' % (x, y), 'TIFF',
+                                      bidx=bidx)
+            size = src.get_tag_item('BLOCK_SIZE_%d_%d' % (x, y), 'TIFF',
+                                    bidx=bidx)
+            if not offset or not size:
+                raise ValueError('block %d, %d is sparse' % (x, y))
+            offsets.append(int(offset))
+            sizes.append(int(size))
+
+    return offsets, sizes
+
+
+class MemmapReader(object):
+    """Reads windows of an uncompressed GeoTIFF as views of a
+    numpy.memmap of the file. read() follows rasterio's signature.
+
+    Every strip or tile is a view at its offset in the file, so windows
+    within one block never copy. When the blocks of a striped file are
+    stored back to back, each band is a single view and any window is.
+
+    Raises ValueError when the file cannot be mapped.
+    """
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise ValueError('%s is not a local file' % path)
+
+        with open(path, 'rb') as f:
+            order = f.read(2)
+        if order not in (b'II', b'MM'):
+            raise ValueError('%s is not a TIFF' % path)
+
+        with rasterio.open(path) as src:
+            if src.driver != 'GTiff' or src.compression is not None:
+                raise ValueError('%s is not an uncompressed GeoTIFF' % path)
+            if len(set(src.dtypes)) != 1 or \
+                    src.tags(1, ns='IMAGE_STRUCTURE').get('NBITS'):
+                raise ValueError('%s has an unsupported sample layout'
+                                 % path)
+
+            self.name = path
+            self.count = src.count
+            self.width = src.width
+            self.height = src.height
+            self.dtypes = src.dtypes
+            self.nodata = src.nodata
+            self.profile = src.profile
+
+            dtype = np.dtype(src.dtypes[0]).newbyteorder(
+                '<' if order == b'II' else '>')
+            bh, bw = src.block_shapes[0]
+            self.block_shape = (bh, bw)
+            self.tiled = bw != src.width
+            ny = -(-src.height // bh)
+            nx = -(-src.width // bw)
+            pixel = src.count > 1 and \
+                src.tags(ns='IMAGE_STRUCTURE').get('INTERLEAVE') == 'PIXEL'
+
+            self._file = np.memmap(path, dtype=np.uint8, mode='r')
+            self._file = self._file.view(np.ndarray)
+            samples = src.count if pixel else 1
+
+            layouts = [_block_layout(src, 1, ny, nx)] if pixel else \
+                [_block_layout(src, bidx, ny, nx) for bidx in src.indexes]
+
+        blocks = [self._blocks(offsets, sizes, dtype, ny, nx, samples)
+                  for offsets, sizes in layouts]
+
+        # full planes, when the strips are stored back to back
+        full = [self._full(offsets, sizes, dtype, samples)
+                for offsets, sizes in layouts]
+
+        if pixel:
+            self._pixel_blocks = blocks[0]
+            self._pixel_full = full[0]
+            self._blocks_by_band = [
+                [[block[..., b] for block in row] for row in blocks[0]]
+                for b in range(self.count)]
+            self._full_by_band = [
+                None if full[0] is None else full[0][..., b]
+                for b in range(self.count)]
+        else:
+            self._pixel_blocks = self._pixel_full = None
+            self._blocks_by_band = blocks
+            self._full_by_band = full
+
+    def _blocks(self, offsets, sizes, dtype, ny, nx, samples):
+        bh, bw = self.block_shape
+        row_bytes = bw * samples * dtype.itemsize
+        blocks = []
+        for y in range(ny):
+            row = []
+            for x in range(nx):
+                offset, size = offsets[y * nx + x], sizes[y * nx + x]
+                # the last strip of a striped file may be short
+                rows = bh if self.tiled else min(bh, self.height - y * bh)
+                if size < rows * row_bytes or \
+                        offset + rows * row_bytes > len(self._file):
+                    raise ValueError('block %d, %d is truncated' % (x, y))
+                block = self._file[offset:offset + rows * row_bytes]
+                row.append(block.view(dtype).reshape(
+                    (rows, bw, samples) if samples > 1 else (rows, bw)))
+            blocks.append(row)
+
+        return blocks
+
+    def _full(self, offsets, sizes, dtype, samples):
+        if self.tiled or any(b - a != size for a, b, size in
+                             zip(offsets, offsets[1:], sizes)):
+            return None
+
+        nbytes = self.height * self.width * samples * dtype.itemsize
+        plane = self._file[offsets[0]:offsets[0] + nbytes].view(dtype)
+        return plane.reshape((self.height, self.width, samples)
+                             if samples > 1 else (self.height, self.width))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.close()
+
+    def close(self):
+        self._file = None
+        self._pixel_blocks = self._pixel_full = None
+        self._blocks_by_band = self._full_by_band = []
+
+    def _read_blocks(self, blocks, full, rows, cols):
+        (r0, r1), (c0, c1) = rows, cols
+        if full is not None:
+            return full[r0:r1, c0:c1]
+
+        bh, bw = self.block_shape
+        ty0, ty1 = r0 // bh, (r1 - 1) // bh
+        tx0, tx1 = c0 // bw, (c1 - 1) // bw
+        if ty0 == ty1 and tx0 == tx1:
+            return blocks[ty0][tx0][r0 - ty0 * bh:r1 - ty0 * bh,
+                                    c0 - tx0 * bw:c1 - tx0 * bw]
+
+        # windows spanning blocks are assembled from the block views
+        first = blocks[0][0]
+        out = np.empty((r1 - r0, c1 - c0) + first.shape[2:],
+                       dtype=first.dtype)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                tr0, tr1 = max(r0, ty * bh), min(r1, (ty + 1) * bh)
+                tc0, tc1 = max(c0, tx * bw), min(c1, (tx + 1) * bw)
+                out[tr0 - r0:tr1 - r0, tc0 - c0:tc1 - c0] = \
+                    blocks[ty][tx][tr0 - ty * bh:tr1 - ty * bh,
+                                   tc0 - tx * bw:tc1 - tx * bw]
+        return out
+
+    def read(self, indexes=None, window=None, out=None):
+        """
+        Read bands of a window, as rasterio's DatasetReader.read
+
+        Parameters
+        -----------
+        indexes: int or list
+            1-based band index, or list of them (Default: all bands)
+        window: Window or tuple
+            (Default: the whole raster)
+        out: ndarray
+            array to copy the result into
+
+        Returns
+        --------
+        ndarray
+            a 2D array for an int index, otherwise (bands, rows, cols);
+            a read-only view of the file unless out is given, the
+            window spans blocks that are not stored back to back, or
+            several bands of a band interleaved file are read
+        """
+        if window is None:
+            rows, cols = (0, self.height), (0, self.width)
+        else:
+            rows, cols = toa_utils._window_ranges(window)
+
+        if isinstance(indexes, int):
+            arr = self._read_blocks(self._blocks_by_band[indexes - 1],
+                                    self._full_by_band[indexes - 1],
+                                    rows, cols)
+        else:
+            indexes = list(indexes or range(1, self.count + 1))
+            first = indexes[0] - 1
+            if self._pixel_blocks is not None and \
+                    indexes == list(range(first + 1,
+                                          first + len(indexes) + 1)):
+                # (rows, cols, bands) pixels, as a (bands, rows, cols) view
+                arr = self._read_blocks(
+                    self._pixel_blocks, self._pixel_full, rows, cols)
+                arr = arr[..., first:first + len(indexes)].transpose(2, 0, 1)
+            else:
+                arrs = [self._read_blocks(self._blocks_by_band[i - 1],
+                                          self._full_by_band[i - 1],
+                                          rows, cols)
+                        for i in indexes]
+                # one band stays a view; several are stacked
+                arr = arrs[0][np.newaxis] if len(arrs) == 1 else \
+                    np.stack(arrs)
+
+        if out is None:
+            return arr
+
+        out[...] = arr
+        return out
+
+
+def open_dataset(path):
+    """
+    Open path with a MemmapReader when its layout allows, else with
+    rasterio
+
+    Parameters
+    -----------
+    path: string
+
+    Returns
+    --------
+    MemmapReader or rasterio DatasetReader
+    """
+    try:
+        return MemmapReader(path)
+    except (ValueError, RasterioError):
+        return rasterio.open(path)
@@ -0,0 +1,116 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import rasterio
+from rasterio.windows import Window
+
+from rio_toa import toa_utils
+
+
+def coalesce_windows(windows, max_blocks=8):
+    """
+    Group row-major block windows into runs of horizontally
+    adjacent windows that can be read with a single request
+
+    Parameters
+    -----------
+    windows: list
+        [window, ij] pairs, as from riomucho.utils.getWindows
+    max_blocks: int
+        maximum number of windows merged into one read
+
+    Returns
+    --------
+    groups: list
+        list of (union window, [[window, ij], ...]) tuples
+    """
+    groups = []
+    run = []
+    last = None
+
+    for window, ij in windows:
+        rows, cols = toa_utils._window_ranges(window)
+        if run and (rows != last[0] or cols[0] != last[1][1] or
+                    len(run) == max_blocks):
+            groups.append(_union(run))
+            run = []
+        run.append([window, ij])
+        last = (rows, cols)
+
+    if run:
+        groups.append(_union(run))
+
+    return groups
+
+
+def _union(run):
+    (row_start, row_stop), (col_start, _) = \
+        toa_utils._window_ranges(run[0][0])
+    _, (_, col_stop) = toa_utils._window_ranges(run[-1][0])
+
+    return Window(col_start, row_start,
+                  col_stop - col_start, row_stop - row_start), run
+
+
+class Prefetcher(object):
+    """Reads windows of every input ahead of the consumer.
+
+    Coalesced groups of windows are read concurrently by a thread pool,
+    with each thread holding its own dataset handles, and at most
+    depth groups are buffered ahead of the consumer. Iterating yields
+    (data, window, ij) in window order, where data is a list with one
+    (count, rows, cols) array per input, like riomucho's simple_read.
+    Inputs are opened with opener, rasterio.open by default.
+    """
+
+    def __init__(self, src_paths, windows, depth=8, threads=4,
+                 max_blocks=8, opener=None):
+        self.src_paths = list(src_paths)
+        self.opener = opener or rasterio.open
+        self.groups = coalesce_windows(windows, max_blocks)
+        self.depth = depth
+        self.threads = threads
+        self._local = threading.local()
+        self._handles = []
+
+    def __enter__(self):
+        self.executor = ThreadPoolExecutor(self.threads)
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.executor.shutdown()
+        for src in self._handles:
+            src.close()
+
+    def _open_files(self):
+        if not hasattr(self._local, 'srcs'):
+            self._local.srcs = [self.opener(p) for p in self.src_paths]
+            self._handles.extend(self._local.srcs)
+        return self._local.srcs
+
+    def _read_group(self, group):
+        union, run = group
+        arrays = [src.read(window=union) for src in self._open_files()]
+
+        _, (col_offset, _) = toa_utils._window_ranges(union)
+        out = []
+        for window, ij in run:
+            _, (col_start, col_stop) = toa_utils._window_ranges(window)
+            out.append(([a[:, :, col_start - col_offset:
+                             col_stop - col_offset] for a in arrays],
+                        window, ij))
+        return out
+
+    def __iter__(self):
+        groups = collections.deque(self.groups)
+        pending = collections.deque()
+
+        while groups or pending:
+            while groups and len(pending) < self.depth:
+                pending.append(self.executor.submit(self._read_group,
+                                                    groups.popleft()))
+
+            for read in pending.popleft().result():
+                yield read
+
@@ -0,0 +1,215 @@
+"""Reduced resolution previews computed from overviews.
+
+A preview at scale N covers the scene with 1/N of its rows and columns.
+Inputs are opened as DecimatedReaders, whose windows are in preview
+pixels and are read with an out_shape, so that GDAL serves them from
+the closest internal or external (.ovr) overview, or decimates the full
+resolution blocks when there is none. Workers compute TOA on the
+preview grid directly, and per pixel sun angles are evaluated on it.
+"""
+import math
+
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from rio_toa import toa_utils
+
+
+WINDOW_SIZE = 512
+
+# compressions that lose quality when a tile is written twice
+LOSSY = ('jpeg', 'webp')
+
+
+def parse_scale(value):
+    """
+    Check a preview scale
+
+    Parameters
+    -----------
+    value: int or None
+
+    Returns
+    --------
+    int or None
+        None (full resolution) for None or 1
+    """
+    if value is None:
+        return None
+
+    scale = int(value)
+    if scale != value or scale < 1:
+        raise ValueError('preview scale must be a positive integer, got %r'
+                         % (value, ))
+
+    return scale if scale > 1 else None
+
+
+def preview_shape(height, width, scale):
+    """(rows, cols) of a preview at scale, rounded up"""
+    return int(math.ceil(height / float(scale))), \
+        int(math.ceil(width / float(scale)))
+
+
+def preview_profile(profile, scale):
+    """
+    Destination profile of a preview
+
+    Parameters
+    -----------
+    profile: dict
+        full resolution profile
+    scale: int
+
+    Returns
+    --------
+    dict
+        profile with the preview's shape and a transform covering the
+        same extent
+    """
+    profile = profile.copy()
+    height, width = preview_shape(profile['height'], profile['width'],
+                                  scale)
+    profile['transform'] = profile['transform'] * Affine.scale(
+        profile['width'] / float(width), profile['height'] / float(height))
+    profile['height'], profile['width'] = height, width
+
+    return fit_blocks(profile)
+
+
+def fit_blocks(profile):
+    """Drop the tiling of a profile whose tiles are larger than its
+    raster, to write it in strips"""
+    if profile.get('blockxsize', 0) > profile['width'] or \
+            profile.get('blockysize', 0) > profile['height']:
+        profile = profile.copy()
+        for key in ['tiled', 'blockxsize', 'blockysize']:
+            profile.pop(key, None)
+
+    return profile
+
+
+def lossy(profile):
+    """Whether a profile is tiled with lossy compression"""
+    compress = profile.get('compress')
+    compress = getattr(compress, 'value', compress)
+    return bool(profile.get('tiled')) and \
+        str(compress).lower() in LOSSY
+
+
+def _gcd(a, b):
+    # math.gcd is python 3.5+
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def tile_multiple(profile):
+    """Smallest square window size made of whole tiles of a profile"""
+    x, y = int(profile['blockxsize']), int(profile['blockysize'])
+    return x * y // _gcd(x, y)
+
+
+def preview_windows(profile, size=WINDOW_SIZE):
+    """
+    [window, ij] pairs covering a preview profile, size x size
+
+    Parameters
+    -----------
+    profile: dict
+        preview profile
+    size: int
+
+    Returns
+    --------
+    list
+    """
+    return [[Window(col, row, min(size, profile['width'] - col),
+                    min(size, profile['height'] - row)),
+             (i, j)]
+            for i, row in enumerate(range(0, profile['height'], size))
+            for j, col in enumerate(range(0, profile['width'], size))]
+
+
+class DecimatedReader(object):
+    """Reads a raster on a preview grid at 1/scale of its resolution.
+    read() follows rasterio's signature, with windows in preview pixels.
+
+    Parameters
+    ----------
+    path : str
+    scale : int
+    resampling : rasterio.enums.Resampling
+        nearest by default, so that nodata and QA bits are never blended
+    """
+
+    def __init__(self, path, scale, resampling=Resampling.nearest):
+        self._src = rasterio.open(path)
+        self.scale = scale
+        self.resampling = resampling
+
+        self.name = self._src.name
+        self.count = self._src.count
+        self.dtypes = self._src.dtypes
+        self.nodata = self._src.nodata
+        self.profile = preview_profile(self._src.profile, scale)
+        self.height = self.profile['height']
+        self.width = self.profile['width']
+
+        self._sy = self._src.height / float(self.height)
+        self._sx = self._src.width / float(self.width)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.close()
+
+    def close(self):
+        self._src.close()
+
+    def source_window(self, window):
+        """Full resolution window covering a preview window"""
+        (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+        return Window(c0 * self._sx, r0 * self._sy,
+                      (c1 - c0) * self._sx, (r1 - r0) * self._sy)
+
+    def read(self, indexes=None, window=None, out=None):
+        """
+        Read bands of a preview window, as rasterio's DatasetReader.read
+
+        Parameters
+        -----------
+        indexes: int or list
+            1-based band index, or list of them (Default: all bands)
+        window: Window or tuple
+            window in preview pixels (Default: the whole preview)
+        out: ndarray
+            array to read into
+
+        Returns
+        --------
+        ndarray
+        """
+        if window is None:
+            window = Window(0, 0, self.width, self.height)
+        shape = toa_utils._window_shape(window)
+
+        if out is None:
+            count = 1 if isinstance(indexes, int) else \
+                len(indexes or self._src.indexes)
+            out_shape = shape if isinstance(indexes, int) else \
+                (count, ) + shape
+        else:
+            out_shape = None
+
+        return self._src.read(indexes, window=self.source_window(window),
+                              out=out, out_shape=out_shape,
+                              resampling=self.resampling)
+
+
+def open_dataset(path, scale):
+    """Open path on a preview grid at 1/scale of its resolution"""
+    return DecimatedReader(path, scale)
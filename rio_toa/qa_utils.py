@@ -0,0 +1,71 @@
+import numpy as np
+
+
+# Landsat 8 Collection 1 BQA bit layout:
+# flag: (first bit, number of bits, minimum value that is masked)
+QA_FLAGS = {
+    'fill': (0, 1, 1),
+    'terrain': (1, 1, 1),
+    'cloud': (4, 1, 1),
+    'cloud-shadow': (7, 2, 3),
+    'snow': (9, 2, 3),
+    'cirrus': (11, 2, 3)
+}
+
+
+def qa_mask(qa, flags):
+    """
+    Decode Landsat 8 BQA bit flags into a boolean mask
+
+    Parameters
+    -----------
+    qa: ndarray
+        array of BQA pixels
+    flags: iterable
+        flag names from QA_FLAGS to mask
+
+    Returns
+    --------
+    ndarray
+        boolean ndarray with shape == qa shape,
+        True where any of the requested flags is set
+    """
+    qa = np.asarray(qa).astype(np.uint16)
+    mask = np.zeros(qa.shape, dtype=bool)
+
+    for flag in flags:
+        try:
+            bit, width, threshold = QA_FLAGS[flag]
+        except KeyError:
+            raise ValueError('%s is not a valid QA flag' % (flag))
+
+        mask |= ((qa >> bit) & ((1 << width) - 1)) >= threshold
+
+    return mask
+
+
+def apply_qa_mask(arr, mask, fill=0):
+    """
+    Set masked pixels of a (rows, cols) or (depth, rows, cols)
+    array to a fill value in place
+
+    Parameters
+    -----------
+    arr: ndarray
+        computed output
+    mask: ndarray
+        boolean (rows, cols) mask from qa_mask
+    fill: number
+        value written to masked pixels
+
+    Returns
+    --------
+    ndarray
+        the masked input array
+    """
+    if arr.ndim == 3:
+        arr[:, mask] = fill
+    else:
+        arr[mask] = fill
+
+    return arr
@@ -1,45 +1,15 @@
 import numpy as np
 import rasterio
-import riomucho
 
+from rio_toa import stretch
+from rio_toa import band_stats
+from rio_toa import bundle
+from rio_toa import preview
 from rio_toa import toa_utils
-
-
-def radiance(img, ML, AL, src_nodata=0):
-    """Calculate top of atmosphere radiance of Landsat 8
-    as outlined here: http://landsat.usgs.gov/Landsat8_Using_Product.php
-
-    L = ML * Q + AL
-
-    where:
-        L  = TOA spectral radiance (Watts / (m2 * srad * mm))
-        ML = Band-specific multiplicative rescaling factor from the metadata
-             (RADIANCE_MULT_BAND_x, where x is the band number)
-        AL = Band-specific additive rescaling factor from the metadata
-             (RADIANCE_ADD_BAND_x, where x is the band number)
-        Q  = Quantized and calibrated standard product pixel values (DN)
-             (ndarray img)
-
-    Parameters
-    -----------
-    img: ndarray
-        array of input pixels
-    ML: float
-        multiplicative rescaling factor from scene metadata
-    AL: float
-        additive rescaling factor from scene metadata
-
-    Returns
-    --------
-    ndarray:
-        float32 ndarray with shape == input shape
-    """
-
-    rs = ML * img.astype(np.float32) + AL
-    if src_nodata is not None:
-        rs[img == src_nodata] = 0.0
-
-    return rs
+from rio_toa.kernels import radiance
+from rio_toa import qa_utils
+from rio_toa import reproject
+from rio_toa.executor import Executor
 
 
 def _radiance_worker(data, window, ij, g_args):
@@ -48,67 +18,176 @@ def _radiance_worker(data, window, ij, g_args):
     TODO: integrate rescaling functionality for
     different output datatypes
     """
+    if g_args['qa_flags']:
+        mask = qa_utils.qa_mask(data[-1][0], g_args['qa_flags'])
+        if mask.all():
+            return np.zeros((g_args['bands'],) + mask.shape,
+                            dtype=g_args['dst_dtype'])
+        data = data[:-1]
+
     output = toa_utils.rescale(
         radiance(
-            data[0],
+            np.concatenate(data),
             g_args['M'],
             g_args['A'],
             g_args['src_nodata']),
         g_args['rescale_factor'],
         g_args['dst_dtype'],
-        clip=g_args['clip'])
+        clip=g_args['clip'],
+        stretch=g_args.get('stretch'))
+
+    if g_args['qa_flags']:
+        output = qa_utils.apply_qa_mask(output, mask)
 
     return output
 
 
 def calculate_landsat_radiance(src_path, src_mtl, dst_path, rescale_factor,
                                creation_options, band, dst_dtype, processes,
-                               clip=True):
+                               clip=True, qa_path=None, qa_flags=None,
+                               prefetch=0, shard=None, cache=None,
+                               stats=False, aux_xml=False,
+                               auto_rescale=None,
+                               auto_sample=stretch.SAMPLE,
+                               preview_scale=None, dst_crs=None,
+                               dst_res=None, target_aligned_pixels=False,
+                               driver=None, scale_offset=False,
+                               scene=None):
     """
     Parameters
     ------------
-    src_path: strings
-    src_mtl: string
+    src_path: string or list of strings
+        single band or stacked multiband files (or VRTs), or a USGS
+        .tar.gz bundle whose bands are read in place (see rio_toa.bundle)
+    src_mtl: string or dict
+        MTL file, or the bundle (or None) to parse the bundle's MTL, or
+        an MTL already parsed (e.g. by rio_toa.Scene)
     dst_path: string
     rescale_factor: float
     creation_options: dict
-    bands: list
+    band: integer or list
+        L8 band numbers of every input band, in order; all of them are
+        computed in one pass, as one band each of the output
     dst_dtype: string
     processes: integer
-    pixel_sunangle: boolean
     clip: boolean
+    qa_path: string
+        BQA band path, required with qa_flags
+    qa_flags: list
+        BQA flags (see qa_utils.QA_FLAGS) to write as nodata
+    prefetch: integer
+        number of coalesced window reads to prefetch concurrently
+        (for remote inputs); 0 reads in the workers
+    shard: tuple
+        (i, n) to compute only shard i of n as a partial output, to be
+        assembled with rio_toa.shards.merge_shards
+    cache: rio_toa.cache.OutputCache
+        serve the output from this cache when the same job ran before
+    stats: boolean
+        accumulate per-band statistics and histograms while computing,
+        and write them to the output's band metadata
+    aux_xml: boolean
+        also write the statistics and histograms to a .aux.xml
+    auto_rescale: tuple
+        (low, high) percentiles of TOA values, sampled before the main
+        pass, to stretch to 0..rescale_factor instead of 0..1; the
+        stretch is recorded in the output's tags
+    auto_sample: float
+        share of the scene's windows sampled for auto_rescale
+    preview_scale: int
+        compute a preview at 1/preview_scale of the input resolution,
+        read from the inputs' overviews (see rio_toa.preview)
+    dst_crs: string or CRS
+        compute the output reprojected to this CRS, reading the inputs
+        through a WarpedVRT; areas outside the scene are written
+        as nodata (0 unless the input has one)
+    dst_res: float or tuple
+        output resolution in dst_crs units (Default: as gdalwarp)
+    target_aligned_pixels: boolean
+        align the output bounds to multiples of dst_res, as gdalwarp -tap
+    driver: string
+        output format, "GTiff", "Zarr" (see rio_toa.zarr_output) or
+        "VRT" over per-window tiles (see rio_toa.tiles)
+        (Default: the input's)
+    scale_offset: boolean
+        also write the conversion of stored values back to TOA units as
+        the bands' scale and offset; Zarr outputs always keep it, as
+        scale_factor and add_offset attributes
+    scene: rio_toa.Scene
+        the scene of src_path and src_mtl, whose memoized coefficients,
+        datasets and profiles are used instead of setting them up again
 
     Returns
     ---------
-    None
-        Output is written to dst_path
+    list
+        per band statistics (see rio_toa.band_stats.BandStats.result),
+        or None without stats; output is written to dst_path
     """
-    mtl = toa_utils._load_mtl(src_mtl)
-
-    M = toa_utils._load_mtl_key(mtl,
-                                ['L1_METADATA_FILE',
-                                 'RADIOMETRIC_RESCALING',
-                                 'RADIANCE_MULT_BAND_'],
-                                band)
-    A = toa_utils._load_mtl_key(mtl,
-                                ['L1_METADATA_FILE',
-                                 'RADIOMETRIC_RESCALING',
-                                 'RADIANCE_ADD_BAND_'],
-                                band)
+    src_paths = toa_utils._as_list(src_path)
+    bands = toa_utils._as_list(band)
+    if scene is not None:
+        M, A = scene.rescaling('RADIANCE', bands)
+    else:
+        src_paths, src_mtl = bundle.resolve(src_paths, src_mtl, bands)
+        mtl = toa_utils._load_mtl(src_mtl)
+
+        M = toa_utils._band_constants(mtl,
+                                      ['L1_METADATA_FILE',
+                                       'RADIOMETRIC_RESCALING',
+                                       'RADIANCE_MULT_BAND_'],
+                                      bands)
+        A = toa_utils._band_constants(mtl,
+                                      ['L1_METADATA_FILE',
+                                       'RADIOMETRIC_RESCALING',
+                                       'RADIANCE_ADD_BAND_'],
+                                      bands)
 
     rescale_factor = toa_utils.normalize_scale(rescale_factor, dst_dtype)
 
     dst_dtype = np.__dict__[dst_dtype]
 
-    with rasterio.open(src_path) as src:
-        dst_profile = src.profile.copy()
-
-        src_nodata = src.nodata
+    if scene is not None:
+        dst_profile = scene.profile(bands, dst_dtype, creation_options,
+                                    driver).copy()
+        src_nodata = scene.dataset(bands[-1]).nodata
+        src_counts = [scene.dataset(b).count for b in bands]
+    else:
+        src_counts = []
+        for path in src_paths:
+            with rasterio.open(path) as src:
+                dst_profile = src.profile.copy()
+                src_nodata = src.nodata
+                src_counts.append(src.count)
 
         for co in creation_options:
             dst_profile[co] = creation_options[co]
 
-        dst_profile['dtype'] = dst_dtype
+        dst_profile.update(dtype=dst_dtype, count=len(bands))
+        if driver:
+            dst_profile['driver'] = driver
+
+    # checks that every input band has an L8 band number
+    toa_utils._read_plan(src_counts, bands)
+
+    if dst_crs:
+        dst_profile = reproject.warped_profile(dst_profile, dst_crs, dst_res,
+                                               target_aligned_pixels)
+        if src_nodata is None:
+            # pixels outside the scene are read as 0
+            src_nodata = 0
+        if dst_profile['nodata'] is None:
+            dst_profile['nodata'] = 0
+
+    tags = {}
+    if preview_scale:
+        dst_profile = preview.preview_profile(dst_profile, preview_scale)
+        tags['TOA_PREVIEW_SCALE'] = str(preview_scale)
+
+    warp = reproject.warp_options(dst_profile) if dst_crs else None
+
+    if qa_flags:
+        src_paths.append(qa_path)
+        dst_profile['nodata'] = 0
 
     global_args = {
         'A': A,
@@ -116,13 +195,34 @@ def calculate_landsat_radiance(src_path, src_mtl, dst_path, rescale_factor,
         'src_nodata': src_nodata,
         'rescale_factor': rescale_factor,
         'clip': clip,
-        'dst_dtype': dst_dtype
+        'dst_dtype': dst_dtype,
+        'qa_flags': qa_flags,
+        'bands': len(bands),
+        'stretch': None
         }
 
-    with riomucho.RioMucho([src_path],
-                           dst_path,
-                           _radiance_worker,
-                           options=dst_profile,
-                           global_args=global_args) as rm:
+    with Executor(src_paths,
+                  dst_path,
+                  _radiance_worker,
+                  options=dst_profile,
+                  global_args=global_args,
+                  prefetch=prefetch,
+                  shard=shard,
+                  cache=cache,
+                  stats=band_stats.hist_range(dst_dtype, (0, rescale_factor))
+                  if stats else None,
+                  aux_xml=aux_xml,
+                  tags=tags,
+                  band_tags=[{'TOA_BAND': str(b)} for b in bands],
+                  preview=preview_scale,
+                  warp=warp,
+                  scale_offset=bool(
+                      scale_offset or dst_profile['driver'] == 'Zarr'),
+                  auto_rescale=(auto_rescale, auto_sample)
+                  if auto_rescale else None,
+                  first_src=scene.dataset(bands[0])
+                  if scene is not None else None) as rm:
 
         rm.run(processes)
+
+    return rm.band_stats
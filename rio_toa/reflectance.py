@@ -2,76 +2,21 @@ import numpy as np
 import rasterio
 from rasterio.coords import BoundingBox
 from rasterio import warp
-import riomucho
-
+from rasterio import windows
+
+from rio_toa import stretch
+from rio_toa import band_stats
+from rio_toa import bundle
+from rio_toa import color
+from rio_toa import encodings
+from rio_toa import preview
 from rio_toa import toa_utils
+from rio_toa.kernels import reflectance
 from rio_toa import sun_utils
-
-
-def reflectance(img, MR, AR, E, src_nodata=0):
-    """Calculate top of atmosphere reflectance of Landsat 8
-    as outlined here: http://landsat.usgs.gov/Landsat8_Using_Product.php
-
-    R_raw = MR * Q + AR
-
-    R = R_raw / cos(Z) = R_raw / sin(E)
-
-    Z = 90 - E (in degrees)
-
-    where:
-
-        R_raw = TOA planetary reflectance, without correction for solar angle.
-        R = TOA reflectance with a correction for the sun angle.
-        MR = Band-specific multiplicative rescaling factor from the metadata
-            (REFLECTANCE_MULT_BAND_x, where x is the band number)
-        AR = Band-specific additive rescaling factor from the metadata
-            (REFLECTANCE_ADD_BAND_x, where x is the band number)
-        Q = Quantized and calibrated standard product pixel values (DN)
-        E = Local sun elevation angle. The scene center sun elevation angle
-            in degrees is provided in the metadata (SUN_ELEVATION).
-        Z = Local solar zenith angle (same angle as E, but measured from the
-            zenith instead of from the horizon).
-
-    Parameters
-    -----------
-    img: ndarray
-        array of input pixels of shape (rows, cols) or (rows, cols, depth)
-    MR: float or list of floats
-        multiplicative rescaling factor from scene metadata
-    AR: float or list of floats
-        additive rescaling factor from scene metadata
-    E: float or numpy array of floats
-        local sun elevation angle in degrees
-
-    Returns
-    --------
-    ndarray:
-        float32 ndarray with shape == input shape
-
-    """
-
-    if np.any(E < 0.0):
-        raise ValueError("Sun elevation must be nonnegative "
-                         "(sun must be above horizon for entire scene)")
-
-    input_shape = img.shape
-
-    if len(input_shape) > 2:
-        img = np.rollaxis(img, 0, len(input_shape))
-
-    rf = ((MR * img.astype(np.float32)) + AR) / np.sin(np.deg2rad(E))
-    if src_nodata is not None:
-        rf[img == src_nodata] = 0.0
-
-    if len(input_shape) > 2:
-        if np.rollaxis(rf, len(input_shape) - 1, 0).shape != input_shape:
-            raise ValueError(
-                "Output shape %s is not equal to input shape %s"
-                % (rf.shape, input_shape))
-        else:
-            return np.rollaxis(rf, len(input_shape) - 1, 0)
-    else:
-        return rf
+from rio_toa import qa_utils
+from rio_toa import reproject
+from rio_toa import ang_utils
+from rio_toa.executor import Executor
 
 
 def _reflectance_worker(open_files, window, ij, g_args):
@@ -90,19 +35,66 @@ def _reflectance_worker(open_files, window, ij, g_args):
         Output is written to dst_path
 
     """
-    data = riomucho.utils.array_stack([
-      src.read(window=window).astype(np.float32)
-      for src in open_files
-    ])
+    mask = None
+    if g_args['qa_flags']:
+        mask = qa_utils.qa_mask(open_files[-1].read(1, window=window),
+                                g_args['qa_flags'])
+        if mask.all():
+            # fully masked window: skip band reads and computation
+            return np.zeros((g_args['bands'],) + mask.shape,
+                            dtype=g_args['dst_dtype'])
+
+    data = toa_utils._read_window(open_files, g_args['read_plan'],
+                                  window, g_args['src_dtype'])
+
+    return _reflectance_compute(data, mask, window, g_args)
+
 
+def _reflectance_array_worker(data, window, ij, g_args):
+    """Reflectance worker for windows that were already read, as a list
+    with one (count, rows, cols) array per input (and BQA last when
+    masking), e.g. by rio_toa.prefetch.
+    """
+    mask = None
+    if g_args['qa_flags']:
+        mask = qa_utils.qa_mask(data[-1][0], g_args['qa_flags'])
+        if mask.all():
+            return np.zeros((g_args['bands'],) + mask.shape,
+                            dtype=g_args['dst_dtype'])
+        data = data[:-1]
+
+    # the planned bands of every input, in order
+    data = np.concatenate([data[i][[bidx - 1 for bidx in indexes]]
+                           for i, indexes in g_args['read_plan']])
+
+    return _reflectance_compute(data, mask, window, g_args)
+
+
+def _reflectance_compute(data, mask, window, g_args):
     depth, rows, cols = data.shape
 
-    if g_args['pixel_sunangle']:
+    if g_args['src_nodata'] is not None and \
+            np.all(data == g_args['src_nodata']):
+        # nodata window: skip sun angles and computation
+        return np.zeros(data.shape, dtype=g_args['dst_dtype'])
+
+    if g_args['ang_poly'] is not None:
+        E = (90.0 - ang_utils.eval_zenith_poly(
+                        g_args['ang_poly'],
+                        window)).reshape(rows, cols, 1)
+
+    elif g_args.get('sun_grid') is not None:
+        (row_start, row_stop), (col_start, col_stop) = \
+            toa_utils._window_ranges(window)
+        E = g_args['sun_grid'][row_start:row_stop,
+                               col_start:col_stop].reshape(rows, cols, 1)
+
+    elif g_args['pixel_sunangle']:
         bbox = BoundingBox(
                     *warp.transform_bounds(
                         g_args['src_crs'],
                         {'init': u'epsg:4326'},
-                        *open_files[0].window_bounds(window)))
+                        *windows.bounds(window, g_args['src_transform'])))
 
         E = sun_utils.sun_elevation(
                         bbox,
@@ -114,69 +106,226 @@ def _reflectance_worker(open_files, window, ij, g_args):
         # We're doing whole-scene (instead of per-pixel) sunangle:
         E = np.array([g_args['E'] for i in range(depth)])
 
+    output = reflectance(
+        data,
+        g_args['M'],
+        g_args['A'],
+        E,
+        g_args['src_nodata'])
+
+    if g_args.get('color'):
+        output = color.apply_operations(output, g_args['color'])
+
     output = toa_utils.rescale(
-        reflectance(
-            data,
-            g_args['M'],
-            g_args['A'],
-            E,
-            g_args['src_nodata']),
+        output,
         g_args['rescale_factor'],
         g_args['dst_dtype'],
-        clip=g_args['clip'])
+        clip=g_args['clip'],
+        stretch=g_args.get('stretch'))
+
+    if g_args['qa_flags']:
+        output = qa_utils.apply_qa_mask(output, mask)
 
     return output
 
 
 def calculate_landsat_reflectance(src_paths, src_mtl, dst_path, rescale_factor,
                                   creation_options, bands, dst_dtype,
-                                  processes, pixel_sunangle, clip=True):
+                                  processes, pixel_sunangle, clip=True,
+                                  qa_path=None, qa_flags=None, src_ang=None,
+                                  prefetch=0, shard=None, cache=None,
+                                  stats=False, aux_xml=False,
+                                  auto_rescale=None,
+                                  auto_sample=stretch.SAMPLE,
+                                  preview_scale=None, dst_crs=None,
+                                  dst_res=None,
+                                  target_aligned_pixels=False,
+                                  driver=None, outputs=None, color_ops=None,
+                                  scale_offset=False, scene=None,
+                                  src_bands=None):
     """
     Parameters
     ------------
     src_paths: list of strings
-    src_mtl: string
+        single band or stacked multiband files (or VRTs), or a USGS
+        .tar.gz bundle whose bands are read in place (see rio_toa.bundle)
+    src_mtl: string or dict
+        MTL file, or the bundle (or None) to parse the bundle's MTL, or
+        an MTL already parsed (e.g. by rio_toa.Scene)
     dst_path: string
     rescale_factor: float
     creation_options: dict
     bands: list
+        L8 band numbers to compute, in order; every input band unless
+        src_bands is given
     dst_dtype: string
     processes: integer
     pixel_sunangle: boolean
     clip: boolean
+    qa_path: string
+        BQA band path, required with qa_flags
+    qa_flags: list
+        BQA flags (see qa_utils.QA_FLAGS) to write as nodata
+    src_ang: string
+        ANG file path; per pixel sun angles are evaluated from its
+        solar vector instead of pixel_sunangle's approximation
+    prefetch: integer
+        number of coalesced window reads to prefetch concurrently
+        (for remote inputs); 0 reads in the workers
+    shard: tuple
+        (i, n) to compute only shard i of n as a partial output, to be
+        assembled with rio_toa.shards.merge_shards
+    cache: rio_toa.cache.OutputCache
+        serve the output from this cache when the same job ran before
+    stats: boolean
+        accumulate per-band statistics and histograms while computing,
+        and write them to the output's band metadata
+    aux_xml: boolean
+        also write the statistics and histograms to a .aux.xml
+    auto_rescale: tuple
+        (low, high) percentiles of TOA values, sampled before the main
+        pass, to stretch to 0..rescale_factor instead of 0..1; the
+        stretch is recorded in the output's tags
+    auto_sample: float
+        share of the scene's windows sampled for auto_rescale
+    preview_scale: int
+        compute a preview at 1/preview_scale of the input resolution,
+        read from the inputs' overviews (see rio_toa.preview); per
+        pixel sun angles are evaluated on the preview grid
+    dst_crs: string or CRS
+        compute the output reprojected to this CRS, reading the inputs
+        through a WarpedVRT; sun angles are evaluated on the output
+        grid, and areas outside the scene are written as nodata (0
+        unless the input has one)
+    dst_res: float or tuple
+        output resolution in dst_crs units (Default: as gdalwarp)
+    target_aligned_pixels: boolean
+        align the output bounds to multiples of dst_res, as gdalwarp -tap
+    driver: string
+        output format, "GTiff", "Zarr" (see rio_toa.zarr_output) or
+        "VRT" over per-window tiles (see rio_toa.tiles)
+        (Default: the input's)
+    outputs: list
+        more (path, dtype, rescale_factor, clip) GeoTIFF encodings of
+        the same reflectance (see rio_toa.encodings.parse_output),
+        written from the same reads and kernel evaluations as dst_path
+    color_ops: list
+        (operation, args) color operations (see
+        rio_toa.color.parse_operations) applied to the 0..1 reflectance
+        before rescaling, for visual products (see rio_toa.visual); the
+        output then gets no scale and offset
+    scale_offset: boolean
+        also write the conversion of stored values back to TOA units as
+        the bands' scale and offset of dst_path and of each output; Zarr
+        outputs always keep it, as scale_factor and add_offset
+        attributes
+    scene: rio_toa.Scene
+        the scene of src_paths and src_mtl, whose memoized coefficients,
+        datasets, profiles and sun elevation grid are used instead of
+        setting them up again
+    src_bands: list
+        L8 band numbers of every input band, in order, to compute bands
+        from a subset of them, e.g. of stacked multiband inputs
+        (Default: bands)
 
     Returns
     ---------
-    None
-        Output is written to dst_path
+    list
+        per band statistics (see rio_toa.band_stats.BandStats.result),
+        or None without stats; with outputs, a list of them for dst_path
+        and each output. Output is written to dst_path
     """
-    mtl = toa_utils._load_mtl(src_mtl)
+    if scene is not None:
+        mtl = scene.mtl
+        M, A = scene.rescaling('REFLECTANCE', bands, np.float64)
+    else:
+        src_paths, src_mtl = bundle.resolve(
+            src_paths, src_mtl, bands if src_bands is None else src_bands)
+        mtl = toa_utils._load_mtl(src_mtl)
+        M, A = [toa_utils._band_constants(
+                    mtl, ['L1_METADATA_FILE', 'RADIOMETRIC_RESCALING',
+                          'REFLECTANCE_%s_BAND_' % key], bands, np.float64)
+                for key in ('MULT', 'ADD')]
+    # the kernel broadcasts them over the last axis
+    M, A = M.ravel(), A.ravel()
     metadata = mtl['L1_METADATA_FILE']
 
-    M = [metadata['RADIOMETRIC_RESCALING']
-         ['REFLECTANCE_MULT_BAND_{}'.format(b)]
-         for b in bands]
-    A = [metadata['RADIOMETRIC_RESCALING']
-         ['REFLECTANCE_ADD_BAND_{}'.format(b)]
-         for b in bands]
-
     E = metadata['IMAGE_ATTRIBUTES']['SUN_ELEVATION']
     date_collected = metadata['PRODUCT_METADATA']['DATE_ACQUIRED']
     time_collected_utc = metadata['PRODUCT_METADATA']['SCENE_CENTER_TIME']
 
     rescale_factor = toa_utils.normalize_scale(rescale_factor, dst_dtype)
 
-    dst_dtype = np.__dict__[dst_dtype]
+    if outputs:
+        if auto_rescale:
+            raise ValueError('auto_rescale cannot be combined with outputs')
+        if driver not in (None, 'GTiff'):
+            raise ValueError('outputs are written as GeoTIFFs')
+        outputs = [(dst_path, dst_dtype, rescale_factor, clip)] + \
+            list(outputs)
+        # workers return the kernel's float64 reflectance, which the
+        # writer encodes exactly as a single output would be
+        dst_dtype, rescale_factor, clip = 'float64', 1.0, False
 
-    for src_path in src_paths:
-        with rasterio.open(src_path) as src:
-            dst_profile = src.profile.copy()
-            src_nodata = src.nodata
+    dst_dtype = np.__dict__[dst_dtype]
 
-            for co in creation_options:
-                dst_profile[co] = creation_options[co]
+    if scene is not None:
+        dst_profile = scene.profile(bands, dst_dtype, creation_options,
+                                    driver).copy()
+        src = scene.dataset(bands[-1])
+        src_nodata, src_dtype = src.nodata, src.dtypes[0]
+        src_counts = [scene.dataset(b).count for b in bands]
+    else:
+        src_counts = []
+        for src_path in src_paths:
+            with rasterio.open(src_path) as src:
+                dst_profile = src.profile.copy()
+                src_nodata = src.nodata
+                src_dtype = src.dtypes[0]
+                src_counts.append(src.count)
+
+                for co in creation_options:
+                    dst_profile[co] = creation_options[co]
+
+                dst_profile['dtype'] = dst_dtype
+
+    if driver:
+        dst_profile['driver'] = driver
+
+    read_plan = toa_utils._read_plan(src_counts, bands, src_bands)
+
+    if dst_crs:
+        dst_profile = reproject.warped_profile(dst_profile, dst_crs, dst_res,
+                                               target_aligned_pixels)
+        if src_nodata is None:
+            # pixels outside the scene are read as 0
+            src_nodata = 0
+        if dst_profile['nodata'] is None:
+            dst_profile['nodata'] = 0
+
+    tags = {}
+    if preview_scale:
+        dst_profile = preview.preview_profile(dst_profile, preview_scale)
+        tags['TOA_PREVIEW_SCALE'] = str(preview_scale)
+
+    warp_opts = reproject.warp_options(dst_profile) if dst_crs else None
+
+    if src_ang:
+        ang_poly = ang_utils.zenith_poly(
+            ang_utils.load_ang(src_ang), dst_profile['crs'],
+            dst_profile['transform'],
+            (dst_profile['height'], dst_profile['width']))
+    else:
+        ang_poly = None
 
-            dst_profile['dtype'] = dst_dtype
+    sun_grid = None
+    if scene is not None and pixel_sunangle and ang_poly is None:
+        shape = (dst_profile['height'], dst_profile['width'])
+        sun_grid = scene.sun_elevation_grid(
+            shape, warp.transform_bounds(
+                dst_profile['crs'], {'init': u'epsg:4326'},
+                *windows.bounds(windows.Window(0, 0, shape[1], shape[0]),
+                                dst_profile['transform'])))
 
     global_args = {
         'A': A,
@@ -184,27 +333,65 @@ def calculate_landsat_reflectance(src_paths, src_mtl, dst_path, rescale_factor,
         'E': E,
         'src_nodata': src_nodata,
         'src_crs': dst_profile['crs'],
+        'src_transform': dst_profile['transform'],
         'dst_dtype': dst_dtype,
         'rescale_factor': rescale_factor,
         'clip': clip,
         'pixel_sunangle': pixel_sunangle,
+        'ang_poly': ang_poly,
+        'sun_grid': sun_grid,
         'date_collected': date_collected,
         'time_collected_utc': time_collected_utc,
-        'bands': len(bands)
+        'bands': len(bands),
+        'read_plan': read_plan,
+        'src_dtype': src_dtype,
+        'qa_flags': qa_flags,
+        'stretch': None,
+        'color': color_ops
     }
 
     dst_profile.update(count=len(bands))
 
-    if len(bands) == 3:
-        dst_profile.update(photometric='rgb')
-    else:
-        dst_profile.update(photometric='minisblack')
+    src_paths = list(src_paths)
+    if qa_flags:
+        src_paths.append(qa_path)
+        dst_profile.update(nodata=0)
 
-    with riomucho.RioMucho(list(src_paths),
-                           dst_path,
-                           _reflectance_worker,
-                           options=dst_profile,
-                           global_args=global_args,
-                           mode='manual_read') as rm:
+    # unless given, e.g. as YCbCr for JPEG compression
+    if 'photometric' not in creation_options:
+        dst_profile.update(photometric='rgb' if len(bands) == 3
+                           else 'minisblack')
+
+    if prefetch:
+        # windows arrive already read, as a list of arrays per input
+        worker, mode = _reflectance_array_worker, 'simple_read'
+    else:
+        worker, mode = _reflectance_worker, 'manual_read'
+
+    with Executor(src_paths,
+                  dst_path,
+                  worker,
+                  options=dst_profile,
+                  global_args=global_args,
+                  mode=mode,
+                  prefetch=prefetch,
+                  shard=shard,
+                  cache=cache,
+                  stats=band_stats.hist_range(dst_dtype, (0, rescale_factor))
+                  if stats and not outputs else None,
+                  aux_xml=aux_xml,
+                  tags=tags,
+                  preview=preview_scale,
+                  warp=warp_opts,
+                  scale_offset=not color_ops and bool(
+                      scale_offset or dst_profile['driver'] == 'Zarr'),
+                  auto_rescale=(auto_rescale, auto_sample)
+                  if auto_rescale else None,
+                  writer=encodings.writer(outputs, stats, scale_offset)
+                  if outputs else None,
+                  first_src=scene.dataset(bands[0])
+                  if scene is not None else None) as rm:
 
         rm.run(processes)
+
+    return rm.band_stats
@@ -0,0 +1,162 @@
+"""Compute TOA directly in a target CRS and grid.
+
+Inputs are opened as WarpedReaders over a rasterio WarpedVRT of the
+destination grid, so that workers read windows that are already
+reprojected and write them in place; there is no separate gdalwarp
+pass. Sun angles are evaluated on the destination grid.
+"""
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import aligned_target, calculate_default_transform
+
+from rio_toa import preview
+
+
+def parse_res(value):
+    """
+    Normalize a resolution to an (x, y) tuple
+
+    Parameters
+    -----------
+    value: float, or tuple of 1 or 2 floats, or None
+
+    Returns
+    --------
+    tuple or None
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        value = (value, )
+
+    res = tuple(float(v) for v in value)
+    if len(res) == 1:
+        res = res * 2
+    if len(res) != 2 or min(res) <= 0:
+        raise ValueError('resolution must be one or two positive numbers, '
+                         'got %r' % (value, ))
+    return res
+
+
+def warped_profile(profile, dst_crs, dst_res=None,
+                   target_aligned_pixels=False):
+    """
+    Destination profile of a reprojected output
+
+    Parameters
+    -----------
+    profile: dict
+        source profile
+    dst_crs: CRS or string
+        e.g. "EPSG:3857"
+    dst_res: float or tuple
+        output (x, y) resolution in dst_crs units (Default: as
+        calculated by GDAL to preserve the pixel count)
+    target_aligned_pixels: bool
+        align the output bounds to multiples of dst_res, as gdalwarp -tap
+
+    Returns
+    --------
+    dict
+    """
+    dst_crs = CRS.from_user_input(dst_crs)
+    dst_res = parse_res(dst_res)
+    if target_aligned_pixels and dst_res is None:
+        raise ValueError('target_aligned_pixels requires dst_res')
+
+    bounds = array_bounds(profile['height'], profile['width'],
+                          profile['transform'])
+    transform, width, height = calculate_default_transform(
+        profile['crs'], dst_crs, profile['width'], profile['height'],
+        *bounds, resolution=dst_res)
+
+    if target_aligned_pixels:
+        transform, width, height = aligned_target(transform, width, height,
+                                                  dst_res)
+
+    profile = profile.copy()
+    profile.update(crs=dst_crs, transform=transform, width=width,
+                   height=height)
+
+    return preview.fit_blocks(profile)
+
+
+def warp_options(profile, resampling='nearest'):
+    """
+    Describe a destination grid for WarpedReader
+
+    Parameters
+    -----------
+    profile: dict
+        destination profile
+    resampling: string
+        rasterio.enums.Resampling name; nearest keeps DNs and QA bits
+        intact
+
+    Returns
+    --------
+    dict
+        crs, transform, width, height and resampling
+    """
+    return {'crs': profile['crs'],
+            'transform': profile['transform'],
+            'width': profile['width'],
+            'height': profile['height'],
+            'resampling': resampling}
+
+
+class WarpedReader(object):
+    """Reads a raster reprojected to a destination grid. read() follows
+    rasterio's signature, with windows of the destination grid.
+
+    Pixels outside the source are read as its nodata value, or 0 when
+    it has none.
+
+    Parameters
+    ----------
+    path : str
+    warp : dict
+        destination grid, from warp_options
+    """
+
+    def __init__(self, path, warp):
+        self._src = rasterio.open(path)
+        nodata = self._src.nodata if self._src.nodata is not None else 0
+        self._vrt = WarpedVRT(self._src, crs=warp['crs'],
+                              transform=warp['transform'],
+                              width=warp['width'], height=warp['height'],
+                              resampling=Resampling[warp['resampling']],
+                              nodata=nodata)
+
+        self.name = self._src.name
+        self.count = self._vrt.count
+        self.dtypes = self._vrt.dtypes
+        self.nodata = nodata
+        self.profile = self._vrt.profile
+        self.width = self._vrt.width
+        self.height = self._vrt.height
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.close()
+
+    def close(self):
+        self._vrt.close()
+        self._src.close()
+
+    def read(self, indexes=None, window=None, out=None):
+        """
+        Read bands of a destination window, as rasterio's
+        DatasetReader.read
+        """
+        return self._vrt.read(indexes, window=window, out=out)
+
+
+def open_dataset(path, warp):
+    """Open path reprojected to the destination grid warp"""
+    return WarpedReader(path, warp)
@@ -0,0 +1,387 @@
+"""Stream outputs to S3 compatible object storage.
+
+An s3://bucket/key output is written as a tiled GeoTIFF by a multipart
+upload while windows are still being computed, without a local copy.
+The windows are the output's tiles, written in row-major order; GDAL
+encodes each one (so every GTiff compression works) and it is appended
+to the upload, which sends a part whenever part_size bytes are
+buffered. The first part is held back and sent last: it starts with the
+TIFF header and IFD, which are only complete once every tile's size and
+the final metadata (tags, statistics, scale and offset) are known. The
+IFD thus comes before the tile data, as in a COG without overviews.
+Memory use is bounded by about two parts plus the uploads in flight.
+
+Requires the optional boto3 package (pip install rio-toa[s3]); the
+endpoint and credentials are boto3's, e.g. AWS_ENDPOINT_URL for MinIO.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import math
+import struct
+import threading
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+import numpy as np
+from rasterio.io import MemoryFile
+
+from rio_toa import preview
+from rio_toa import toa_utils
+
+
+TILE_SIZE = 512
+PART_SIZE = 8 * 1024 * 1024
+
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+
+# TIFF field type sizes
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4,
+               10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8}
+
+
+def _require_boto3():
+    if boto3 is None:
+        raise ImportError('s3:// outputs require the boto3 package: '
+                          'pip install rio-toa[s3]')
+
+
+def is_s3_uri(path):
+    return path.startswith('s3://')
+
+
+def split_uri(uri):
+    """(bucket, key) of an s3://bucket/key URI"""
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    if not bucket or not key:
+        raise ValueError('expected s3://bucket/key, got %r' % (uri, ))
+    return bucket, key
+
+
+def tile_size(profile):
+    """Tile size of a streamed output: the profile's square blocks,
+    or TILE_SIZE"""
+    if profile.get('tiled') and \
+            profile.get('blockxsize') == profile.get('blockysize'):
+        return int(profile['blockxsize'])
+    return TILE_SIZE
+
+
+def stream_windows(profile):
+    """[window, ij] pairs of a streamed output's tiles, row-major"""
+    return preview.preview_windows(profile, tile_size(profile))
+
+
+def read_ifd(data):
+    """
+    Parse the first IFD of a TIFF or BigTIFF
+
+    Parameters
+    -----------
+    data: bytes
+        the whole file, little endian
+
+    Returns
+    --------
+    (bigtiff, entries)
+        entries maps each tag to (type, count, value bytes)
+    """
+    if data[:2] != b'II':
+        raise ValueError('expected a little endian TIFF')
+
+    bigtiff = struct.unpack_from('<H', data, 2)[0] == 43
+    if bigtiff:
+        offset = struct.unpack_from('<Q', data, 8)[0]
+        n = struct.unpack_from('<Q', data, offset)[0]
+        entry_fmt, inline, start = '<HHQ', 8, offset + 8
+    else:
+        offset = struct.unpack_from('<I', data, 4)[0]
+        n = struct.unpack_from('<H', data, offset)[0]
+        entry_fmt, inline, start = '<HHI', 4, offset + 2
+
+    entry_size = struct.calcsize(entry_fmt) + inline
+    entries = {}
+    for i in range(n):
+        pos = start + i * entry_size
+        tag, typ, count = struct.unpack_from(entry_fmt, data, pos)
+        size = _TYPE_SIZES[typ] * count
+        pos += struct.calcsize(entry_fmt)
+        if size > inline:
+            pos = struct.unpack_from('<Q' if bigtiff else '<I', data, pos)[0]
+        entries[tag] = (typ, count, bytes(data[pos:pos + size]))
+
+    return bigtiff, entries
+
+
+def write_ifd(bigtiff, entries):
+    """
+    Serialize a TIFF header and one IFD, with out-of-line values after
+    it; the inverse of read_ifd
+
+    Returns
+    --------
+    bytes
+    """
+    if bigtiff:
+        header = struct.pack('<2sHHHQ', b'II', 43, 8, 0, 16)
+        count_fmt, entry_fmt, off_fmt, inline = '<Q', '<HHQ', '<Q', 8
+    else:
+        header = struct.pack('<2sHI', b'II', 42, 8)
+        count_fmt, entry_fmt, off_fmt, inline = '<H', '<HHI', '<I', 4
+
+    tags = sorted(entries)
+    ifd_size = struct.calcsize(count_fmt) + len(tags) * (
+        struct.calcsize(entry_fmt) + inline) + struct.calcsize(off_fmt)
+
+    ifd = [struct.pack(count_fmt, len(tags))]
+    values = []
+    pos = len(header) + ifd_size
+    for tag in tags:
+        typ, count, value = entries[tag]
+        ifd.append(struct.pack(entry_fmt, tag, typ, count))
+        if len(value) > inline:
+            ifd.append(struct.pack(off_fmt, pos))
+            value += b'\0' * (len(value) % 2)
+            values.append(value)
+            pos += len(value)
+        else:
+            ifd.append(value.ljust(inline, b'\0'))
+    ifd.append(struct.pack(off_fmt, 0))
+
+    return header + b''.join(ifd) + b''.join(values)
+
+
+class S3Upload(object):
+    """A multipart upload of one object
+
+    Parameters
+    ----------
+    uri : str
+        s3://bucket/key
+    client : boto3 S3 client
+        (Default: boto3.client('s3'))
+    """
+
+    def __init__(self, uri, client=None):
+        self.bucket, self.key = split_uri(uri)
+        if client is None:
+            _require_boto3()
+            client = boto3.client('s3')
+        self.client = client
+        self.upload_id = client.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key,
+            ContentType='image/tiff')['UploadId']
+        self.etags = {}
+
+    def upload_part(self, number, data):
+        self.etags[number] = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=number, Body=data)['ETag']
+
+    def complete(self):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': n, 'ETag': etag}
+                for n, etag in sorted(self.etags.items())]})
+
+    def abort(self):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class StreamWriter(object):
+    """Streams a tiled GeoTIFF to a multipart upload, with the parts of
+    rasterio's writer interface the Executor uses: write(),
+    update_tags() and close(). Windows must be the output's tiles; ones
+    that arrive ahead of their turn are kept, encoded, until the tiles
+    before them are written.
+
+    Parameters
+    ----------
+    upload : S3Upload
+        or any object with upload_part(number, data), complete() and
+        abort()
+    profile : dict
+        destination profile; its compression and block size apply
+    windows : list
+        [window, ij] pairs of the job, from stream_windows
+    part_size : int
+        bytes buffered before a part is uploaded; at least 5 MiB for S3
+    max_uploads : int
+        parts uploading concurrently, beyond which writes wait
+    """
+
+    def __init__(self, upload, profile, windows, part_size=PART_SIZE,
+                 max_uploads=2):
+        self.upload = upload
+        self.size = tile_size(profile)
+        self.part_size = part_size
+        self.across = int(math.ceil(profile['width'] / float(self.size)))
+        self.count = self.across * int(
+            math.ceil(profile['height'] / float(self.size)))
+
+        self.profile = profile.copy()
+        self.profile.update(driver='GTiff', tiled=True,
+                            blockxsize=self.size, blockysize=self.size,
+                            interleave='pixel')
+
+        expected = [toa_utils._window_ranges(w)
+                    for w, _ in stream_windows(profile)]
+        if sorted(toa_utils._window_ranges(w) for w, _ in windows) != \
+                sorted(expected):
+            raise ValueError('streamed outputs are written by tiles of '
+                             '%d pixels' % self.size)
+
+        self.tags = {}
+        self.band_tags = [{} for _ in range(profile['count'])]
+        self.scale_offset = None
+
+        self._next = 0
+        self._ahead = {}
+        self._byte_counts = []
+        self._first = bytearray()
+        self._buffer = bytearray()
+        self._part = 1
+
+        self._uploads = []
+        self._slots = threading.Semaphore(max_uploads)
+        self._executor = ThreadPoolExecutor(max_uploads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        if ext_t is None:
+            self.close()
+        else:
+            self._executor.shutdown()
+            self.upload.abort()
+
+    def _encode(self, arr):
+        """Bytes of one tile, as GDAL encodes it"""
+        rows, cols = arr.shape[1:]
+        if (rows, cols) != (self.size, self.size):
+            fill = self.profile.get('nodata') or 0
+            tile = np.full((arr.shape[0], self.size, self.size), fill,
+                           dtype=arr.dtype)
+            tile[:, :rows, :cols] = arr
+            arr = tile
+
+        profile = dict(self.profile, width=self.size, height=self.size)
+        for key in ['crs', 'transform']:
+            profile.pop(key, None)
+        with MemoryFile() as mem:
+            with mem.open(**profile) as dst:
+                dst.write(arr)
+            data = mem.read()
+
+        bigtiff, entries = read_ifd(data)
+        fmt = '<Q' if bigtiff else '<I'
+        offset = struct.unpack(fmt, entries[TILE_OFFSETS][2])[0]
+        size = struct.unpack(fmt, entries[TILE_BYTE_COUNTS][2])[0]
+        return data[offset:offset + size]
+
+    def write(self, arr, window=None):
+        (r0, _), (c0, _) = toa_utils._window_ranges(window)
+        self._ahead[(r0 // self.size) * self.across + c0 // self.size] = \
+            self._encode(np.asarray(arr, dtype=self.profile['dtype']))
+
+        while self._next in self._ahead:
+            self._append(self._ahead.pop(self._next))
+            self._next += 1
+
+    def _append(self, data):
+        self._byte_counts.append(len(data))
+        if len(self._first) < self.part_size:
+            self._first += data
+            return
+
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            self._send(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def _send(self, data):
+        self._part += 1
+        self._slots.acquire()
+        future = self._executor.submit(self.upload.upload_part, self._part,
+                                       data)
+        future.add_done_callback(lambda f: self._slots.release())
+        self._uploads.append(future)
+
+    def update_tags(self, bidx=0, **tags):
+        """Merge tags into the dataset's (bidx 0) or a band's tags"""
+        tags = dict((k, str(v)) for k, v in tags.items())
+        if bidx:
+            self.band_tags[bidx - 1].update(tags)
+        else:
+            self.tags.update(tags)
+
+    def set_scale_offset(self, scale, offset):
+        """Record the linear conversion of stored values to TOA units,
+        as the bands' scale and offset"""
+        self.scale_offset = (scale, offset)
+
+    def _header(self):
+        """TIFF header and IFD, as GDAL writes them for this profile,
+        pointing at the streamed tiles"""
+        # no tiles are written to the template, only its IFD is kept
+        bigtiff = sum(self._byte_counts) > 2 ** 32 - 2 ** 26
+        with MemoryFile() as mem:
+            with mem.open(**dict(self.profile, sparse_ok=True,
+                                 bigtiff='YES' if bigtiff else 'NO')) as dst:
+                dst.update_tags(**self.tags)
+                for bidx, tags in enumerate(self.band_tags, 1):
+                    dst.update_tags(bidx, **tags)
+                if self.scale_offset is not None:
+                    dst.scales = [self.scale_offset[0]] * dst.count
+                    dst.offsets = [self.scale_offset[1]] * dst.count
+            bigtiff, entries = read_ifd(mem.read())
+
+        typ, fmt = (16, '<Q') if bigtiff else (4, '<I')
+        entries[TILE_BYTE_COUNTS] = (
+            typ, self.count,
+            b''.join(struct.pack(fmt, n) for n in self._byte_counts))
+
+        # the offsets' values do not change the header's size
+        entries[TILE_OFFSETS] = (typ, self.count,
+                                 b'\0' * struct.calcsize(fmt) * self.count)
+        offsets = np.cumsum([len(write_ifd(bigtiff, entries))] +
+                            self._byte_counts[:-1])
+        entries[TILE_OFFSETS] = (
+            typ, self.count,
+            b''.join(struct.pack(fmt, int(n)) for n in offsets))
+
+        return write_ifd(bigtiff, entries)
+
+    def close(self):
+        try:
+            if self._next != self.count:
+                raise ValueError('%d of %d tiles were written'
+                                 % (self._next, self.count))
+            if self._buffer:
+                self._send(bytes(self._buffer))
+            for future in self._uploads:
+                future.result()
+            self.upload.upload_part(1, self._header() + bytes(self._first))
+        except Exception:
+            self.upload.abort()
+            raise
+        finally:
+            self._executor.shutdown()
+
+        self.upload.complete()
+
+
+def create(path, profile, windows):
+    """Start streaming an output to the s3:// URI path"""
+    return StreamWriter(S3Upload(path), profile, windows)
+
+
+# tiles are appended to the upload as they come, so the executor hands
+# out the output's tiles in row-major order
+create.windows = stream_windows
+create.ordered = True
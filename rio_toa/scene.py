@@ -0,0 +1,257 @@
+"""One Landsat 8 scene, set up once for many products.
+
+A Scene parses its MTL once and memoizes what the calculate_* functions
+would otherwise look up or open again for every product: per band
+coefficient arrays, sun elevation grids, the scene bounds, open band
+datasets and output profiles. Its radiance(), reflectance(),
+brightness_temperature() and visual() methods hand the scene to those
+functions, which then take their setup from it, so that many products
+and AOIs of one scene share it. Per pixel sun angles then come from the
+memoized grid of the whole output rather than from each window's
+bounds.
+"""
+import numpy as np
+import rasterio
+from rasterio.coords import BoundingBox
+
+from rio_toa import sun_utils
+from rio_toa import toa_utils
+
+
+class Scene(object):
+    """
+    A Landsat 8 scene
+
+    Parameters
+    ----------
+    mtl : str or dict
+        *_MTL.txt or *_MTL.json path, USGS .tar.gz bundle, or parsed MTL
+    band_paths : dict
+        L8 band number: file path (Default: found from the MTL path
+        with template, or in the bundle)
+    template : str
+        band path template of rio_toa.cube.scene_paths
+    """
+
+    def __init__(self, mtl, band_paths=None, template=None):
+        if isinstance(mtl, dict):
+            self.mtl_path, self.mtl = None, mtl
+        else:
+            self.mtl_path, self.mtl = mtl, toa_utils._load_mtl(mtl)
+        self.metadata = self.mtl['L1_METADATA_FILE']
+        self._band_paths = dict(band_paths or {})
+        self.template = template
+        self._coefficients = {}
+        self._sun_grids = {}
+        self._datasets = {}
+        self._band_profiles = {}
+        self._profiles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.close()
+
+    def close(self):
+        """Close the open band datasets"""
+        for src in self._datasets.values():
+            src.close()
+        self._datasets.clear()
+
+    @property
+    def scene_id(self):
+        return self.metadata.get('METADATA_FILE_INFO', {}).get(
+            'LANDSAT_SCENE_ID')
+
+    @property
+    def date_collected(self):
+        return self.metadata['PRODUCT_METADATA']['DATE_ACQUIRED']
+
+    @property
+    def time_collected_utc(self):
+        return self.metadata['PRODUCT_METADATA']['SCENE_CENTER_TIME']
+
+    @property
+    def sun_elevation(self):
+        """Scene center sun elevation, in degrees"""
+        return self.metadata['IMAGE_ATTRIBUTES']['SUN_ELEVATION']
+
+    @property
+    def bounds(self):
+        """(west, south, east, north) of the scene corners"""
+        return BoundingBox(*toa_utils._get_bounds_from_metadata(
+            self.metadata['PRODUCT_METADATA']))
+
+    def coefficients(self, group, key, bands, dtype=np.float32):
+        """
+        Per band MTL constants, memoized
+
+        Parameters
+        -----------
+        group: str
+            MTL group, e.g. "RADIOMETRIC_RESCALING"
+        key: str
+            constant without the band number, e.g.
+            "REFLECTANCE_MULT_BAND_"
+        bands: list
+            L8 band numbers
+        dtype: numpy dtype
+
+        Returns
+        --------
+        ndarray
+            array of shape (bands, 1, 1); do not modify it
+        """
+        cache_key = (group, key, tuple(bands), np.dtype(dtype).str)
+        if cache_key not in self._coefficients:
+            self._coefficients[cache_key] = toa_utils._band_constants(
+                self.mtl, ['L1_METADATA_FILE', group, key], list(bands),
+                dtype)
+
+        return self._coefficients[cache_key]
+
+    def rescaling(self, kind, bands, dtype=np.float32):
+        """(mult, add) rescaling arrays of "RADIANCE" or "REFLECTANCE"
+        for bands"""
+        return (self.coefficients('RADIOMETRIC_RESCALING',
+                                  '%s_MULT_BAND_' % kind, bands, dtype),
+                self.coefficients('RADIOMETRIC_RESCALING',
+                                  '%s_ADD_BAND_' % kind, bands, dtype))
+
+    def thermal_constants(self, bands):
+        """(K1, K2) arrays of the thermal bands"""
+        return (self.coefficients('TIRS_THERMAL_CONSTANTS',
+                                  'K1_CONSTANT_BAND_', bands),
+                self.coefficients('TIRS_THERMAL_CONSTANTS',
+                                  'K2_CONSTANT_BAND_', bands))
+
+    def sun_elevation_grid(self, shape, bounds=None):
+        """
+        Per pixel sun elevation, memoized
+
+        Parameters
+        -----------
+        shape: tuple
+            (rows, cols) of the grid
+        bounds: tuple
+            (west, south, east, north) in degrees (Default: the scene
+            bounds)
+
+        Returns
+        --------
+        ndarray
+            (rows, cols) sun elevations in degrees; do not modify it
+        """
+        bounds = tuple(bounds if bounds is not None else self.bounds)
+        key = (bounds, tuple(shape))
+        if key not in self._sun_grids:
+            self._sun_grids[key] = sun_utils.sun_elevation(
+                BoundingBox(*bounds), shape, self.date_collected,
+                self.time_collected_utc)
+
+        return self._sun_grids[key]
+
+    def band_path(self, band):
+        """Path of an L8 band's file"""
+        if band not in self._band_paths:
+            if self.mtl_path is None:
+                raise ValueError('no path for band %s of an MTL dict; '
+                                 'give band_paths' % band)
+            from rio_toa.cube import BAND_TEMPLATE, scene_paths
+            self._band_paths[band] = scene_paths(
+                self.mtl_path, [band], self.template or BAND_TEMPLATE)[0]
+
+        return self._band_paths[band]
+
+    def band_paths(self, bands):
+        return [self.band_path(b) for b in bands]
+
+    def dataset(self, band):
+        """Open dataset of an L8 band, kept open until close()"""
+        if band not in self._datasets:
+            self._datasets[band] = rasterio.open(self.band_path(band))
+
+        return self._datasets[band]
+
+    def band_profile(self, band):
+        """Profile of an L8 band's file, memoized; copy it to modify"""
+        if band not in self._band_profiles:
+            self._band_profiles[band] = self.dataset(band).profile
+
+        return self._band_profiles[band]
+
+    def profile(self, bands, dtype, creation_options=None, driver=None):
+        """
+        Output profile of a product of bands, memoized
+
+        Parameters
+        -----------
+        bands: list
+            L8 band numbers, one output band each
+        dtype: string or numpy dtype
+        creation_options: dict
+        driver: string
+            (Default: the band files')
+
+        Returns
+        --------
+        dict
+            the last band's profile with creation_options, dtype, count
+            and driver; copy it to modify
+        """
+        creation_options = creation_options or {}
+        key = (tuple(bands), np.dtype(dtype).str,
+               tuple(sorted(creation_options.items())), driver)
+        if key not in self._profiles:
+            profile = self.band_profile(bands[-1]).copy()
+            profile.update(creation_options)
+            profile.update(dtype=dtype, count=len(bands))
+            if driver:
+                profile['driver'] = driver
+            self._profiles[key] = profile
+
+        return self._profiles[key]
+
+    def radiance(self, dst_path, bands, rescale_factor=None,
+                 creation_options=None, dst_dtype='uint16', processes=4,
+                 **kwargs):
+        """Write the radiance of bands, with
+        rio_toa.radiance.calculate_landsat_radiance's keyword arguments"""
+        from rio_toa.radiance import calculate_landsat_radiance
+        return calculate_landsat_radiance(
+            self.band_paths(bands), self.mtl, dst_path,
+            rescale_factor, creation_options or {}, list(bands), dst_dtype,
+            processes, scene=self, **kwargs)
+
+    def reflectance(self, dst_path, bands, rescale_factor=None,
+                    creation_options=None, dst_dtype='uint16', processes=4,
+                    pixel_sunangle=False, **kwargs):
+        """Write the reflectance of bands, with
+        rio_toa.reflectance.calculate_landsat_reflectance's keyword
+        arguments"""
+        from rio_toa.reflectance import calculate_landsat_reflectance
+        return calculate_landsat_reflectance(
+            self.band_paths(bands), self.mtl, dst_path,
+            rescale_factor, creation_options or {}, list(bands), dst_dtype,
+            processes, pixel_sunangle, scene=self, **kwargs)
+
+    def brightness_temperature(self, dst_path, bands=(10, ), temp_scale='K',
+                               creation_options=None, dst_dtype='float32',
+                               processes=4, **kwargs):
+        """Write the brightness temperature of thermal bands, with
+        rio_toa.brightness_temp's keyword arguments"""
+        from rio_toa.brightness_temp import (
+            calculate_landsat_brightness_temperature)
+        return calculate_landsat_brightness_temperature(
+            self.band_paths(bands), self.mtl, dst_path, temp_scale,
+            creation_options or {}, list(bands), dst_dtype, processes,
+            scene=self, **kwargs)
+
+    def visual(self, dst_path, bands=(4, 3, 2), **kwargs):
+        """Write a visual product, with
+        rio_toa.visual.calculate_landsat_visual's keyword arguments"""
+        from rio_toa.visual import calculate_landsat_visual
+        return calculate_landsat_visual(
+            self.band_paths(bands), self.mtl, dst_path, bands,
+            scene=self, **kwargs)
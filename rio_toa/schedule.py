@@ -0,0 +1,142 @@
+"""Cost-aware window ordering and per-scene latency statistics.
+
+Windows are handed to workers one at a time, most expensive first, so
+that cheap windows (nodata collars) fill the gaps at the end of a scene
+instead of a long interior window starting last. Costs come from the
+input's overviews and block metadata only; inputs without overviews
+keep row-major order rather than pay for a full extra read.
+"""
+import contextlib
+
+import numpy as np
+import rasterio
+from rasterio.errors import RasterioError
+
+from rio_toa import toa_utils
+
+
+@contextlib.contextmanager
+def _opened(src):
+    if isinstance(src, str):
+        with rasterio.open(src) as src:
+            yield src
+    else:
+        # open already, and kept open
+        yield src
+
+
+def window_costs(src_path, windows, decimation=8):
+    """
+    Estimate the relative cost of computing each window from the
+    dataset mask of an overview and the compressed size of its block
+
+    Parameters
+    -----------
+    src_path: string or dataset
+        first input of the job, or its open dataset
+    windows: list
+        [window, ij] pairs
+    decimation: int
+        factor the mask is read at, from the input's overviews
+
+    Returns
+    --------
+    costs: list
+        one float per window; valid pixels weighted by how large the
+        window's block is compared to the average block. None when the
+        input has no overviews, as its mask would be read in full.
+    """
+    with _opened(src_path) as src:
+        if not src.overviews(1):
+            return None
+        shape = (max(1, src.height // decimation),
+                 max(1, src.width // decimation))
+        valid = src.dataset_mask(out_shape=shape) > 0
+        scale_y = float(shape[0]) / src.height
+        scale_x = float(shape[1]) / src.width
+
+        nbytes = []
+        for window, ij in windows:
+            try:
+                nbytes.append(src.block_size(1, *ij))
+            except (RasterioError, TypeError, ValueError):
+                nbytes.append(None)
+
+    known = [b for b in nbytes if b]
+    mean_bytes = float(np.mean(known)) if known else None
+
+    costs = []
+    for (window, ij), size in zip(windows, nbytes):
+        (row_start, row_stop), (col_start, col_stop) = \
+            toa_utils._window_ranges(window)
+
+        r0 = int(row_start * scale_y)
+        c0 = int(col_start * scale_x)
+        cells = valid[r0:max(r0 + 1, int(np.ceil(row_stop * scale_y))),
+                      c0:max(c0 + 1, int(np.ceil(col_stop * scale_x)))]
+        pixels = (row_stop - row_start) * (col_stop - col_start)
+        cost = cells.mean() * pixels if cells.size else float(pixels)
+
+        if size and mean_bytes:
+            cost *= 0.5 + 0.5 * size / mean_bytes
+
+        costs.append(float(cost))
+
+    return costs
+
+
+def order_windows(windows, costs):
+    """
+    Sort windows by descending cost, keeping row-major order for ties
+
+    Parameters
+    -----------
+    windows: list
+        [window, ij] pairs
+    costs: list
+        output of window_costs
+
+    Returns
+    --------
+    windows: list
+    """
+    order = sorted(range(len(windows)), key=lambda i: -costs[i])
+    return [windows[i] for i in order]
+
+
+def latency_summary(seconds, wall, processes):
+    """
+    Summarise per-window compute times of one scene
+
+    Parameters
+    -----------
+    seconds: list
+        time each window spent reading and computing in a worker
+    wall: float
+        elapsed time of the whole run
+    processes: int
+
+    Returns
+    --------
+    dict
+        count, mean, p50, p90, p99 and max window seconds, wall time and
+        utilization (busy worker time over wall time times processes)
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    count = len(seconds)
+    if not count:
+        seconds = np.zeros(1)
+
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+
+    return {
+        'count': count,
+        'mean': float(seconds.mean()),
+        'p50': float(p50),
+        'p90': float(p90),
+        'p99': float(p99),
+        'max': float(seconds.max()),
+        'wall': float(wall),
+        'utilization': float(seconds.sum() / (wall * processes))
+        if wall else 0.0
+    }
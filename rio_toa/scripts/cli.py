@@ -1,16 +1,250 @@
 import json
 import logging
+import os
+import re
 
 import click
 from rasterio.rio.options import creation_options
 
-from rio_toa.radiance import calculate_landsat_radiance
-from rio_toa.reflectance import calculate_landsat_reflectance
-from rio_toa.brightness_temp import calculate_landsat_brightness_temperature
+# subcommand implementations pull in riomucho and rasterio.warp, so they
+# are imported when a subcommand runs rather than when rio loads plugins
+from rio_toa import bundle
 from rio_toa.toa_utils import _parse_bands_from_filename, _parse_mtl_txt
+from rio_toa.qa_utils import QA_FLAGS
 
 logger = logging.getLogger('rio_toa')
 
+READTEMPLATE = r".*/LC8.*\_B{b}.TIF"
+
+_URL = re.compile(r'[a-z][a-z0-9+.-]*://', re.I)
+
+
+class InputPath(click.Path):
+    """A click.Path that must exist when it is a local file; GDAL /vsi*/
+    paths and URLs, which GDAL or the MTL reader open, pass as given"""
+
+    def convert(self, value, param, ctx):
+        if value.startswith('/vsi') or _URL.match(value):
+            return value
+        return super(InputPath, self).convert(value, param, ctx)
+
+
+qa_band_opt = click.option(
+    '--qa-band', type=InputPath(exists=True), default=None,
+    help="Landsat 8 BQA band used by --qa-mask")
+
+qa_mask_opt = click.option(
+    '--qa-mask', type=click.Choice(sorted(QA_FLAGS)), multiple=True,
+    help="BQA flag to write as nodata; can be repeated. Requires --qa-band")
+
+
+prefetch_opt = click.option(
+    '--prefetch', type=int, default=0,
+    help="Number of coalesced window reads to prefetch concurrently, "
+         "for remote (/vsicurl/, /vsis3/) inputs (Default: 0, off)")
+
+
+def _parse_preview_scale(ctx, param, value):
+    from rio_toa.preview import parse_scale
+    try:
+        return parse_scale(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx=ctx, param=param)
+
+
+preview_opt = click.option(
+    '--preview-scale', type=int, default=None,
+    callback=_parse_preview_scale,
+    help="Compute a preview at 1/N of the input resolution, read from "
+         "the inputs' overviews (or decimated when they have none)")
+
+
+driver_opt = click.option(
+    '--driver', type=click.Choice(['GTiff', 'Zarr', 'VRT']), default=None,
+    help="Output format; Zarr writes a chunked array and VRT a GeoTIFF "
+         "per window, both written by the workers directly (Default: "
+         "Zarr for *.zarr paths, VRT for *.vrt paths, else the input's)")
+
+scale_offset_opt = click.option(
+    '--scale-offset', is_flag=True, default=False,
+    help="Also write the conversion of stored values back to TOA units "
+         "as the bands' scale and offset (Zarr outputs always keep it)")
+
+
+def _output_driver(driver, dst_path):
+    if driver is None:
+        ext = os.path.splitext(dst_path.rstrip('/'))[1].lower()
+        driver = {'.zarr': 'Zarr', '.vrt': 'VRT'}.get(ext)
+    if driver == 'Zarr':
+        from rio_toa import zarr_output
+        if zarr_output.zarr is None:
+            raise click.UsageError('Zarr output requires the zarr package: '
+                                   'pip install rio-toa[zarr]')
+    if dst_path.startswith('s3://'):
+        from rio_toa import s3_output
+        if s3_output.boto3 is None:
+            raise click.UsageError('s3:// outputs require the boto3 '
+                                   'package: pip install rio-toa[s3]')
+    return driver
+
+
+def warp_options(f):
+    f = click.option(
+        '--target-aligned-pixels', is_flag=True, default=False,
+        help="Align the output bounds to multiples of --dst-res, as "
+             "gdalwarp -tap")(f)
+    f = click.option(
+        '--dst-res', type=float, multiple=True,
+        help="Output resolution in --dst-crs units; give once for square "
+             "pixels or twice for x and y (Default: as gdalwarp)")(f)
+    return click.option(
+        '--dst-crs', default=None,
+        help="Compute the output reprojected to this CRS, e.g. EPSG:3857, "
+             "without a separate warp pass")(f)
+
+
+def _warp_kwargs(dst_crs, dst_res, target_aligned_pixels):
+    if (dst_res or target_aligned_pixels) and not dst_crs:
+        raise click.BadParameter('requires --dst-crs',
+                                 param_hint='--dst-res')
+    if target_aligned_pixels and not dst_res:
+        raise click.BadParameter('--target-aligned-pixels requires '
+                                 '--dst-res', param_hint='--dst-res')
+    if len(dst_res) > 2:
+        raise click.BadParameter('give one or two resolutions',
+                                 param_hint='--dst-res')
+
+    return {'dst_crs': dst_crs, 'dst_res': dst_res or None,
+            'target_aligned_pixels': target_aligned_pixels}
+
+
+def _parse_shard(ctx, param, value):
+    if value is None:
+        return None
+
+    from rio_toa.shards import parse_shard
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e), ctx=ctx, param=param)
+
+
+shard_opt = click.option(
+    '--shard', default=None, callback=_parse_shard,
+    help="Compute only shard i of n (0 <= i < n), formatted i/n, as a "
+         "partial output for `rio toa merge`")
+
+
+cache_dir_opt = click.option(
+    '--cache-dir', type=click.Path(file_okay=False), default=None,
+    envvar='RIO_TOA_CACHE_DIR',
+    help="Output cache directory; a job that ran before with the same "
+         "inputs and options is served from it (Default: "
+         "$RIO_TOA_CACHE_DIR, off when unset)")
+
+
+def cache_options(f):
+    f = click.option(
+        '--cache-link', is_flag=True, default=False,
+        help="Hard link cached outputs into place instead of copying")(f)
+    f = click.option(
+        '--cache-size', default=None, envvar='RIO_TOA_CACHE_SIZE',
+        help="Evict least recently used outputs beyond this size, "
+             "e.g. 20G (Default: $RIO_TOA_CACHE_SIZE, unlimited)")(f)
+    return cache_dir_opt(f)
+
+
+def _check_percentiles(ctx, param, value):
+    low, high = value
+    if not 0 <= low < high <= 100:
+        raise click.BadParameter('percentiles must satisfy '
+                                 '0 <= LOW < HIGH <= 100', ctx=ctx,
+                                 param=param)
+    return value
+
+
+def auto_rescale_options(f):
+    f = click.option(
+        '--auto-sample', type=float, default=0.02,
+        help="Share of the scene's windows sampled for --auto-rescale "
+             "(Default: 0.02)")(f)
+    f = click.option(
+        '--auto-percentiles', type=float, nargs=2, default=(0.0, 99.5),
+        callback=_check_percentiles,
+        help="TOA percentiles stretched to 0 and to the rescale factor "
+             "by --auto-rescale; a low percentile of 0 keeps 0 at 0 "
+             "(Default: 0 99.5)")(f)
+    return click.option(
+        '--auto-rescale', is_flag=True, default=False,
+        help="Derive the stretch from a sample of the scene before "
+             "computing it, and record it in the output's tags")(f)
+
+
+def stats_options(f):
+    f = click.option(
+        '--aux-xml', is_flag=True, default=False,
+        help="With --stats, also write statistics and histograms to a "
+             ".aux.xml sidecar, for gdalinfo -hist")(f)
+    return click.option(
+        '--stats/--no-stats', default=False,
+        help="Accumulate per-band statistics and histograms while "
+             "computing and write them to the output (Default: False)")(f)
+
+
+def _output_cache(cache_dir, cache_size=None, cache_link=False):
+    if not cache_dir:
+        return None
+
+    from rio_toa.cache import OutputCache, parse_size
+    try:
+        max_bytes = parse_size(cache_size) if cache_size else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--cache-size')
+
+    return OutputCache(cache_dir, max_bytes, cache_link)
+
+
+def _bundle_inputs(src_paths, src_mtl, bands, readtemplate, bidx_hint):
+    """Band paths of a .tar.gz bundle input, which may also be given
+    alone in place of src_mtl; src_paths unchanged otherwise"""
+    if not src_paths and bundle.is_bundle(src_mtl):
+        src_paths = (src_mtl, )
+    if len(src_paths) != 1 or not bundle.is_bundle(src_paths[0]):
+        return list(src_paths)
+
+    if not bands:
+        raise click.BadParameter('%s is required for bundle inputs'
+                                 % bidx_hint, param_hint=bidx_hint)
+    if readtemplate == READTEMPLATE:
+        readtemplate = bundle.BAND_TEMPLATE
+    try:
+        return bundle.band_paths(src_paths[0], list(bands), readtemplate)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--readtemplate')
+
+
+def _parse_outputs(ctx, param, value):
+    from rio_toa.encodings import parse_output
+    try:
+        return [parse_output(spec) for spec in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--output')
+
+
+def _parse_color(ctx, param, value):
+    from rio_toa.color import parse_operations
+    try:
+        return parse_operations(value or '')
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--color')
+
+
+def _check_qa(qa_band, qa_mask):
+    if qa_mask and not qa_band:
+        raise click.BadParameter('--qa-mask requires --qa-band',
+                                 param_hint='--qa-mask')
+    return list(qa_mask) or None
+
 
 @click.group('toa')
 def toa():
@@ -20,8 +254,8 @@ def toa():
 
 
 @click.command('radiance')
-@click.argument('src_path', type=click.Path(exists=True))
-@click.argument('src_mtl', type=click.Path(exists=True))
+@click.argument('src_paths', nargs=-1, type=InputPath(exists=True))
+@click.argument('src_mtl', type=InputPath(exists=True))
 @click.argument('dst_path', type=click.Path(exists=False))
 @click.option('--dst-dtype',
               type=click.Choice(['uint16', 'uint8']),
@@ -34,34 +268,72 @@ def toa():
 @click.option('--clip/--no-clip', default=True,
               help="Clip raw TOA values to constrain the domain to 0..1 "
               "(Default: True)")
-@click.option('--readtemplate', '-t', default=".*/LC8.*\_B{b}.TIF",
-              help="File path template [Default ='.*/LC8.*\_B{b}.TIF']")
+@click.option('--readtemplate', '-t', default=READTEMPLATE,
+              help=r"File path template, or member name template for "
+                   r"a .tar.gz bundle [Default ='.*/LC8.*\_B{b}.TIF', "
+                   r"'.*_B{b}\.TIF' for bundles]")
 @click.option('--workers', '-j', type=int, default=4)
-@click.option('--l8-bidx', default=0, type=int,
-              help="L8 Band that the src_path represents"
-              "(Default is parsed from file name)")
+@click.option('--l8-bidx', type=int, multiple=True,
+              help="L8 Band that each input band represents, in order; "
+              "repeat for every band of stacked multiband inputs "
+              "(Default is parsed from file names)")
 @click.option('--verbose', '-v', is_flag=True, default=False)
+@qa_band_opt
+@qa_mask_opt
+@prefetch_opt
+@preview_opt
+@warp_options
+@driver_opt
+@scale_offset_opt
+@shard_opt
+@cache_options
+@stats_options
+@auto_rescale_options
 @click.pass_context
 @creation_options
-def radiance(ctx, src_path, src_mtl, dst_path, rescale_factor,
+def radiance(ctx, src_paths, src_mtl, dst_path, rescale_factor,
              readtemplate, verbose, creation_options, l8_bidx,
-             dst_dtype, workers, clip):
+             dst_dtype, workers, clip, qa_band, qa_mask,
+             prefetch, shard, cache_dir, cache_size, cache_link, stats,
+             aux_xml, auto_rescale, auto_percentiles, auto_sample,
+             preview_scale, dst_crs, dst_res, target_aligned_pixels,
+             driver, scale_offset):
     """Calculates Landsat8 Top of Atmosphere Radiance
     """
     if verbose:
         logger.setLevel(logging.DEBUG)
 
-    if l8_bidx == 0:
-        l8_bidx = _parse_bands_from_filename([src_path], readtemplate)[0]
+    from rio_toa.radiance import calculate_landsat_radiance
+
+    qa_mask = _check_qa(qa_band, qa_mask)
 
-    calculate_landsat_radiance(src_path, src_mtl, dst_path,
-                               rescale_factor, creation_options, l8_bidx,
-                               dst_dtype, workers, clip)
+    src_paths = _bundle_inputs(src_paths, src_mtl, l8_bidx, readtemplate,
+                               '--l8-bidx')
+    if not l8_bidx:
+        l8_bidx = _parse_bands_from_filename(src_paths, readtemplate)
+
+    calculate_landsat_radiance(list(src_paths), src_mtl, dst_path,
+                               rescale_factor, creation_options,
+                               list(l8_bidx),
+                               dst_dtype, workers, clip,
+                               qa_path=qa_band, qa_flags=qa_mask,
+                               prefetch=prefetch, shard=shard,
+                               cache=_output_cache(cache_dir, cache_size,
+                                                   cache_link),
+                               stats=stats, aux_xml=aux_xml,
+                               auto_rescale=auto_percentiles
+                               if auto_rescale else None,
+                               auto_sample=auto_sample,
+                               preview_scale=preview_scale,
+                               driver=_output_driver(driver, dst_path),
+                               scale_offset=scale_offset,
+                               **_warp_kwargs(dst_crs, dst_res,
+                                              target_aligned_pixels))
 
 
 @click.command('reflectance')
-@click.argument('src_paths', nargs=-1, type=click.Path(exists=True))
-@click.argument('src_mtl', type=click.Path(exists=True))
+@click.argument('src_paths', nargs=-1, type=InputPath(exists=True))
+@click.argument('src_mtl', type=InputPath(exists=True))
 @click.argument('dst_path', type=click.Path(exists=False))
 @click.option('--dst-dtype',
               type=click.Choice(['uint16', 'uint8', 'float32']),
@@ -74,37 +346,101 @@ def radiance(ctx, src_path, src_mtl, dst_path, rescale_factor,
 @click.option('--clip/--no-clip', default=True,
               help="Clip raw TOA values to constrain the domain to 0..1 "
               "(Default: True)")
-@click.option('--readtemplate', '-t', default=".*/LC8.*\_B{b}.TIF",
-              help="File path template [Default ='.*/LC8.*\_B{b}.TIF']")
+@click.option('--readtemplate', '-t', default=READTEMPLATE,
+              help=r"File path template, or member name template for "
+                   r"a .tar.gz bundle [Default ='.*/LC8.*\_B{b}.TIF', "
+                   r"'.*_B{b}\.TIF' for bundles]")
 @click.option('--workers', '-j', type=int, default=4)
-@click.option('--l8-bidx', default=0, type=int,
-              help="L8 Band that the src_path represents"
-              "(Default is parsed from file name)")
+@click.option('--l8-bidx', type=int, multiple=True,
+              help="L8 Band that each input band represents, in order; "
+              "repeat for every band of stacked multiband inputs "
+              "(Default is parsed from file names)")
 @click.option('--verbose', '-v', is_flag=True, default=False)
 @click.option('--pixel-sunangle', '-p', is_flag=True, default=False,
               help="Per pixel sun elevation")
+@click.option('--sunangle-source',
+              type=click.Choice(['scene', 'pixel', 'ang']), default=None,
+              help="Sun elevation from the MTL scene centre, approximated "
+                   "per pixel (same as --pixel-sunangle), or per pixel "
+                   "from the --src-ang angle coefficient file")
+@click.option('--src-ang', type=click.Path(exists=True), default=None,
+              help="Landsat 8 *_ANG.txt file for --sunangle-source ang")
+@click.option('--output', 'outputs', multiple=True, callback=_parse_outputs,
+              metavar='PATH:DTYPE:RESCALE:CLIP',
+              help="Also write the reflectance to PATH as DTYPE (uint16, "
+                   "uint8 or float32), scaled by RESCALE (empty for the "
+                   "dtype's default) and clipped to 0..1 or not (clip or "
+                   "noclip), from the same pass; can be repeated")
+@qa_band_opt
+@qa_mask_opt
+@prefetch_opt
+@preview_opt
+@warp_options
+@driver_opt
+@scale_offset_opt
+@shard_opt
+@cache_options
+@stats_options
+@auto_rescale_options
 @click.pass_context
 @creation_options
 def reflectance(ctx, src_paths, src_mtl, dst_path, dst_dtype,
                 rescale_factor, clip, readtemplate, workers, l8_bidx,
-                verbose, creation_options, pixel_sunangle):
+                verbose, creation_options, pixel_sunangle, sunangle_source,
+                src_ang, qa_band, qa_mask, prefetch, shard, cache_dir,
+                cache_size, cache_link, stats, aux_xml, auto_rescale,
+                auto_percentiles, auto_sample, preview_scale, dst_crs,
+                dst_res, target_aligned_pixels, driver, outputs,
+                scale_offset):
     """Calculates Landsat8 Top of Atmosphere Reflectance
     """
     if verbose:
         logger.setLevel(logging.DEBUG)
 
-    if l8_bidx == 0:
-        l8_bidx = _parse_bands_from_filename(list(src_paths), readtemplate)
+    from rio_toa.reflectance import calculate_landsat_reflectance
+
+    if sunangle_source == 'ang':
+        if not src_ang:
+            raise click.BadParameter('--sunangle-source ang requires '
+                                     '--src-ang', param_hint='--src-ang')
+    else:
+        src_ang = None
+        pixel_sunangle = pixel_sunangle or sunangle_source == 'pixel'
+
+    qa_mask = _check_qa(qa_band, qa_mask)
+    if outputs and auto_rescale:
+        raise click.BadParameter('--output cannot be combined with '
+                                 '--auto-rescale', param_hint='--output')
+
+    src_paths = _bundle_inputs(src_paths, src_mtl, l8_bidx, readtemplate,
+                               '--l8-bidx')
+    if not l8_bidx:
+        l8_bidx = _parse_bands_from_filename(src_paths, readtemplate)
 
     calculate_landsat_reflectance(list(src_paths), src_mtl, dst_path,
                                   rescale_factor, creation_options,
                                   list(l8_bidx), dst_dtype,
-                                  workers, pixel_sunangle, clip)
+                                  workers, pixel_sunangle, clip,
+                                  qa_path=qa_band, qa_flags=qa_mask,
+                                  src_ang=src_ang, prefetch=prefetch,
+                                  shard=shard,
+                                  cache=_output_cache(cache_dir, cache_size,
+                                                      cache_link),
+                                  stats=stats, aux_xml=aux_xml,
+                                  auto_rescale=auto_percentiles
+                                  if auto_rescale else None,
+                                  auto_sample=auto_sample,
+                                  preview_scale=preview_scale,
+                                  driver=_output_driver(driver, dst_path),
+                                  outputs=outputs,
+                                  scale_offset=scale_offset,
+                                  **_warp_kwargs(dst_crs, dst_res,
+                                                 target_aligned_pixels))
 
 
 @click.command('brighttemp')
-@click.argument('src_path', type=click.Path(exists=True))
-@click.argument('src_mtl', type=click.Path(exists=True))
+@click.argument('src_paths', nargs=-1, type=InputPath(exists=True))
+@click.argument('src_mtl', type=InputPath(exists=True))
 @click.argument('dst_path', type=click.Path(exists=False))
 @click.option('--dst-dtype', '-d',
               type=click.Choice(['float32', 'float64', 'uint16', 'uint8']),
@@ -114,18 +450,33 @@ def reflectance(ctx, src_paths, src_mtl, dst_path, dst_dtype,
               type=click.Choice(['K', 'F', 'C']),
               default='K',
               help='Temperature scale [Default = K (Kelvin)]')
-@click.option('--readtemplate', '-t', default=".*/LC8.*\_B{b}.TIF",
-              help="File path template [Default ='.*/LC8.*\_B{b}.TIF']")
+@click.option('--readtemplate', '-t', default=READTEMPLATE,
+              help=r"File path template, or member name template for "
+                   r"a .tar.gz bundle [Default ='.*/LC8.*\_B{b}.TIF', "
+                   r"'.*_B{b}\.TIF' for bundles]")
 @click.option('--workers', '-j', type=int, default=4)
-@click.option('--thermal-bidx', default=0, type=int,
-              help="L8 thermal band that the src_path represents"
-              "(Default is parsed from file name)")
+@click.option('--thermal-bidx', type=int, multiple=True,
+              help="L8 thermal band (10 or 11) that each input band "
+              "represents, in order; repeat for both bands "
+              "(Default is parsed from file names)")
 @click.option('--verbose', '-v', is_flag=True, default=False)
+@qa_band_opt
+@qa_mask_opt
+@prefetch_opt
+@preview_opt
+@warp_options
+@driver_opt
+@shard_opt
+@cache_options
+@stats_options
 @click.pass_context
 @creation_options
-def brighttemp(ctx, src_path, src_mtl, dst_path, dst_dtype,
+def brighttemp(ctx, src_paths, src_mtl, dst_path, dst_dtype,
                temp_scale, readtemplate, workers,
-               thermal_bidx, verbose, creation_options):
+               thermal_bidx, verbose, creation_options, qa_band, qa_mask,
+               prefetch, shard, cache_dir, cache_size, cache_link, stats,
+               aux_xml, preview_scale, dst_crs, dst_res,
+               target_aligned_pixels, driver):
     """Calculates Landsat8 at-satellite brightness temperature.
     TIRS band data can be converted from spectral radiance
     to brightness temperature using the thermal
@@ -135,12 +486,160 @@ def brighttemp(ctx, src_path, src_mtl, dst_path, dst_dtype,
     if verbose:
         logger.setLevel(logging.DEBUG)
 
-    if thermal_bidx == 0:
-        thermal_bidx = _parse_bands_from_filename([src_path], readtemplate)[0]
+    from rio_toa.brightness_temp import (
+        calculate_landsat_brightness_temperature)
+
+    qa_mask = _check_qa(qa_band, qa_mask)
+
+    src_paths = _bundle_inputs(src_paths, src_mtl, thermal_bidx,
+                               readtemplate, '--thermal-bidx')
+    if not thermal_bidx:
+        thermal_bidx = _parse_bands_from_filename(src_paths, readtemplate)
 
     calculate_landsat_brightness_temperature(
-        src_path, src_mtl, dst_path, temp_scale,
-        creation_options, thermal_bidx, dst_dtype, workers)
+        list(src_paths), src_mtl, dst_path, temp_scale,
+        creation_options, list(thermal_bidx), dst_dtype, workers,
+        qa_path=qa_band, qa_flags=qa_mask, prefetch=prefetch,
+        shard=shard,
+        cache=_output_cache(cache_dir, cache_size, cache_link),
+        stats=stats, aux_xml=aux_xml, preview_scale=preview_scale,
+        driver=_output_driver(driver, dst_path),
+        **_warp_kwargs(dst_crs, dst_res, target_aligned_pixels))
+
+
+@click.command('cube')
+@click.argument('src_mtls', nargs=-1, required=True,
+                type=click.Path(exists=True))
+@click.argument('dst_path', type=click.Path(exists=False))
+@click.option('--band', '-b', 'bands', type=int, multiple=True,
+              required=True,
+              help="L8 band to stack for every date; can be repeated")
+@click.option('--band-template', default='{prefix}_B{b}.TIF',
+              help="Band file path of a scene, formatted with prefix (the "
+                   "MTL path without _MTL.*), dir, scene and b "
+                   "(Default: '{prefix}_B{b}.TIF')")
+@click.option('--dst-dtype',
+              type=click.Choice(['uint16', 'uint8', 'float32']),
+              default='uint16',
+              help='Output data type')
+@click.option('--rescale-factor', '-r', type=float,
+              default=None,
+              help="Rescale TOA values by a multiplier. (Default: "
+                   "65535 for uint16, 255 for uint8, 1.0 for float32)")
+@click.option('--clip/--no-clip', default=True,
+              help="Clip raw TOA values to constrain the domain to 0..1 "
+              "(Default: True)")
+@click.option('--workers', '-j', type=int, default=4)
+@click.option('--verbose', '-v', is_flag=True, default=False)
+@click.option('--pixel-sunangle', '-p', is_flag=True, default=False,
+              help="Per pixel sun elevation, for each date")
+@driver_opt
+@scale_offset_opt
+@shard_opt
+@cache_options
+@stats_options
+@creation_options
+def cube(src_mtls, dst_path, bands, band_template, dst_dtype,
+         rescale_factor, clip, workers, verbose, pixel_sunangle, shard,
+         cache_dir, cache_size, cache_link, stats, aux_xml,
+         creation_options, driver, scale_offset):
+    """Stacks Top of Atmosphere Reflectance of many dates of a path/row
+    on a common grid into one multiband raster, one band per date and
+    band, ordered by acquisition date
+    """
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+
+    from rio_toa.cube import calculate_landsat_reflectance_cube, scene_paths
+
+    scenes = []
+    for src_mtl in src_mtls:
+        try:
+            src_paths = scene_paths(src_mtl, bands, band_template)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--band')
+        for path in src_paths:
+            if not bundle.split_vsi_path(path) and not os.path.exists(path):
+                raise click.BadParameter('%s not found for %s'
+                                         % (path, src_mtl),
+                                         param_hint='--band-template')
+        scenes.append((src_paths, src_mtl))
+
+    try:
+        calculate_landsat_reflectance_cube(
+            scenes, dst_path, rescale_factor, creation_options, list(bands),
+            dst_dtype, workers, pixel_sunangle, clip, shard=shard,
+            cache=_output_cache(cache_dir, cache_size, cache_link),
+            stats=stats, aux_xml=aux_xml,
+            driver=_output_driver(driver, dst_path),
+            scale_offset=scale_offset)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('visual')
+@click.argument('src_paths', nargs=-1, type=InputPath(exists=True))
+@click.argument('src_mtl', type=InputPath(exists=True))
+@click.argument('dst_path', type=click.Path(exists=False))
+@click.option('--color', '-c', 'operations', default=None,
+              callback=_parse_color,
+              help="Color operations applied in order to the 0..1 "
+                   "reflectance, e.g. 'gamma 1.1 sigmoidal 10 0.15 "
+                   "saturation 1.3'")
+@click.option('--compress', type=click.Choice(['jpeg', 'webp', 'deflate']),
+              default='jpeg', help="Output compression (Default: jpeg)")
+@click.option('--quality', type=click.IntRange(1, 100), default=90,
+              help="JPEG or WEBP quality (Default: 90)")
+@click.option('--readtemplate', '-t', default=READTEMPLATE,
+              help=r"File path template, or member name template for "
+                   r"a .tar.gz bundle [Default ='.*/LC8.*\_B{b}.TIF', "
+                   r"'.*_B{b}\.TIF' for bundles]")
+@click.option('--workers', '-j', type=int, default=4)
+@click.option('--l8-bidx', type=int, multiple=True,
+              help="L8 Band that each input band represents, in order "
+              "red, green, blue (Default is parsed from file names, or "
+              "4, 3, 2 for bundles)")
+@click.option('--verbose', '-v', is_flag=True, default=False)
+@click.option('--pixel-sunangle', '-p', is_flag=True, default=False,
+              help="Per pixel sun elevation")
+@qa_band_opt
+@qa_mask_opt
+@prefetch_opt
+@preview_opt
+@warp_options
+@creation_options
+def visual(src_paths, src_mtl, dst_path, operations, compress, quality,
+           readtemplate, workers, l8_bidx, verbose, pixel_sunangle, qa_band,
+           qa_mask, prefetch, preview_scale, dst_crs, dst_res,
+           target_aligned_pixels, creation_options):
+    """Writes an 8-bit RGB visual product of Landsat8 Top of Atmosphere
+    Reflectance, color corrected and compressed in the same pass
+    """
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+
+    from rio_toa.visual import calculate_landsat_visual
+
+    qa_mask = _check_qa(qa_band, qa_mask)
+
+    src_paths = _bundle_inputs(src_paths, src_mtl, l8_bidx or (4, 3, 2),
+                               readtemplate, '--l8-bidx')
+    if not l8_bidx:
+        if src_paths and bundle.split_vsi_path(src_paths[0]):
+            l8_bidx = (4, 3, 2)
+        else:
+            l8_bidx = _parse_bands_from_filename(src_paths, readtemplate)
+    if len(l8_bidx) != 3:
+        raise click.BadParameter('visual products need 3 bands, got %d'
+                                 % len(l8_bidx), param_hint='--l8-bidx')
+
+    calculate_landsat_visual(src_paths, src_mtl, dst_path, list(l8_bidx),
+                             workers, pixel_sunangle, operations, compress,
+                             quality, creation_options, qa_path=qa_band,
+                             qa_flags=qa_mask, prefetch=prefetch,
+                             preview_scale=preview_scale,
+                             **_warp_kwargs(dst_crs, dst_res,
+                                            target_aligned_pixels))
 
 
 @click.command('parsemtl')
@@ -157,7 +656,163 @@ def parsemtl(mtl):
     click.echo(json.dumps(_parse_mtl_txt(mtl)))
 
 
+@click.command('merge')
+@click.argument('shard_paths', nargs=-1, required=True,
+                type=click.Path(exists=True))
+@click.argument('dst_path', type=click.Path(exists=False))
+@click.option('--driver', type=click.Choice(['GTiff', 'COG', 'VRT']),
+              default=None,
+              help="Output format; VRT references the shards in place "
+                   "(Default: VRT for .vrt paths, else GTiff)")
+@creation_options
+def merge(shard_paths, dst_path, driver, creation_options):
+    """Assembles the partial outputs of radiance, reflectance or
+    brighttemp runs with --shard i/n into one raster
+    """
+    from rio_toa.shards import merge_shards
+
+    if driver is None:
+        driver = 'VRT' if dst_path.lower().endswith('.vrt') else 'GTiff'
+
+    try:
+        merge_shards(list(shard_paths), dst_path, creation_options, driver)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('concat')
+@click.argument('src_path', type=click.Path(exists=True))
+@click.argument('dst_path', type=click.Path(exists=False))
+@creation_options
+def concat(src_path, dst_path, creation_options):
+    """Copies a tiled VRT output (--driver VRT) into one tiled GeoTIFF,
+    compressing with every core
+    """
+    from rio_toa.tiles import concat_tiles
+
+    concat_tiles(src_path, dst_path, creation_options)
+
+
+@click.group('cache')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              required=True, envvar='RIO_TOA_CACHE_DIR',
+              help="Output cache directory (Default: $RIO_TOA_CACHE_DIR)")
+@click.pass_context
+def cache(ctx, cache_dir):
+    """Manages the output cache used with --cache-dir
+    """
+    from rio_toa.cache import OutputCache
+
+    ctx.obj = OutputCache(cache_dir)
+
+
+@cache.command('list')
+@click.pass_obj
+def cache_list(output_cache):
+    """Lists cached outputs as JSON lines, least recently used first
+    """
+    for entry in output_cache.entries():
+        click.echo(json.dumps(entry, sort_keys=True))
+
+
+@cache.command('info')
+@click.pass_obj
+def cache_info(output_cache):
+    """Prints the number and total size of cached outputs
+    """
+    entries = output_cache.entries()
+    click.echo(json.dumps({'path': output_cache.path,
+                           'count': len(entries),
+                           'size': sum(e['size'] for e in entries)}))
+
+
+@cache.command('prune')
+@click.option('--max-size', required=True,
+              help="Evict least recently used outputs beyond this size, "
+                   "e.g. 20G")
+@click.pass_obj
+def cache_prune(output_cache, max_size):
+    """Evicts least recently used outputs down to a size
+    """
+    from rio_toa.cache import parse_size
+
+    try:
+        max_bytes = parse_size(max_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--max-size')
+
+    for key in output_cache.evict(max_bytes):
+        click.echo(key)
+
+
+@cache.command('clear')
+@click.pass_obj
+def cache_clear(output_cache):
+    """Removes every cached output
+    """
+    for key in output_cache.clear():
+        click.echo(key)
+
+
+@click.command('serve')
+@click.option('--host', default='127.0.0.1',
+              help="Address to listen on [Default = 127.0.0.1]")
+@click.option('--port', type=int, default=8877,
+              help="Port to listen on [Default = 8877]")
+@click.option('--workers', '-j', type=int, default=4,
+              help="Number of warm worker processes; each runs one job "
+                   "at a time")
+@click.option('--allow-remote', is_flag=True, default=False,
+              help="Allow a --host other than a loopback address. Jobs "
+                   "read and write files as the server's user for any "
+                   "client that reaches it with the token")
+@click.option('--token', envvar='RIO_TOA_TOKEN', default=None,
+              help="Token clients must send; printed at startup "
+                   "[Default = $RIO_TOA_TOKEN, else a new random token]")
+def serve(host, port, workers, allow_remote, token):
+    """Runs a local job server that keeps warm worker processes
+    for radiance, reflectance and brighttemp jobs submitted with
+    `rio toa submit`
+    """
+    from rio_toa.server import serve as run_server
+
+    try:
+        run_server(host, port, workers, allow_remote, token)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--host')
+
+
+@click.command('submit', context_settings=dict(ignore_unknown_options=True))
+@click.argument('command')
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@click.option('--url', default='http://127.0.0.1:8877',
+              help="rio toa serve url [Default = http://127.0.0.1:8877]")
+@click.option('--wait/--no-wait', default=True,
+              help="Wait for the job to finish (Default: True)")
+@click.option('--token', envvar='RIO_TOA_TOKEN', required=True,
+              help="The token printed by rio toa serve "
+                   "[Default = $RIO_TOA_TOKEN]")
+def submit(command, args, url, wait, token):
+    """Submits a subcommand with its arguments to `rio toa serve`,
+    e.g. rio toa submit reflectance B4.TIF MTL.txt out.tif
+    """
+    from rio_toa.server import submit_job
+
+    job = submit_job(url, command, args, wait=wait, token=token)
+    if job['status'] == 'failed':
+        raise click.ClickException(job['error'])
+
+    click.echo(json.dumps(job))
+
+
 toa.add_command(radiance)
 toa.add_command(reflectance)
 toa.add_command(brighttemp)
+toa.add_command(cube)
+toa.add_command(visual)
 toa.add_command(parsemtl)
+toa.add_command(merge)
+toa.add_command(concat)
+toa.add_command(cache)
+toa.add_command(serve)
+toa.add_command(submit)
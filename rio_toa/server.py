@@ -0,0 +1,306 @@
+import hmac
+import json
+from multiprocessing import Pool
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import Request, urlopen
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import Request, urlopen
+
+import rasterio
+
+from rio_toa import toa_utils
+
+
+JOB_COMMANDS = ('radiance', 'reflectance', 'brighttemp')
+
+# seconds a finished job's status is kept when nobody fetches it
+JOB_TTL = 3600
+
+_env = None
+
+
+def _init_worker():
+    """Warm up a job worker: import the subcommands, keep a GDAL
+    environment (and its block cache) open across jobs and cache
+    parsed MTLs.
+    """
+    global _env
+    from rio_toa.scripts import cli  # noqa
+
+    toa_utils._mtl_cache = {}
+    _env = rasterio.Env()
+    _env.__enter__()
+
+
+def _run_job(command, args, cwd):
+    from rio_toa.scripts.cli import toa
+
+    if cwd:
+        os.chdir(cwd)
+
+    # jobs run in parallel across the warm workers, never within one
+    try:
+        toa.commands[command].main(args=list(args) + ['--workers', '1'],
+                                   standalone_mode=False)
+    except Exception as e:
+        # click and rasterio errors do not all survive pickling
+        raise RuntimeError('%s: %s' % (type(e).__name__, e))
+
+
+def is_loopback(host):
+    """Whether host resolves to a loopback address"""
+    try:
+        address = socket.getaddrinfo(host, None)[0][4][0]
+    except socket.gaierror:
+        return False
+    return address.startswith('127.') or address == '::1'
+
+
+def is_loopback_name(host):
+    """Whether a Host header names a loopback address literally, without
+    resolving it, so that DNS rebinding cannot pass it off as one"""
+    if host.startswith('['):
+        name = host[1:].partition(']')[0]
+    else:
+        name = host.partition(':')[0]
+    parts = name.split('.')
+    return name.lower() == 'localhost' or name == '::1' or \
+        (len(parts) == 4 and parts[0] == '127' and
+         all(p.isdigit() for p in parts))
+
+
+class JobServer(ThreadingMixIn, HTTPServer):
+    """Local HTTP server running rio toa subcommands on warm workers.
+
+    POST /jobs with {"command": ..., "args": [...], "cwd": ...} queues a
+    job and returns its id; GET /jobs/<id>?wait=1 returns its status,
+    blocking until it finishes when wait is set. A finished job is
+    forgotten once its status has been fetched, or ttl seconds after it
+    was submitted.
+
+    Jobs read and write any path the server's user can, so every request
+    must carry the server's token as "Authorization: Bearer <token>",
+    and jobs must be posted as application/json. The server only listens
+    on loopback addresses, and only answers requests whose Host header
+    names one, unless allow_remote is set.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers, ttl=JOB_TTL, allow_remote=False,
+                 token=None):
+        if not allow_remote and not is_loopback(address[0]):
+            raise ValueError('%s is not a loopback address; jobs can read '
+                             'and write any file, set allow_remote to '
+                             'listen on it anyway' % address[0])
+        HTTPServer.__init__(self, address, _JobHandler)
+        self.allow_remote = allow_remote
+        self.token = token or uuid.uuid4().hex
+        self.pool = Pool(workers, _init_worker)
+        self.ttl = ttl
+        # job id: (AsyncResult, submission time)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def _prune(self):
+        expired = time.time() - self.ttl
+        for job_id, (result, submitted) in list(self.jobs.items()):
+            if submitted < expired and result.ready():
+                del self.jobs[job_id]
+
+    def submit(self, command, args, cwd=None):
+        if command not in JOB_COMMANDS:
+            raise ValueError('%s is not one of %s'
+                             % (command, ', '.join(JOB_COMMANDS)))
+
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._prune()
+            self.jobs[job_id] = (self.pool.apply_async(
+                _run_job, (command, args, cwd)), time.time())
+
+        return job_id
+
+    def status(self, job_id, wait=False):
+        with self.lock:
+            self._prune()
+            result = self.jobs[job_id][0]
+
+        if wait:
+            result.wait()
+
+        if not result.ready():
+            return {'id': job_id, 'status': 'pending'}
+
+        with self.lock:
+            # fetched: the job is forgotten
+            self.jobs.pop(job_id, None)
+
+        try:
+            result.get()
+        except Exception as e:
+            return {'id': job_id, 'status': 'failed', 'error': str(e)}
+
+        return {'id': job_id, 'status': 'done'}
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+
+class _JobHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, code, body):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _refuse(self):
+        """Reply with an error, and return True, unless the request
+        names a loopback Host and carries the server's token"""
+        if not self.server.allow_remote and \
+                not is_loopback_name(self.headers.get('Host', '')):
+            self._reply(403, {'error': 'Host is not a loopback address'})
+            return True
+
+        auth = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth.encode('utf-8'),
+                                   ('Bearer %s' % self.server.token)
+                                   .encode('utf-8')):
+            self._reply(401, {'error': 'missing or wrong token'})
+            return True
+
+        return False
+
+    def do_POST(self):
+        if self._refuse():
+            return
+        if self.path != '/jobs':
+            return self._reply(404, {'error': 'not found'})
+
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.partition(';')[0].strip() != 'application/json':
+            return self._reply(415, {'error': 'jobs must be posted as '
+                                              'application/json'})
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            job_id = self.server.submit(job['command'], job.get('args', []),
+                                        job.get('cwd'))
+        except (KeyError, ValueError) as e:
+            return self._reply(400, {'error': str(e)})
+
+        self._reply(202, {'id': job_id, 'status': 'pending'})
+
+    def do_GET(self):
+        if self._refuse():
+            return
+        path, _, query = self.path.partition('?')
+        if not path.startswith('/jobs/'):
+            return self._reply(404, {'error': 'not found'})
+
+        try:
+            status = self.server.status(path[len('/jobs/'):],
+                                        wait='wait=1' in query.split('&'))
+        except KeyError:
+            return self._reply(404, {'error': 'unknown job'})
+
+        self._reply(200, status)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=8877, workers=4, allow_remote=False,
+          token=None):
+    """
+    Run a JobServer until interrupted, printing its url and token
+
+    Parameters
+    ------------
+    host: string
+    port: integer
+    workers: integer
+        number of warm worker processes
+    allow_remote: boolean
+        listen on a host other than a loopback address; any client that
+        reaches it with the token can then run jobs as this user
+    token: string
+        token clients must send (Default: a new random one)
+
+    Returns
+    ---------
+    None
+    """
+    server = JobServer((host, port), workers, allow_remote=allow_remote,
+                       token=token)
+    print('rio toa serve on http://%s:%d, token %s'
+          % (host, server.server_address[1], server.token))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _request(url, data=None, token=None):
+    if data is not None:
+        data = json.dumps(data).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = 'Bearer %s' % token
+    req = Request(url, data=data, headers=headers)
+
+    return json.loads(urlopen(req).read().decode('utf-8'))
+
+
+def submit_job(url, command, args, cwd=None, wait=True, token=None):
+    """
+    Submit a rio toa subcommand to a JobServer
+
+    Parameters
+    ------------
+    url: string
+        server url, e.g. http://127.0.0.1:8877
+    command: string
+        subcommand name, e.g. reflectance
+    args: list
+        subcommand arguments, as on the command line
+    cwd: string
+        directory relative paths are resolved in (Default: current)
+    wait: boolean
+        block until the job finishes
+    token: string
+        the server's token, as printed by serve
+
+    Returns
+    ---------
+    dict
+        job id and status
+    """
+    url = url.rstrip('/')
+    job = _request(url + '/jobs', {'command': command,
+                                   'args': list(args),
+                                   'cwd': cwd or os.getcwd()},
+                   token=token)
+    if not wait:
+        return job
+
+    return _request('%s/jobs/%s?wait=1' % (url, job['id']), token=token)
@@ -0,0 +1,339 @@
+"""Split a job's window plan across independent runs and merge the
+partial outputs.
+
+Shard i of n processes a contiguous band of block rows and writes a
+GeoTIFF covering only that band, tagged with its position in the scene.
+merge_shards() assembles the bands into one GeoTIFF or COG without
+recomputing, or writes a VRT over them, with the shards' band scale and
+offset and band statistics merged from theirs.
+"""
+import os
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+from rasterio.dtypes import _gdal_typename
+from rasterio.shutil import copy as rio_copy
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from rio_toa import band_stats
+from rio_toa import toa_utils
+
+
+def parse_shard(value):
+    """
+    Parse an "i/n" shard specification, 0 <= i < n
+
+    Parameters
+    -----------
+    value: string
+
+    Returns
+    --------
+    (i, n): tuple of ints
+    """
+    try:
+        i, n = [int(v) for v in value.split('/')]
+    except (AttributeError, ValueError):
+        raise ValueError('shard must be formatted as i/n, got %r' % (value, ))
+
+    if n < 1 or not 0 <= i < n:
+        raise ValueError('shard %s is not in 0/%d..%d/%d'
+                         % (value, n, n - 1, n))
+    return i, n
+
+
+def shard_windows(windows, i, n):
+    """
+    Select the windows of shard i of n
+
+    Parameters
+    -----------
+    windows: list
+        [window, ij] pairs covering the scene
+    i, n: int
+        shard index and count
+
+    Returns
+    --------
+    (windows, (row_start, row_stop))
+        the windows in the shard's band of block rows, and the band's
+        extent in scene rows
+    """
+    ranges = [toa_utils._window_ranges(w) for w, _ in windows]
+    starts = sorted(set(rows[0] for rows, _ in ranges))
+
+    if n > len(starts):
+        raise ValueError('cannot split %d block rows into %d shards'
+                         % (len(starts), n))
+
+    band = set(np.array_split(starts, n)[i].tolist())
+
+    selected = [[w, ij] for (w, ij), (rows, _) in zip(windows, ranges)
+                if rows[0] in band]
+    row_start = min(toa_utils._window_ranges(w)[0][0] for w, _ in selected)
+    row_stop = max(toa_utils._window_ranges(w)[0][1] for w, _ in selected)
+
+    return selected, (row_start, row_stop)
+
+
+def shard_profile(profile, row_start, row_stop):
+    """Destination profile of a shard covering rows row_start:row_stop"""
+    profile = profile.copy()
+    profile['height'] = row_stop - row_start
+    profile['transform'] = profile['transform'] * \
+        Affine.translation(0, row_start)
+
+    return profile
+
+
+def shard_tags(i, n, row_start, row_stop, height):
+    """Tags recording a shard's position in the full scene"""
+    return {'TOA_SHARD': '%d/%d' % (i, n),
+            'TOA_SHARD_ROWS': '%d:%d' % (row_start, row_stop),
+            'TOA_SHARD_HEIGHT': str(height)}
+
+
+def offset_window(window, row_start):
+    """Window shifted up by row_start rows"""
+    (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+    return Window(c0, r0 - row_start, c1 - c0, r1 - r0)
+
+
+def _read_shards(shard_paths):
+    shards = []
+    for path in shard_paths:
+        with rasterio.open(path) as src:
+            tags = src.tags()
+            if 'TOA_SHARD' not in tags:
+                raise ValueError('%s is not a rio toa shard' % path)
+
+            i, n = parse_shard(tags['TOA_SHARD'])
+            row_start, row_stop = [
+                int(r) for r in tags['TOA_SHARD_ROWS'].split(':')]
+
+            shards.append({'path': path, 'i': i, 'n': n,
+                           'rows': (row_start, row_stop),
+                           'height': int(tags['TOA_SHARD_HEIGHT']),
+                           'profile': src.profile,
+                           'tags': tags,
+                           'band_tags': [src.tags(b) for b in src.indexes],
+                           'scale_offset': (src.scales, src.offsets)})
+        shards[-1]['stats'] = band_stats.read_stats(path)
+
+    if not shards:
+        raise ValueError('no shards to merge')
+
+    shards.sort(key=lambda s: s['i'])
+    n = shards[0]['n']
+    found = [s['i'] for s in shards]
+    if any(s['n'] != n for s in shards) or found != list(range(n)):
+        raise ValueError('expected shards 0..%d of %d, found %s'
+                         % (n - 1, n, ', '.join('%d/%d' % (s['i'], s['n'])
+                                                for s in shards)))
+
+    stop = 0
+    first = shards[0]['profile']
+    for s in shards:
+        p = s['profile']
+        if s['rows'][0] != stop or \
+                (p['width'], p['count'], p['dtype'], p['crs']) != \
+                (first['width'], first['count'], first['dtype'],
+                 first['crs']) or \
+                s['scale_offset'] != shards[0]['scale_offset']:
+            raise ValueError('%s does not line up with the other shards'
+                             % s['path'])
+        stop = s['rows'][1]
+
+    if stop != shards[0]['height']:
+        raise ValueError('shards cover %d of %d rows'
+                         % (stop, shards[0]['height']))
+
+    return shards
+
+
+def _scene_profile(shards):
+    first = shards[0]
+    profile = first['profile'].copy()
+    profile['height'] = first['height']
+    profile['transform'] = profile['transform'] * \
+        Affine.translation(0, -first['rows'][0])
+
+    return profile
+
+
+def _scene_tags(shards):
+    return dict((k, v) for k, v in shards[0]['tags'].items()
+                if not k.startswith('TOA_SHARD'))
+
+
+def _scene_band_tags(shards):
+    """The first shard's band tags, with statistics merged from every
+    shard"""
+    band_tags = [dict((k, v) for k, v in tags.items()
+                      if not k.startswith('STATISTICS_') and
+                      k != 'TOA_HISTOGRAM')
+                 for tags in shards[0]['band_tags']]
+
+    profile = shards[0]['profile']
+    stats = band_stats.merge_stats([s['stats'] for s in shards],
+                                   profile['width'] * shards[0]['height'])
+    if stats is not None:
+        for tags, band in zip(band_tags, stats):
+            tags.update(band_stats.stats_tags(band))
+
+    return band_tags
+
+
+def _scene_scale_offset(shards):
+    """(scale, offset) of the shards' bands, or None when they have
+    none"""
+    scales, offsets = shards[0]['scale_offset']
+    if all(v == 1.0 for v in scales) and all(v == 0.0 for v in offsets):
+        return None
+    return scales[0], offsets[0]
+
+
+def _metadata(tags, indent):
+    if not tags:
+        return []
+    return ([indent + '<Metadata>'] +
+            [indent + '  <MDI key="%s">%s</MDI>' % (escape(k), escape(str(v)))
+             for k, v in sorted(tags.items())] +
+            [indent + '</Metadata>'])
+
+
+def write_vrt(dst_path, profile, sources, tags=None, band_tags=None,
+              scale_offset=None):
+    """
+    Write a VRT mosaicking partial outputs in place
+
+    Parameters
+    -----------
+    dst_path: string
+    profile: dict
+        profile of the whole output
+    sources: list
+        (path, window) of every partial output, where window is the
+        part of the output it covers, and all its bands are used
+    tags: dict
+        dataset metadata
+    band_tags: list
+        metadata of each band
+    scale_offset: tuple
+        (scale, offset) of every band
+
+    Returns
+    --------
+    None
+    """
+    dst_dir = os.path.dirname(os.path.abspath(dst_path))
+    gt = profile['transform'].to_gdal()
+    band_tags = band_tags or []
+
+    lines = ['<VRTDataset rasterXSize="%d" rasterYSize="%d">'
+             % (profile['width'], profile['height'])]
+    if profile['crs']:
+        lines.append('  <SRS>%s</SRS>' % escape(profile['crs'].to_wkt()))
+    lines.append('  <GeoTransform>%s</GeoTransform>'
+                 % ', '.join(repr(float(v)) for v in gt))
+    lines.extend(_metadata(tags, '  '))
+
+    for bidx in range(1, profile['count'] + 1):
+        lines.append('  <VRTRasterBand dataType="%s" band="%d">'
+                     % (_gdal_typename(profile['dtype']), bidx))
+        if bidx <= len(band_tags):
+            lines.extend(_metadata(band_tags[bidx - 1], '    '))
+        if profile['nodata'] is not None:
+            lines.append('    <NoDataValue>%r</NoDataValue>'
+                         % float(profile['nodata']))
+        if scale_offset is not None:
+            lines.extend(['    <Offset>%r</Offset>' % float(scale_offset[1]),
+                          '    <Scale>%r</Scale>' % float(scale_offset[0])])
+
+        for path, window in sources:
+            (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+            source = os.path.relpath(os.path.abspath(path), dst_dir)
+            rect = 'xOff="%d" yOff="%d" xSize="%d" ySize="%d"'
+            lines.extend([
+                '    <SimpleSource>',
+                '      <SourceFilename relativeToVRT="1">%s</SourceFilename>'
+                % escape(source),
+                '      <SourceBand>%d</SourceBand>' % bidx,
+                '      <SrcRect %s/>' % (rect % (0, 0, c1 - c0, r1 - r0)),
+                '      <DstRect %s/>' % (rect % (c0, r0, c1 - c0, r1 - r0)),
+                '    </SimpleSource>'])
+
+        lines.append('  </VRTRasterBand>')
+    lines.append('</VRTDataset>')
+
+    with open(dst_path, 'w') as dst:
+        dst.write('\n'.join(lines) + '\n')
+
+
+def _write_vrt(shards, dst_path):
+    profile = _scene_profile(shards)
+    write_vrt(dst_path, profile,
+              [(s['path'], Window(0, s['rows'][0], profile['width'],
+                                  s['rows'][1] - s['rows'][0]))
+               for s in shards],
+              tags=_scene_tags(shards), band_tags=_scene_band_tags(shards),
+              scale_offset=_scene_scale_offset(shards))
+
+
+def _write_gtiff(shards, dst_path, creation_options):
+    profile = _scene_profile(shards)
+    profile['driver'] = 'GTiff'
+    profile.update(creation_options)
+
+    with rasterio.open(dst_path, 'w', **profile) as dst:
+        dst.update_tags(**_scene_tags(shards))
+        for bidx, tags in enumerate(_scene_band_tags(shards), 1):
+            dst.update_tags(bidx, **tags)
+        if _scene_scale_offset(shards) is not None:
+            dst.scales, dst.offsets = shards[0]['scale_offset']
+        for s in shards:
+            with rasterio.open(s['path']) as src:
+                for _, window in src.block_windows(1):
+                    dst.write(src.read(window=window),
+                              window=offset_window(window, -s['rows'][0]))
+
+
+def merge_shards(shard_paths, dst_path, creation_options=None,
+                 driver='GTiff'):
+    """
+    Assemble the partial outputs of a sharded job
+
+    Parameters
+    -----------
+    shard_paths: list
+        every shard's output, in any order
+    dst_path: string
+    creation_options: dict
+        GeoTIFF or COG creation options
+    driver: string
+        "GTiff", "COG", or "VRT" to reference the shards in place
+
+    Returns
+    --------
+    None
+        Output is written to dst_path
+    """
+    creation_options = creation_options or {}
+    shards = _read_shards(shard_paths)
+
+    if driver == 'VRT':
+        _write_vrt(shards, dst_path)
+    elif driver == 'COG':
+        tmp_path = dst_path + '.tmp.tif'
+        try:
+            _write_gtiff(shards, tmp_path, {})
+            rio_copy(tmp_path, dst_path, driver='COG', **creation_options)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    elif driver == 'GTiff':
+        _write_gtiff(shards, dst_path, creation_options)
+    else:
+        raise ValueError('driver must be one of: ["GTiff", "COG", "VRT"]')
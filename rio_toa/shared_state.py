@@ -0,0 +1,160 @@
+"""Publish large read-only per-scene arrays to workers once.
+
+Arrays in global_args above a size threshold are replaced by small
+descriptors before global_args is handed to the worker pool. Each worker
+attaches to the same memory by name, so worker memory does not grow with
+the number of processes.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# arrays smaller than this are cheaper to pickle
+MIN_SHARED_BYTES = 1 << 20
+
+
+class SharedArray(object):
+    """Descriptor of a published array: a shared memory block name,
+    or the path of a .npy scratch file.
+    """
+
+    def __init__(self, shape, dtype, name=None, path=None):
+        self.shape = shape
+        self.dtype = dtype
+        self.name = name
+        self.path = path
+
+
+class Publication(object):
+    """Owns the shared memory blocks and scratch files of a publish()"""
+
+    def __init__(self):
+        self.blocks = []
+        self.tmpdir = None
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+
+def _publish_array(arr, publication, use_shm):
+    arr = np.ascontiguousarray(arr)
+
+    if use_shm:
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        publication.blocks.append(shm)
+        return SharedArray(arr.shape, arr.dtype.str, name=shm.name)
+
+    if publication.tmpdir is None:
+        publication.tmpdir = tempfile.mkdtemp(prefix='rio_toa_')
+    path = os.path.join(publication.tmpdir, '%s.npy' % len(os.listdir(
+        publication.tmpdir)))
+    np.save(path, arr)
+    return SharedArray(arr.shape, arr.dtype.str, path=path)
+
+
+def publish(global_args, min_bytes=MIN_SHARED_BYTES, use_shm=None):
+    """
+    Replace large arrays in global_args (and in nested dicts) with
+    SharedArray descriptors
+
+    Parameters
+    -----------
+    global_args: dict
+        worker global arguments
+    min_bytes: int
+        arrays at least this large are published
+    use_shm: boolean
+        use shared memory (Default: when available), else memory-mapped
+        scratch files
+
+    Returns
+    --------
+    (global_args, Publication)
+        a copy of global_args with descriptors, and the publication to
+        close once the workers are done
+    """
+    if use_shm is None:
+        use_shm = shared_memory is not None
+
+    publication = Publication()
+
+    def walk(args):
+        out = {}
+        for k, v in args.items():
+            if isinstance(v, dict):
+                out[k] = walk(v)
+            elif isinstance(v, np.ndarray) and v.nbytes >= min_bytes:
+                out[k] = _publish_array(v, publication, use_shm)
+            else:
+                out[k] = v
+        return out
+
+    try:
+        return walk(global_args), publication
+    except Exception:
+        publication.close()
+        raise
+
+
+# blocks attached in this process, kept open for its lifetime
+_attached = {}
+
+
+def _attach_array(desc):
+    if desc.path is not None:
+        return np.load(desc.path, mmap_mode='r')
+
+    if desc.name not in _attached:
+        _attached[desc.name] = shared_memory.SharedMemory(name=desc.name)
+    arr = np.ndarray(desc.shape, dtype=desc.dtype,
+                     buffer=_attached[desc.name].buf)
+    arr.flags.writeable = False
+    return arr
+
+
+def attach(global_args):
+    """
+    Resolve SharedArray descriptors in global_args to read-only arrays
+
+    Parameters
+    -----------
+    global_args: dict
+        output of publish()
+
+    Returns
+    --------
+    dict
+        global_args with arrays viewing the published memory
+    """
+    out = {}
+    for k, v in global_args.items():
+        if isinstance(v, dict):
+            out[k] = attach(v)
+        elif isinstance(v, SharedArray):
+            out[k] = _attach_array(v)
+        else:
+            out[k] = v
+    return out
+
+
+def detach():
+    """Close the blocks attached in this process"""
+    for shm in _attached.values():
+        shm.close()
+    _attached.clear()
@@ -0,0 +1,246 @@
+"""Derive the output stretch from a sample of the scene.
+
+Before the main pass, an evenly spaced subset of the job's windows
+(a few percent of the scene) is computed with the job's own worker,
+with rescaling and clipping turned off so that it returns plain TOA
+values. Inputs with overviews skip windows that look empty at overview
+resolution. While the sample holds fewer than MIN_PIXELS valid pixels
+it is doubled with windows not sampled yet. DN 0 is fill unless the
+inputs have another nodata value. Percentiles of the valid values give
+a linear stretch (min, max) that the main pass maps to 0..rescale_factor
+before casting (see toa_utils.rescale). With a low percentile of 0 the
+stretch starts at 0, i.e. it only replaces the rescale factor.
+"""
+import logging
+
+import numpy as np
+import rasterio
+import riomucho
+
+from rio_toa import executor
+from rio_toa import preview as toa_preview
+from rio_toa import toa_utils
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (0.0, 99.5)
+SAMPLE = 0.02
+MIN_PIXELS = 10000
+
+
+def sample_windows(windows, fraction=SAMPLE):
+    """
+    Evenly spaced subset of a job's windows, each picked from the middle
+    of its share of the list, so that the scene's corners (often fill)
+    are not favoured
+
+    Parameters
+    -----------
+    windows: list
+        [window, ij] pairs covering the scene
+    fraction: float
+        share of the windows to select, at least one
+
+    Returns
+    --------
+    list
+        [window, ij] pairs
+    """
+    count = min(len(windows), max(1, int(np.ceil(fraction * len(windows)))))
+    step = len(windows) / float(count)
+
+    return [windows[int((i + 0.5) * step)] for i in range(count)]
+
+
+def valid_windows(src_path, windows, decimation=8):
+    """
+    The windows holding valid pixels, judged from an overview of the
+    first band
+
+    Parameters
+    -----------
+    src_path: string
+        first input of the job, on the windows' grid
+    windows: list
+        [window, ij] pairs
+    decimation: int
+        factor the band is read at, from its overviews
+
+    Returns
+    --------
+    list
+        [window, ij] pairs; all of windows when none looks valid, or
+        when the input has no overviews, as the band would be read in
+        full
+    """
+    with rasterio.open(src_path) as src:
+        if not src.overviews(1):
+            return list(windows)
+        shape = (max(1, src.height // decimation),
+                 max(1, src.width // decimation))
+        # DN 0 is Landsat's fill when no nodata is set
+        nodata = 0 if src.nodata is None else src.nodata
+        valid = src.read(1, out_shape=shape) != nodata
+        scale_y = float(shape[0]) / src.height
+        scale_x = float(shape[1]) / src.width
+
+    found = []
+    for window, ij in windows:
+        (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+        rows = slice(int(r0 * scale_y), max(int(r0 * scale_y) + 1,
+                                            int(np.ceil(r1 * scale_y))))
+        cols = slice(int(c0 * scale_x), max(int(c0 * scale_x) + 1,
+                                            int(np.ceil(c1 * scale_x))))
+        if valid[rows, cols].any():
+            found.append([window, ij])
+
+    return found or list(windows)
+
+
+def sample_values(inpaths, worker, global_args, windows, mode='simple_read',
+                  preview=None, warp=None):
+    """
+    Compute TOA values of some windows with a job's worker
+
+    Parameters
+    -----------
+    inpaths: list
+        the job's inputs
+    worker: function
+        the job's worker, with signature (data, window, ij, global_args)
+    global_args: dict
+        the job's global_args; rescaling and clipping are turned off
+    windows: list
+        [window, ij] pairs to compute
+    mode: string
+        the job's riomucho read mode
+    preview: int
+        the job's preview scale
+    warp: dict
+        the job's destination grid, when reprojecting
+
+    Returns
+    --------
+    ndarray
+        float32 values of every valid pixel; 0 (the kernels' nodata
+        and masked value) and NaN are left out, as is DN 0 when the
+        inputs have no nodata
+    """
+    src_nodata = global_args.get('src_nodata')
+    g_args = dict(global_args, rescale_factor=1.0, clip=False,
+                  dst_dtype=np.float32, stretch=None,
+                  src_nodata=0 if src_nodata is None else src_nodata)
+    executor._init_worker(inpaths, g_args, preview=preview, warp=warp)
+    task = executor._task(worker, mode)
+
+    values = []
+    try:
+        for window, ij in windows:
+            out = task((window, ij, None, None))[0]
+            out = out[np.isfinite(out) & (out != 0)]
+            values.append(out.astype(np.float32))
+    finally:
+        executor._close_worker()
+
+    return np.concatenate(values) if values else np.array([], np.float32)
+
+
+def derive_stretch(inpaths, worker, global_args, windows=None,
+                   mode='simple_read', percentiles=PERCENTILES,
+                   fraction=SAMPLE, preview=None, warp=None):
+    """
+    Choose a stretch for a job from a sample of its windows
+
+    Parameters
+    -----------
+    inpaths: list
+    worker: function
+    global_args: dict
+        the job's global_args, including rescale_factor
+    windows: list
+        [window, ij] pairs of the whole scene (Default: block windows
+        of the first input, or windows of the preview or warp grid);
+        shards sample the whole scene, so that they all get the same
+        stretch
+    mode: string
+    percentiles: tuple
+        (low, high) percentiles of the sampled values mapped to 0 and
+        to rescale_factor; a low percentile of 0 keeps 0 at 0
+    fraction: float
+        share of the windows to sample
+    preview: int
+        the job's preview scale (see rio_toa.preview)
+    warp: dict
+        the job's destination grid (see rio_toa.reproject)
+
+    Returns
+    --------
+    (stretch, tags)
+        stretch is a (min, max) tuple of TOA values, or None when the
+        sample holds no valid pixels; tags record the choice for the
+        output's metadata
+    """
+    low, high = percentiles
+    if not 0 <= low < high <= 100:
+        raise ValueError('percentiles must satisfy 0 <= low < high <= 100, '
+                         'got %s' % (percentiles, ))
+
+    if not windows and warp:
+        windows = toa_preview.preview_windows(warp)
+    elif not windows and preview:
+        windows = toa_preview.preview_windows(toa_preview.preview_profile(
+            riomucho.utils.getOptions(inpaths[0]), preview))
+    elif not windows:
+        windows = riomucho.utils.getWindows(inpaths[0])
+
+    # preview and warp windows are not on the inputs' grid
+    candidates = windows if preview or warp else \
+        valid_windows(inpaths[0], windows)
+    # indexes of the candidates sampled so far, and not yet
+    remaining = list(range(len(candidates)))
+    sampled, values, count = [], [], 0
+    while remaining:
+        new = sample_windows(remaining, fraction)
+        values.append(sample_values(inpaths, worker, global_args,
+                                    [candidates[i] for i in new], mode,
+                                    preview, warp))
+        count += values[-1].size
+        sampled.extend(new)
+        new = set(new)
+        remaining = [i for i in remaining if i not in new]
+        if count >= MIN_PIXELS or not remaining:
+            break
+        # double the sample with windows it does not hold yet
+        fraction = float(len(sampled)) / len(remaining)
+
+    values = np.concatenate(values)
+    sample = [candidates[i] for i in sorted(sampled)]
+
+    pixels = sum(int(np.prod(toa_utils._window_shape(w))) for w, _ in windows)
+    sampled = sum(int(np.prod(toa_utils._window_shape(w))) for w, _ in sample)
+
+    if not values.size:
+        logger.warning('auto rescale: no valid pixels in %d sampled windows, '
+                       'keeping the rescale factor', len(sample))
+        return None, {}
+
+    vmin = float(np.percentile(values, low)) if low > 0 else 0.0
+    vmax = float(np.percentile(values, high))
+    if vmax <= vmin:
+        logger.warning('auto rescale: sampled values are constant, '
+                       'keeping the rescale factor')
+        return None, {}
+
+    factor = global_args['rescale_factor'] / (vmax - vmin)
+    tags = {'TOA_STRETCH_MIN': repr(vmin),
+            'TOA_STRETCH_MAX': repr(vmax),
+            'TOA_STRETCH_PERCENTILES': '%r,%r' % (float(low), float(high)),
+            'TOA_RESCALE_FACTOR': repr(factor),
+            'TOA_RESCALE_OFFSET': repr(0.0 - vmin * factor),
+            'TOA_AUTO_RESCALE_SAMPLE': '%d/%d windows, %.2f%% of pixels' % (
+                len(sample), len(windows), 100.0 * sampled / pixels)}
+
+    logger.info('auto rescale: stretch %.6g..%.6g from %s', vmin, vmax,
+                tags['TOA_AUTO_RESCALE_SAMPLE'])
+
+    return (vmin, vmax), tags
@@ -0,0 +1,162 @@
+"""Per-window tile outputs, assembled by a VRT.
+
+With driver "VRT", every window is written as its own small GeoTIFF in
+a directory next to the output (out.vrt -> out_tiles/), by the worker
+that computed it, so that compression and writes run on every core
+instead of in the single writer process. When all windows are done the
+parent writes the output VRT over the tiles, with the job's tags,
+statistics, nodata and scale and offset. concat_tiles() copies the
+mosaic into one tiled GeoTIFF when a single file is needed.
+"""
+import functools
+import os
+import shutil
+
+import rasterio
+from rasterio import windows as rio_windows
+from rasterio.shutil import copy as rio_copy
+
+from rio_toa import preview
+from rio_toa import shards
+from rio_toa import toa_utils
+
+
+def tiles_dir(path):
+    """Directory holding the tiles of the VRT output path"""
+    return os.path.splitext(path)[0] + '_tiles'
+
+
+def tile_path(directory, window):
+    """Tile file of a window, named by its row and column offsets"""
+    (r0, _), (c0, _) = toa_utils._window_ranges(window)
+    return os.path.join(directory, 'r%d_c%d.tif' % (r0, c0))
+
+
+def tile_profile(profile, window):
+    """
+    GeoTIFF profile of one window's tile
+
+    Parameters
+    -----------
+    profile: dict
+        profile of the whole output; its creation options (compression,
+        block size) apply to each tile
+    window: Window
+
+    Returns
+    --------
+    dict
+    """
+    rows, cols = toa_utils._window_shape(window)
+    profile = profile.copy()
+    profile.update(driver='GTiff', height=rows, width=cols,
+                   transform=rio_windows.transform(window,
+                                                   profile['transform']))
+
+    return preview.fit_blocks(profile)
+
+
+class TileWriter(object):
+    """Writes each window to its own GeoTIFF, with the parts of
+    rasterio's writer interface the Executor uses: write(),
+    update_tags() and close(). Closing the writer that created the
+    output writes the VRT over the tiles.
+
+    reopen opens the writer again in a worker process, for windows to
+    be written concurrently.
+
+    Parameters
+    ----------
+    path : str
+        output VRT
+    profile : dict
+        destination profile
+    windows : list
+        [window, ij] pairs of the job; None in workers, which only
+        write tiles
+    """
+
+    reopen = None
+
+    def __init__(self, path, profile, windows=None):
+        self.path = path
+        self.profile = profile
+        self.windows = windows
+        self.directory = tiles_dir(path)
+        self.tags = {}
+        self.band_tags = [{} for _ in range(profile['count'])]
+        self.scale_offset = None
+
+        if windows is not None:
+            # tiles of an earlier run may not match these windows
+            if os.path.isdir(self.directory):
+                shutil.rmtree(self.directory)
+            os.makedirs(self.directory)
+            self.reopen = functools.partial(TileWriter, path, profile)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        if ext_t is None:
+            self.close()
+
+    def close(self):
+        if self.windows is None:
+            return
+        shards.write_vrt(self.path, self.profile,
+                         [(tile_path(self.directory, w), w)
+                          for w, _ in self.windows],
+                         tags=self.tags, band_tags=self.band_tags,
+                         scale_offset=self.scale_offset)
+
+    def write(self, arr, window=None):
+        with rasterio.open(tile_path(self.directory, window), 'w',
+                           **tile_profile(self.profile, window)) as dst:
+            dst.write(arr)
+
+    def update_tags(self, bidx=0, **tags):
+        """Merge tags into the dataset's (bidx 0) or a band's tags"""
+        tags = dict((k, str(v)) for k, v in tags.items())
+        if bidx:
+            self.band_tags[bidx - 1].update(tags)
+        else:
+            self.tags.update(tags)
+
+    def set_scale_offset(self, scale, offset):
+        """Record the linear conversion of stored values to TOA units,
+        as the VRT bands' Scale and Offset"""
+        self.scale_offset = (scale, offset)
+
+
+def create(path, profile, windows):
+    """Create a tiled VRT output for windows"""
+    return TileWriter(path, profile, windows)
+
+
+def concat_tiles(vrt_path, dst_path, creation_options=None):
+    """
+    Copy a tiled VRT output into one tiled GeoTIFF, with its metadata
+
+    Parameters
+    -----------
+    vrt_path: string
+    dst_path: string
+    creation_options: dict
+        GeoTIFF creation options (Default: 256 x 256 tiles, compressed
+        with every core)
+
+    Returns
+    --------
+    None
+        Output is written to dst_path
+    """
+    options = {'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+               'compress': 'deflate', 'num_threads': 'ALL_CPUS'}
+    with rasterio.open(vrt_path) as src:
+        if src.width < 256 or src.height < 256:
+            for key in ['tiled', 'blockxsize', 'blockysize']:
+                options.pop(key)
+    options.update(creation_options or {})
+
+    rio_copy(vrt_path, dst_path, driver='GTiff', **options)
@@ -1,4 +1,6 @@
+import copy
 import json
+import os
 import re
 
 import numpy as np
@@ -16,6 +18,137 @@ def _parse_bands_from_filename(filenames, template):
     return bands
 
 
+def _read_plan(src_counts, bands, src_bands=None):
+    """
+    Map L8 bands onto (file, band index) reads
+
+    Parameters
+    -----------
+    src_counts: list
+        band count of each input file, in order
+    bands: list
+        L8 band numbers to read, in order
+    src_bands: list
+        L8 band numbers of every input band, in order (Default: bands,
+        i.e. every input band is read)
+
+    Returns
+    --------
+    read_plan: list
+        list of (file index, [band indexes]) tuples, reading bands in
+        order
+    """
+    if src_bands is None:
+        src_bands = bands
+    if sum(src_counts) != len(src_bands):
+        raise ValueError('%s L8 bands were given for %s input bands'
+                         % (len(src_bands), sum(src_counts)))
+
+    positions = [(i, bidx) for i, count in enumerate(src_counts)
+                 for bidx in range(1, count + 1)]
+    located = {}
+    for band, position in zip(src_bands, positions):
+        located.setdefault(band, position)
+
+    read_plan = []
+    for band in bands:
+        if band not in located:
+            raise ValueError('L8 band %s is not one of the input bands %s'
+                             % (band, ', '.join(str(b) for b in src_bands)))
+        i, bidx = located[band]
+        if read_plan and read_plan[-1][0] == i:
+            read_plan[-1][1].append(bidx)
+        else:
+            read_plan.append((i, [bidx]))
+
+    return read_plan
+
+
+def _as_list(value):
+    """A path or band given alone, as a one item list"""
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _band_constants(mtl, keys, bands, dtype=np.float32):
+    """
+    Per band MTL constants, shaped to broadcast over (bands, rows, cols)
+
+    Parameters
+    -----------
+    mtl: dict
+        parsed Landsat 8 MTL metadata
+    keys: iterable
+        keys of the constant, without the band number
+    bands: list
+        L8 band numbers
+    dtype: numpy dtype
+
+    Returns
+    --------
+    ndarray
+        array of shape (bands, 1, 1)
+    """
+    return np.array([_load_mtl_key(mtl, keys, b) for b in bands],
+                    dtype=dtype).reshape(-1, 1, 1)
+
+
+def _window_ranges(window):
+    if hasattr(window, 'toranges'):
+        window = window.toranges()
+
+    (row_start, row_stop), (col_start, col_stop) = window
+    return (int(row_start), int(row_stop)), (int(col_start), int(col_stop))
+
+
+def _window_shape(window):
+    (row_start, row_stop), (col_start, col_stop) = _window_ranges(window)
+    return row_stop - row_start, col_stop - col_start
+
+
+def _read_window(open_files, read_plan, window, dtype, out=None):
+    """
+    Read a window of all planned bands into one (bands, rows, cols)
+    array with one read per input file. A plan of one file is returned
+    as its reader gives it, e.g. as a read-only view of a memory mapped
+    input (see rio_toa.memmap_reader), without a copy.
+
+    Parameters
+    -----------
+    open_files: list
+        rasterio open files
+    read_plan: list
+        (file index, [band indexes]) tuples from _read_plan
+    window: tuple or Window
+        window to read
+    dtype: numpy dtype
+        source data type
+    out: ndarray
+        (bands, rows, cols) array of dtype to read into (Default: a new
+        one); callers reusing one across windows must not keep the
+        arrays they get back
+
+    Returns
+    --------
+    ndarray
+        (bands, rows, cols) array of source pixels
+    """
+    if out is None and len(read_plan) == 1:
+        i, indexes = read_plan[0]
+        return open_files[i].read(indexes, window=window)
+
+    if out is None:
+        depth = sum(len(indexes) for _, indexes in read_plan)
+        out = np.empty((depth,) + _window_shape(window), dtype=dtype)
+
+    offset = 0
+    for i, indexes in read_plan:
+        open_files[i].read(indexes, window=window,
+                           out=out[offset:offset + len(indexes)])
+        offset += len(indexes)
+
+    return out
+
+
 def _load_mtl_key(mtl, keys, band=None):
     """
     Loads requested metadata from a Landsat MTL dict
@@ -47,12 +180,58 @@ def _load_mtl_key(mtl, keys, band=None):
     return mtl
 
 
+# parsed MTLs keyed by (path, mtime); None disables caching
+_mtl_cache = None
+
+
 def _load_mtl(src_mtl):
-    with open(src_mtl) as src:
-        if src_mtl.split('.')[-1] == 'json':
-            return json.loads(src.read())
-        else:
-            return _parse_mtl_txt(src.read())
+    if isinstance(src_mtl, dict):
+        # already parsed, e.g. by rio_toa.Scene
+        return copy.deepcopy(src_mtl)
+
+    if _mtl_cache is not None and _mtl_url(src_mtl) is None:
+        key = (os.path.abspath(src_mtl), os.path.getmtime(src_mtl))
+        if key not in _mtl_cache:
+            _mtl_cache[key] = _read_mtl(src_mtl)
+        return copy.deepcopy(_mtl_cache[key])
+
+    return _read_mtl(src_mtl)
+
+
+def _mtl_url(src_mtl):
+    """HTTP(S) URL of an MTL given as a URL or /vsicurl/ path, or None"""
+    if src_mtl.startswith('/vsicurl/'):
+        src_mtl = src_mtl[len('/vsicurl/'):]
+    if src_mtl.startswith(('http://', 'https://')):
+        return src_mtl
+    return None
+
+
+def _read_mtl(src_mtl):
+    from rio_toa import bundle
+    if bundle.is_bundle(src_mtl):
+        return bundle.read_mtl(src_mtl)
+
+    url = _mtl_url(src_mtl)
+    if url is not None:
+        # imported here so that loading the rio plugin does not pay for it
+        try:
+            from urllib.request import urlopen
+        except ImportError:
+            from urllib2 import urlopen
+        response = urlopen(url)
+        try:
+            text = response.read().decode('utf-8')
+        finally:
+            response.close()
+    else:
+        with open(src_mtl) as src:
+            text = src.read()
+
+    if src_mtl.split('.')[-1] == 'json':
+        return json.loads(text)
+    else:
+        return _parse_mtl_txt(text)
 
 
 def _parse_mtl_txt(mtltxt):
@@ -118,10 +297,14 @@ def _get_bounds_from_metadata(product_metadata):
     return [min(lngs), min(lats), max(lngs), max(lats)]
 
 
-def rescale(arr, rescale_factor, dtype, clip=True):
-    """Convert an array from 0..1 to dtype, scaling up linearly
+def rescale(arr, rescale_factor, dtype, clip=True, stretch=None):
+    """Convert an array from 0..1 to dtype, scaling up linearly.
+    With a (min, max) stretch, min..max is mapped to 0..1 first.
     """
     arr = arr.copy()  # avoid mutating the original data
+    if stretch is not None:
+        arr -= stretch[0]
+        arr /= stretch[1] - stretch[0]
     if clip:
         arr[arr < 0.0] = 0.0
         arr[arr > 1.0] = 1.0
@@ -138,6 +321,21 @@ def rescale(arr, rescale_factor, dtype, clip=True):
     return arr.astype(dtype)
 
 
+def scale_offset(rescale_factor, stretch=None):
+    """(scale, offset) converting values written by rescale() back to
+    TOA units, as value * scale + offset; None when they are identical
+    """
+    if stretch is None:
+        scale, offset = 1.0 / rescale_factor, 0.0
+    else:
+        scale = (stretch[1] - stretch[0]) / float(rescale_factor)
+        offset = float(stretch[0])
+
+    if (scale, offset) == (1.0, 0.0):
+        return None
+    return scale, offset
+
+
 def temp_rescale(arr, temp_scale):
     if temp_scale == 'K':
         return arr
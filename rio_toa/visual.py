@@ -0,0 +1,101 @@
+"""Visual products: TOA reflectance, color correction and 8-bit encoding
+in one pass.
+
+Each window's reflectance is color corrected (see rio_toa.color) in the
+worker, in memory, and rescaled to uint8 before it is written to a
+JPEG or WEBP compressed RGB GeoTIFF, with no intermediate uint16 output.
+Windows cover whole output tiles, so that no tile is compressed twice.
+"""
+from rio_toa import color
+from rio_toa.reflectance import calculate_landsat_reflectance
+
+
+COMPRESSIONS = ('jpeg', 'webp', 'deflate')
+
+
+def visual_options(compress='jpeg', quality=90, blocksize=256):
+    """
+    Creation options of a visual product
+
+    Parameters
+    -----------
+    compress: string
+        one of COMPRESSIONS
+    quality: int
+        JPEG or WEBP quality, 1..100
+    blocksize: int
+
+    Returns
+    --------
+    dict
+    """
+    if compress not in COMPRESSIONS:
+        raise ValueError('compress must be one of %s'
+                         % ', '.join(COMPRESSIONS))
+
+    options = {'tiled': True, 'blockxsize': blocksize,
+               'blockysize': blocksize, 'interleave': 'pixel',
+               'compress': compress}
+    if compress == 'jpeg':
+        options.update(photometric='ycbcr', jpeg_quality=quality)
+    elif compress == 'webp':
+        options.update(webp_level=quality)
+
+    return options
+
+
+def calculate_landsat_visual(src_paths, src_mtl, dst_path, bands=(4, 3, 2),
+                             processes=4, pixel_sunangle=False,
+                             operations=None, compress='jpeg', quality=90,
+                             creation_options=None, qa_path=None,
+                             qa_flags=None, prefetch=0, stats=False,
+                             preview_scale=None, dst_crs=None, dst_res=None,
+                             target_aligned_pixels=False, scene=None):
+    """
+    Parameters
+    ------------
+    src_paths: list of strings
+        band files, or a USGS .tar.gz bundle (see rio_toa.bundle)
+    src_mtl: string or dict
+    dst_path: string
+    bands: list
+        L8 bands of red, green and blue
+    processes: integer
+    pixel_sunangle: boolean
+    operations: string or list
+        color operations, e.g. "gamma 1.1 sigmoidal 10 0.15 saturation
+        1.3" (see rio_toa.color.parse_operations), applied in order
+    compress: string
+        "jpeg", "webp" or "deflate"
+    quality: int
+        JPEG or WEBP quality
+    creation_options: dict
+        overrides the compression's creation options (see
+        visual_options)
+    qa_path, qa_flags, prefetch, stats, preview_scale, dst_crs,
+    dst_res, target_aligned_pixels, scene:
+        as for rio_toa.reflectance.calculate_landsat_reflectance
+
+    Returns
+    ---------
+    list
+        per band statistics, or None without stats; output is written
+        to dst_path
+    """
+    if len(bands) != 3:
+        raise ValueError('visual products have 3 (RGB) bands, got %d'
+                         % len(bands))
+
+    if isinstance(operations, str):
+        operations = color.parse_operations(operations)
+
+    options = visual_options(compress, quality)
+    options.update(creation_options or {})
+
+    return calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, 255, options, list(bands), 'uint8',
+        processes, pixel_sunangle, True, qa_path=qa_path, qa_flags=qa_flags,
+        prefetch=prefetch, stats=stats, preview_scale=preview_scale,
+        dst_crs=dst_crs, dst_res=dst_res,
+        target_aligned_pixels=target_aligned_pixels,
+        color_ops=operations or None, scene=scene)
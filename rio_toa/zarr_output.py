@@ -0,0 +1,177 @@
+"""Zarr output, written chunk by chunk by the workers.
+
+The output is a (band, y, x) array in a local directory store, chunked
+like the job's windows so that each window is exactly one chunk. When
+the windows line up with the chunks, every worker writes its own chunks
+and the parent process only collects statistics. Georeferencing,
+nodata, tags and the scale and offset that convert stored values back
+to TOA units are kept in the array's attributes.
+
+Requires the optional zarr package (pip install rio-toa[zarr]).
+"""
+import functools
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+import numpy as np
+
+from rio_toa import toa_utils
+
+
+def _require_zarr():
+    if zarr is None:
+        raise ImportError('Zarr output requires the zarr package: '
+                          'pip install rio-toa[zarr]')
+
+
+def window_chunks(windows, count):
+    """
+    (bands, rows, cols) chunk shape of the largest window
+
+    Parameters
+    -----------
+    windows: list
+        [window, ij] pairs
+    count: int
+        band count, all in one chunk
+
+    Returns
+    --------
+    tuple
+    """
+    rows, cols = np.max([toa_utils._window_shape(w) for w, _ in windows],
+                        axis=0)
+    return (count, int(rows), int(cols))
+
+
+def aligned(windows, chunks):
+    """Whether every window covers exactly one chunk, so that windows
+    can be written concurrently"""
+    _, chunk_rows, chunk_cols = chunks
+    for window, _ in windows:
+        (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+        if r0 % chunk_rows or c0 % chunk_cols or \
+                r1 - r0 > chunk_rows or c1 - c0 > chunk_cols:
+            return False
+    return True
+
+
+class ZarrWriter(object):
+    """Writes windows to a Zarr array with the parts of rasterio's
+    writer interface the Executor uses: write(), update_tags() and
+    close().
+
+    reopen, when set, opens the array again in a worker process, for
+    windows to be written concurrently.
+
+    Parameters
+    ----------
+    path : str
+        directory store
+    profile : dict
+        destination profile (count, height, width, dtype, nodata, crs,
+        transform); required when creating the array
+    chunks : tuple
+        (bands, rows, cols) chunk shape, when creating the array
+    mode : str
+        "w" creates (replacing any existing array), "r+" opens one
+    """
+
+    reopen = None
+
+    def __init__(self, path, profile=None, chunks=None, mode='w'):
+        _require_zarr()
+        self.path = path
+
+        if mode == 'w':
+            nodata = profile.get('nodata')
+            self.array = zarr.open_array(
+                path, mode='w',
+                shape=(profile['count'], profile['height'],
+                       profile['width']),
+                chunks=chunks, dtype=np.dtype(profile['dtype']),
+                fill_value=0 if nodata is None else nodata)
+
+            crs = profile.get('crs')
+            self.array.attrs.update({
+                '_ARRAY_DIMENSIONS': ['band', 'y', 'x'],
+                'crs': crs.to_wkt() if crs else None,
+                'transform': list(profile['transform'])[:6],
+                'nodata': None if nodata is None else float(nodata),
+                'tags': {},
+                'band_tags': [{} for _ in range(profile['count'])]})
+        else:
+            self.array = zarr.open_array(path, mode=mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        self.close()
+
+    def close(self):
+        pass
+
+    def write(self, arr, window=None):
+        (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+        self.array[:, r0:r1, c0:c1] = arr
+
+    def update_tags(self, bidx=0, **tags):
+        """Merge tags into the dataset's (bidx 0) or a band's tags"""
+        tags = dict((k, str(v)) for k, v in tags.items())
+        if bidx:
+            band_tags = self.array.attrs['band_tags']
+            band_tags[bidx - 1].update(tags)
+            self.array.attrs['band_tags'] = band_tags
+        else:
+            self.array.attrs['tags'] = dict(self.array.attrs['tags'], **tags)
+
+    def set_scale_offset(self, scale, offset):
+        """Record the linear conversion of stored values to TOA units,
+        as CF scale_factor and add_offset"""
+        self.array.attrs.update({'scale_factor': scale,
+                                 'add_offset': offset})
+
+
+def create(path, profile, windows):
+    """
+    Create a Zarr output chunked like windows
+
+    Parameters
+    -----------
+    path: string
+    profile: dict
+        destination profile
+    windows: list
+        [window, ij] pairs of the job
+
+    Returns
+    --------
+    ZarrWriter
+        with reopen set when the windows line up with the chunks
+    """
+    writer = ZarrWriter(path, profile,
+                        window_chunks(windows, profile['count']))
+    if aligned(windows, writer.array.chunks):
+        writer.reopen = functools.partial(ZarrWriter, path, mode='r+')
+
+    return writer
+
+
+def read_attrs(path):
+    """
+    Attributes of a Zarr output
+
+    Parameters
+    -----------
+    path: string
+
+    Returns
+    --------
+    dict
+    """
+    _require_zarr()
+    return dict(zarr.open_array(path, mode='r').attrs)
@@ -31,9 +31,12 @@ setup(name='rio-toa',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
       zip_safe=False,
-      install_requires=["click", "rasterio", "rio-mucho"],
+      install_requires=["click", "rasterio", "rio-mucho",
+                        'futures; python_version < "3"'],
       extras_require={
-          'test': ['pytest', 'hypothesis', 'pytest-cov', 'codecov']},
+          'test': ['pytest', 'hypothesis', 'pytest-cov', 'codecov'],
+          'zarr': ['zarr>=2.5,<3'],
+          's3': ['boto3']},
       entry_points="""
       [rasterio.rio_plugins]
       toa=rio_toa.scripts.cli:toa
@@ -0,0 +1,64 @@
+import functools
+import os
+import re
+import threading
+
+import pytest
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    # python 2: tests using http_data are skipped
+    HTTPServer = None
+    SimpleHTTPRequestHandler = object
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves byte ranges, which GDAL's /vsicurl/ relies on"""
+
+    def send_head(self):
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return SimpleHTTPRequestHandler.send_head(self)
+
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        stop = min(int(match.group(2) or size - 1), size - 1)
+
+        src = open(path, 'rb')
+        src.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', 'image/tiff')
+        self.send_header('Content-Range',
+                         'bytes %s-%s/%s' % (start, stop, size))
+        self.send_header('Content-Length', str(stop - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.range_remaining = stop - start + 1
+        return src
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'range_remaining', None)
+        if remaining is None:
+            return SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+        outputfile.write(source.read(remaining))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def http_data():
+    """/vsicurl/ URL prefix of tests/data, served with byte ranges"""
+    if HTTPServer is None:
+        pytest.skip('requires python 3')
+    handler = functools.partial(RangeRequestHandler, directory='tests/data')
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield '/vsicurl/http://127.0.0.1:%s/' % server.server_address[1]
+
+    server.shutdown()
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio import warp
+from rasterio.windows import Window
+
+from rio_toa import ang_utils, reflectance
+
+
+def sun_from_angles(lng, lat, zenith, azimuth):
+    lng, lat, zenith, azimuth = np.deg2rad([lng, lat, zenith, azimuth])
+    up = np.array([np.cos(lat) * np.cos(lng),
+                   np.cos(lat) * np.sin(lng),
+                   np.sin(lat)])
+    east = np.array([-np.sin(lng), np.cos(lng), 0.0])
+    north = np.array([-np.sin(lat) * np.cos(lng),
+                      -np.sin(lat) * np.sin(lng),
+                      np.cos(lat)])
+
+    return (up * np.cos(zenith) +
+            (north * np.cos(azimuth) + east * np.sin(azimuth)) *
+            np.sin(zenith)) * 1.5e11
+
+
+def ang_txt(sun):
+    coords = ['%s = ( %.6f, %.6f,\n      %.6f )' % (
+              'SOLAR_ECEF_%s' % axis, v * 0.9999, v, v * 1.0001)
+              for axis, v in zip('XYZ', sun)]
+
+    return '\n'.join([
+        'GROUP = FILE_HEADER',
+        '  LANDSAT_SCENE_ID = "LC80460282016177LGN00"',
+        '  NUMBER_OF_BANDS = 11',
+        'END_GROUP = FILE_HEADER',
+        'GROUP = SOLAR_VECTOR',
+        '  SAMPLE_TIME = ( 0.000000, 1.000000,',
+        '      2.000000 )'] + ['  ' + c for c in coords] + [
+        'END_GROUP = SOLAR_VECTOR',
+        'END'])
+
+
+@pytest.fixture
+def ang_path(tmpdir):
+    # sun at the MTL scene centre angles of LC80460282016177LGN00
+    path = str(tmpdir.join('LC80460282016177LGN00_ANG.txt'))
+    with open(path, 'w') as dst:
+        dst.write(ang_txt(sun_from_angles(-122.35, 46.02,
+                                          90.0 - 62.58246948,
+                                          139.32619154)))
+    return path
+
+
+def test_parse_ang_txt(ang_path):
+    ang = ang_utils.load_ang(ang_path)
+
+    assert ang['FILE_HEADER']['NUMBER_OF_BANDS'] == 11
+    assert ang['SOLAR_VECTOR']['SAMPLE_TIME'] == [0.0, 1.0, 2.0]
+    assert len(ang['SOLAR_VECTOR']['SOLAR_ECEF_Z']) == 3
+
+
+def test_solar_angles_overhead():
+    sun = sun_from_angles(10.0, 20.0, 0.0, 0.0)
+    sun /= np.linalg.norm(sun)
+
+    zenith, _ = ang_utils.solar_angles(np.array([10.0, 10.0]),
+                                       np.array([20.0, 30.0]), sun)
+    assert np.allclose(zenith, [0.0, 10.0], atol=1e-6)
+
+
+def test_solar_angles_roundtrip():
+    sun = sun_from_angles(-122.0, 46.0, 27.4, 139.3)
+    sun /= np.linalg.norm(sun)
+
+    zenith, azimuth = ang_utils.solar_angles(-122.0, 46.0, sun)
+    assert np.isclose(zenith, 27.4)
+    assert np.isclose(azimuth, 139.3)
+
+
+def test_zenith_poly(ang_path):
+    ang = ang_utils.load_ang(ang_path)
+
+    with rio.open('tests/data/tiny_LC80460282016177LGN00_B2.TIF') as src:
+        poly = ang_utils.zenith_poly(ang, src.crs, src.transform, src.shape)
+        window = Window(1300, 700, 200, 100)
+        rows, cols = np.indices((window.height, window.width)) + 0.5
+        xs, ys = src.transform * (cols.ravel() + window.col_off,
+                                  rows.ravel() + window.row_off)
+        lngs, lats = warp.transform(src.crs, 'EPSG:4326', xs, ys)
+
+    exact, _ = ang_utils.solar_angles(np.array(lngs), np.array(lats),
+                                      ang_utils.sun_vector(ang))
+    fitted = ang_utils.eval_zenith_poly(poly, window)
+
+    assert fitted.shape == (100, 200)
+    assert np.abs(fitted.ravel() - exact).max() < 0.01
+
+
+def test_calculate_landsat_reflectance_ang(ang_path, tmpdir):
+    src_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+    src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+    scene_path = str(tmpdir.join('scene.tif'))
+    ang_out_path = str(tmpdir.join('ang.tif'))
+
+    reflectance.calculate_landsat_reflectance(
+        [src_path], src_mtl, scene_path, None, {}, [2], 'float32', 1, False)
+    reflectance.calculate_landsat_reflectance(
+        [src_path], src_mtl, ang_out_path, None, {}, [2], 'float32', 1, False,
+        src_ang=ang_path)
+
+    with rio.open(scene_path) as scene:
+        with rio.open(ang_out_path) as ang:
+            scene_data = scene.read(1)
+            ang_data = ang.read(1)
+
+    valid = scene_data > 0
+    ratio = ang_data[valid] / scene_data[valid]
+    assert np.abs(ratio - 1).max() < 0.05
+    assert ratio.std() > 0
@@ -0,0 +1,110 @@
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import band_stats, brightness_temp, reflectance
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+def test_hist_range():
+    assert band_stats.hist_range(np.uint8) == (-0.5, 255.5)
+    assert band_stats.hist_range('uint16') == (-0.5, 65535.5)
+    assert band_stats.hist_range(np.float32, (0, 2)) == (0.0, 2.0)
+
+
+def test_merged_windows_match_whole():
+    arr = np.random.rand(2, 100, 80).astype(np.float32)
+    arr[0, :10] = np.nan
+    arr[1, :, :5] = 0
+
+    acc = band_stats.BandStats(2, arr[0].size)
+    for rows in [slice(0, 10), slice(10, 37), slice(37, 100)]:
+        acc.add(band_stats.window_stats(arr[:, rows], nodata=0))
+    stats = acc.result()
+
+    for band, result in zip(arr, stats):
+        valid = band[~np.isnan(band) & (band != 0)].astype(np.float64)
+        assert result['count'] == valid.size
+        assert result['min'] == pytest.approx(valid.min())
+        assert result['max'] == pytest.approx(valid.max())
+        assert result['mean'] == pytest.approx(valid.mean())
+        assert result['stddev'] == pytest.approx(valid.std())
+        assert result['valid_percent'] == pytest.approx(
+            100.0 * valid.size / band.size)
+        hist, _ = np.histogram(valid, 256, (0, 1))
+        assert result['histogram']['counts'] == hist.tolist()
+
+
+def test_window_stats_empty_and_out_of_range():
+    arr = np.zeros((1, 4, 4), dtype=np.uint8)
+    assert band_stats.window_stats(arr, nodata=0)[0][0] == 0
+
+    arr = np.array([[[-5.0, 0.5, 9.0]]])
+    hist = band_stats.window_stats(arr, buckets=4)[0][5]
+    assert hist.tolist() == [1, 0, 1, 1]
+
+
+def _assert_stats_equal(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        assert x['histogram'] == y['histogram']
+        assert x['count'] == y['count']
+        for key in ['min', 'max', 'mean', 'stddev', 'valid_percent']:
+            assert x[key] == pytest.approx(y[key])
+
+
+def test_reflectance_stats(tmpdir):
+    results = []
+    for processes in [1, 2]:
+        dst_path = str(tmpdir.join('toa_%d.tif' % processes))
+        stats = reflectance.calculate_landsat_reflectance(
+            src_paths, src_mtl, dst_path, None, {}, [2, 3], 'uint16',
+            processes, False, stats=True)
+        results.append(stats)
+
+        with rio.open(dst_path) as src:
+            data = src.read().astype(np.float64)
+        for band, result in zip(data, stats):
+            assert result['min'] == band.min()
+            assert result['max'] == band.max()
+            assert result['mean'] == pytest.approx(band.mean())
+            assert result['stddev'] == pytest.approx(band.std())
+            assert sum(result['histogram']['counts']) == band.size
+
+        _assert_stats_equal(band_stats.read_stats(dst_path), stats)
+        assert not os.path.exists(band_stats.aux_path(dst_path))
+
+    _assert_stats_equal(*results)
+
+
+def test_brightness_temp_aux_xml(tmpdir):
+    dst_path = str(tmpdir.join('bt.tif'))
+    stats = brightness_temp.calculate_landsat_brightness_temperature(
+        src_paths[0], src_mtl, dst_path, 'C', {}, 10, 'float32', 1,
+        stats=True, aux_xml=True)
+
+    assert stats[0]['histogram']['min'] == pytest.approx(150 - 273.15)
+    root = ET.parse(band_stats.aux_path(dst_path)).getroot()
+    item = root.find('PAMRasterBand/Histograms/HistItem')
+    counts = [int(c) for c in item.findtext('HistCounts').split('|')]
+    assert counts == stats[0]['histogram']['counts']
+
+    mean = root.find("PAMRasterBand/Metadata/MDI[@key='STATISTICS_MEAN']")
+    assert float(mean.text) == pytest.approx(stats[0]['mean'])
+
+
+def test_no_stats(tmpdir):
+    dst_path = str(tmpdir.join('toa.tif'))
+    assert reflectance.calculate_landsat_reflectance(
+        src_paths[:1], src_mtl, dst_path, None, {}, [2], 'uint16', 1,
+        False, stats=False) is None
+
+    with rio.open(dst_path) as src:
+        assert 'STATISTICS_MEAN' not in src.tags(1)
@@ -200,3 +200,29 @@ def test_calculate_brightness_dst_dtype(test_var, capfd):
 
     with rio.open(dst_path) as created:
         assert created.meta['dtype'] == 'uint16'
+
+
+def test_calculate_brightness_temperature_dual_thermal(tmpdir):
+    # DNs of a reflective band stand in for the two TIRS bands
+    src_path = 'tests/data/tiny_LC81390452014295LGN00_B5.TIF'
+    src_mtl = 'tests/data/LC81390452014295LGN00_MTL.json'
+
+    expected = []
+    for band in [10, 11]:
+        dst_path = str(tmpdir.join('bt_%d.tif' % band))
+        brightness_temp.calculate_landsat_brightness_temperature(
+            src_path, src_mtl, dst_path, 'K', {}, band, 'float32', 1)
+        with rio.open(dst_path) as src:
+            expected.append(src.read(1))
+    assert not np.allclose(expected[0], expected[1], equal_nan=True)
+
+    dst_path = str(tmpdir.join('bt.tif'))
+    brightness_temp.calculate_landsat_brightness_temperature(
+        [src_path, src_path], src_mtl, dst_path, 'K', {}, [10, 11],
+        'float32', 2)
+    with rio.open(dst_path) as src:
+        assert src.count == 2
+        assert np.array_equal(src.read(), np.array(expected),
+                              equal_nan=True)
+        assert [src.tags(b)['TOA_BAND'] for b in src.indexes] == \
+            ['10', '11']
@@ -0,0 +1,95 @@
+import tarfile
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import bundle, cache, reflectance, toa_utils
+from rio_toa.cube import scene_paths
+
+
+scene = 'LC80460282016177LGN00'
+src_paths = ['tests/data/tiny_%s_B%d.TIF' % (scene, b) for b in [2, 3, 4]]
+src_mtl = 'tests/data/%s_MTL.json' % scene
+
+
+@pytest.fixture
+def scene_bundle(tmpdir):
+    path = str(tmpdir.join('%s.tar.gz' % scene))
+    with tarfile.open(path, 'w:gz') as tar:
+        for b, src_path in zip([2, 3, 4], src_paths):
+            tar.add(src_path, arcname='%s_B%d.TIF' % (scene, b))
+        tar.add('tests/data/tiny_%s_B2_refl.TIF' % scene,
+                arcname='%s_B2_refl.TIF' % scene)
+        tar.add(src_mtl, arcname='%s_MTL.json' % scene)
+    return path
+
+
+def test_band_members(scene_bundle):
+    assert bundle.is_bundle(scene_bundle)
+    assert not bundle.is_bundle(src_mtl)
+
+    found = bundle.band_members(scene_bundle)
+    assert sorted(found) == [2, 3, 4]
+    assert found[3] == '/vsitar/%s/%s_B3.TIF' % (scene_bundle, scene)
+    assert bundle.split_vsi_path(found[3]) == (scene_bundle,
+                                               '%s_B3.TIF' % scene)
+    assert bundle.split_vsi_path(src_paths[0]) is None
+
+    with rio.open(found[2]) as src, rio.open(src_paths[0]) as expected:
+        assert np.array_equal(src.read(), expected.read())
+
+    with pytest.raises(ValueError):
+        bundle.band_paths(scene_bundle, [2, 5])
+
+
+def test_read_mtl(scene_bundle):
+    assert toa_utils._load_mtl(scene_bundle) == toa_utils._load_mtl(src_mtl)
+
+
+def test_read_mtl_txt(tmpdir):
+    path = str(tmpdir.join('scene.tar'))
+    with tarfile.open(path, 'w') as tar:
+        tar.add('tests/data/LC80100202015018LGN00_MTL.txt',
+                arcname='LC80100202015018LGN00_MTL.txt')
+    assert bundle.read_mtl(path) == \
+        toa_utils._load_mtl('tests/data/LC80100202015018LGN00_MTL.txt')
+    assert bundle.band_members(path) == {}
+
+
+def test_resolve(scene_bundle):
+    paths, mtl = bundle.resolve(scene_bundle, None, [4, 2])
+    assert mtl == scene_bundle
+    assert [bundle.split_vsi_path(p)[1] for p in paths] == \
+        ['%s_B4.TIF' % scene, '%s_B2.TIF' % scene]
+
+    assert bundle.resolve(src_paths, src_mtl, [2, 3, 4]) == \
+        (src_paths, src_mtl)
+    with pytest.raises(ValueError):
+        bundle.resolve(src_paths, None, [2, 3, 4])
+    with pytest.raises(ValueError):
+        bundle.resolve([scene_bundle, src_paths[0]], src_mtl, [2, 3])
+
+
+def test_input_identity(scene_bundle):
+    path = bundle.band_members(scene_bundle)[2]
+    assert cache.input_identity(path) == \
+        cache.input_identity(scene_bundle) + ['%s_B2.TIF' % scene]
+
+
+def test_reflectance_bundle(tmpdir, scene_bundle):
+    expected = str(tmpdir.join('expected.tif'))
+    output = str(tmpdir.join('bundle.tif'))
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, expected, None, {}, [2, 3, 4], 'uint16', 1, True)
+    reflectance.calculate_landsat_reflectance(
+        scene_bundle, None, output, None, {}, [2, 3, 4], 'uint16', 2, True)
+
+    with rio.open(expected) as a, rio.open(output) as b:
+        assert np.array_equal(a.read(), b.read())
+        assert a.profile == b.profile
+
+
+def test_scene_paths_bundle(scene_bundle):
+    assert scene_paths(scene_bundle, [3]) == \
+        [bundle.band_members(scene_bundle)[3]]
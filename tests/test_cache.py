@@ -0,0 +1,171 @@
+import os
+import time
+
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import bundle, cache, executor, radiance, stretch
+
+
+src_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+def test_parse_size():
+    assert cache.parse_size('512') == 512
+    assert cache.parse_size('2K') == 2048
+    assert cache.parse_size('1.5M') == 1536 * 1024
+    assert cache.parse_size('20GB') == 20 * 1024 ** 3
+    assert cache.parse_size(7) == 7
+    with pytest.raises(ValueError):
+        cache.parse_size('lots')
+
+
+def test_job_key():
+    g_args = {'M': 0.01, 'A': -50.0, 'dst_dtype': np.uint16,
+              'grid': np.arange(10.0), 'qa_flags': None}
+    key = cache.job_key('radiance', [src_path], {'dtype': 'uint16'}, g_args)
+
+    assert key == cache.job_key('radiance', [src_path], {'dtype': 'uint16'},
+                                dict(g_args))
+    assert key != cache.job_key('reflectance', [src_path],
+                                {'dtype': 'uint16'}, g_args)
+    assert key != cache.job_key('radiance', [src_path], {'dtype': 'uint8'},
+                                g_args)
+    assert key != cache.job_key('radiance', [src_path], {'dtype': 'uint16'},
+                                dict(g_args, M=0.02))
+    assert key != cache.job_key('radiance', [src_path], {'dtype': 'uint16'},
+                                dict(g_args, grid=np.arange(10.0) + 1))
+
+
+def test_job_key_input_identity(tmpdir):
+    path = str(tmpdir.join('input.tif'))
+    with open(path, 'w') as f:
+        f.write('a')
+    key = cache.job_key('radiance', [path], {}, {})
+
+    with open(path, 'w') as f:
+        f.write('ab')
+    assert cache.job_key('radiance', [path], {}, {}) != key
+
+
+def _write(path, nbytes):
+    with open(path, 'wb') as f:
+        f.write(b'x' * nbytes)
+    return path
+
+
+def test_output_cache_lru(tmpdir):
+    store = cache.OutputCache(str(tmpdir.join('cache')), max_bytes=250)
+    src = _write(str(tmpdir.join('out.tif')), 100)
+
+    for key in ['aa01', 'bb02']:
+        store.store(key, src, {'product': 'radiance'})
+        time.sleep(0.01)
+
+    # a hit makes aa01 the most recently used
+    dst = str(tmpdir.join('hit.tif'))
+    assert store.fetch('aa01', dst)
+    assert open(dst, 'rb').read() == b'x' * 100
+    assert not store.fetch('cc03', dst)
+
+    time.sleep(0.01)
+    store.store('cc03', src)
+
+    keys = [e['key'] for e in store.entries()]
+    assert keys == ['aa01', 'cc03']
+    assert store.entries()[0]['info']['product'] == 'radiance'
+
+    assert store.clear() == ['aa01', 'cc03']
+    assert store.entries() == []
+
+
+def test_output_cache_link(tmpdir):
+    store = cache.OutputCache(str(tmpdir.join('cache')), link=True)
+    store.store('aa01', _write(str(tmpdir.join('out.tif')), 10))
+
+    dst = str(tmpdir.join('hit.tif'))
+    assert store.fetch('aa01', dst)
+    assert os.stat(dst).st_nlink == 2
+
+
+def _run(dst_path, store, rescale_factor=None):
+    return radiance.calculate_landsat_radiance(
+        src_path, src_mtl, dst_path, rescale_factor, {}, 2, 'uint16', 1,
+        cache=store, stats=True)
+
+
+def test_executor_cache(tmpdir, monkeypatch):
+    store = cache.OutputCache(str(tmpdir.join('cache')), link=True)
+    first = str(tmpdir.join('first.tif'))
+    stats = _run(first, store)
+    assert len(store.entries()) == 1
+
+    def fail(*args):
+        raise AssertionError('computed a cached job')
+
+    monkeypatch.setattr(executor.Executor, '_run', fail)
+
+    second = str(tmpdir.join('second.tif'))
+    cached = _run(second, store)
+    assert cached[0]['histogram'] == stats[0]['histogram']
+    assert cached[0]['mean'] == pytest.approx(stats[0]['mean'])
+    with rio.open(first) as a, rio.open(second) as b:
+        assert np.array_equal(a.read(), b.read())
+
+    # a different rescale factor is a different job
+    with pytest.raises(AssertionError):
+        _run(str(tmpdir.join('third.tif')), store, rescale_factor=1.0)
+
+    monkeypatch.undo()
+
+    # recomputing into a linked output must not touch the cached copy
+    _run(second, None, rescale_factor=1.0)
+    with rio.open(store.entries()[0]['path']) as a, rio.open(first) as b:
+        assert np.array_equal(a.read(), b.read())
+
+
+def test_executor_cache_before_auto_rescale(tmpdir, monkeypatch):
+    store = cache.OutputCache(str(tmpdir.join('cache')))
+
+    def run(dst_path, percentiles=(2, 98)):
+        radiance.calculate_landsat_radiance(
+            src_path, src_mtl, dst_path, None, {}, 2, 'uint16', 1,
+            cache=store, auto_rescale=percentiles, scale_offset=True)
+
+    first = str(tmpdir.join('first.tif'))
+    run(first)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('sampled or computed a cached job')
+
+    monkeypatch.setattr(stretch, 'derive_stretch', fail)
+    monkeypatch.setattr(executor.Executor, '_run', fail)
+
+    second = str(tmpdir.join('second.tif'))
+    run(second)
+    with rio.open(first) as a, rio.open(second) as b:
+        assert b.tags()['TOA_STRETCH_MIN'] == a.tags()['TOA_STRETCH_MIN']
+        assert b.scales == a.scales != (1.0, )
+
+    # other percentiles are another job
+    with pytest.raises(AssertionError):
+        run(str(tmpdir.join('third.tif')), percentiles=(1, 99))
+
+
+def test_remote_inputs_are_not_cached(tmpdir):
+    remote = '/vsicurl/https://example.com/LC8_B2.TIF'
+    assert cache.is_local(src_path)
+    assert not cache.is_local(remote)
+    assert not cache.is_local(bundle.vsi_path('missing.tar.gz', 'a.TIF'))
+
+    store = cache.OutputCache(str(tmpdir.join('cache')))
+    with rio.open(src_path) as src:
+        options = src.profile
+    ex = executor.Executor([remote], str(tmpdir.join('out.tif')),
+                           lambda *args: None, options=options,
+                           windows=[[Window(0, 0, 8, 8), (0, 0)]],
+                           cache=store)
+    assert ex.cache is None
@@ -197,3 +197,340 @@ def test_cli_parsemtl_fail(tmpdir):
               parsemtl,
               ['tests/data/tiny_mtltest_LC80100202015018LGN00_MTL.txt'])
     assert result.exit_code != 0
+
+
+def test_cli_lazy_imports():
+    import subprocess
+    import sys
+
+    code = '\n'.join([
+        'import sys',
+        'import rio_toa.scripts.cli',
+        'loaded = [m for m in ("riomucho", "rasterio.warp",',
+        '                      "rio_toa.reflectance", "rio_toa.radiance",',
+        '                      "rio_toa.brightness_temp") if m in sys.modules]',
+        'assert not loaded, loaded'])
+
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_cli_shard_merge(tmpdir):
+    from rio_toa.scripts.cli import merge
+
+    runner = CliRunner()
+    args = ['tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+            'tests/data/LC80100202015018LGN00_MTL.json']
+    full = str(tmpdir.join('full.tif'))
+    assert runner.invoke(radiance, args + [full, '--l8-bidx', '1']
+                         ).exit_code == 0
+
+    paths = []
+    for i in range(2):
+        paths.append(str(tmpdir.join('shard_%d.tif' % i)))
+        result = runner.invoke(radiance, args + [paths[-1], '--l8-bidx', '1',
+                                                 '--shard', '%d/2' % i])
+        assert result.exit_code == 0
+
+    merged = str(tmpdir.join('merged.vrt'))
+    result = runner.invoke(merge, paths + [merged])
+    assert result.exit_code == 0
+    with rasterio.open(merged) as out, rasterio.open(full) as src:
+        assert out.driver == 'VRT'
+        assert (out.read() == src.read()).all()
+
+    result = runner.invoke(merge, paths[:1] + [merged])
+    assert result.exit_code != 0
+
+    result = runner.invoke(radiance, args + [full, '--shard', '2/2'])
+    assert result.exit_code == 2
+
+
+def test_cli_cache(tmpdir):
+    from rio_toa.scripts.cli import cache
+
+    runner = CliRunner()
+    cache_dir = str(tmpdir.join('cache'))
+    args = ['tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+            'tests/data/LC80100202015018LGN00_MTL.json']
+
+    for name in ['a.tif', 'b.tif']:
+        result = runner.invoke(radiance, args + [
+            str(tmpdir.join(name)), '--l8-bidx', '1', '--cache-dir',
+            cache_dir, '--cache-size', '100M'])
+        assert result.exit_code == 0
+
+    result = runner.invoke(cache, ['--cache-dir', cache_dir, 'info'])
+    assert result.exit_code == 0
+    assert json.loads(result.output)['count'] == 1
+
+    result = runner.invoke(cache, ['--cache-dir', cache_dir, 'list'])
+    entry = json.loads(result.output)
+    assert entry['info']['product'] == '_radiance_worker'
+
+    result = runner.invoke(cache, ['--cache-dir', cache_dir, 'prune',
+                                   '--max-size', '1G'])
+    assert result.output == ''
+
+    result = runner.invoke(cache, ['--cache-dir', cache_dir, 'clear'])
+    assert result.output.strip() == entry['key']
+
+    result = runner.invoke(radiance, args + [
+        str(tmpdir.join('c.tif')), '--l8-bidx', '1', '--cache-dir',
+        cache_dir, '--cache-size', 'lots'])
+    assert result.exit_code == 2
+
+
+def test_cli_stats(tmpdir):
+    output = str(tmpdir.join('toa.tif'))
+    runner = CliRunner()
+    args = ['tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+            'tests/data/LC80100202015018LGN00_MTL.json', output,
+            '--l8-bidx', '1']
+
+    result = runner.invoke(radiance, args + ['--stats', '--aux-xml'])
+    assert result.exit_code == 0
+    assert os.path.exists(output + '.aux.xml')
+    with rasterio.open(output) as out:
+        assert 'STATISTICS_MEAN' in out.tags(1)
+
+    # statistics are off by default
+    for extra in [[], ['--no-stats']]:
+        result = runner.invoke(radiance, args + extra)
+        assert result.exit_code == 0
+        assert not os.path.exists(output + '.aux.xml')
+        with rasterio.open(output) as out:
+            assert 'STATISTICS_MEAN' not in out.tags(1)
+
+
+def test_cli_auto_rescale(tmpdir):
+    output = str(tmpdir.join('toa.tif'))
+    runner = CliRunner()
+    args = ['tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+            'tests/data/LC80100202015018LGN00_MTL.json', output,
+            '--l8-bidx', '1', '--dst-dtype', 'uint8']
+
+    result = runner.invoke(radiance, args + [
+        '--auto-rescale', '--auto-percentiles', '1', '99',
+        '--auto-sample', '1'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as out:
+        assert out.tags()['TOA_STRETCH_PERCENTILES'] == '1.0,99.0'
+        assert out.read(1).max() == 255
+
+    result = runner.invoke(radiance, args + [
+        '--auto-rescale', '--auto-percentiles', '99', '1'])
+    assert result.exit_code == 2
+
+
+def test_cli_preview_scale(tmpdir):
+    output = str(tmpdir.join('toa.tif'))
+    runner = CliRunner()
+    args = ['tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+            'tests/data/LC80100202015018LGN00_MTL.json', output,
+            '--l8-bidx', '1']
+
+    result = runner.invoke(reflectance, args + ['--preview-scale', '4'])
+    assert result.exit_code == 0
+    with rasterio.open(args[0]) as src, rasterio.open(output) as out:
+        assert out.width == -(-src.width // 4)
+        assert out.height == -(-src.height // 4)
+
+    result = runner.invoke(reflectance, args + ['--preview-scale', '0'])
+    assert result.exit_code == 2
+
+
+def test_cli_dst_crs(tmpdir):
+    output = str(tmpdir.join('toa.tif'))
+    runner = CliRunner()
+    args = ['tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+            'tests/data/LC80100202015018LGN00_MTL.json', output,
+            '--l8-bidx', '1']
+
+    result = runner.invoke(reflectance, args + [
+        '--dst-crs', 'EPSG:3857', '--dst-res', '1000',
+        '--target-aligned-pixels'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as out:
+        assert out.crs.to_epsg() == 3857
+        assert out.res == (1000, 1000)
+
+    result = runner.invoke(reflectance, args + ['--target-aligned-pixels',
+                                                '--dst-crs', 'EPSG:3857'])
+    assert result.exit_code == 2
+
+
+def test_cli_cube(tmpdir):
+    from rio_toa.scripts.cli import cube
+
+    output = str(tmpdir.join('cube.tif'))
+    runner = CliRunner()
+    result = runner.invoke(cube, [
+        'tests/data/LC80460282016177LGN00_MTL.json',
+        'tests/data/LC80430302016140LGN00_MTL.json', output,
+        '-b', '2', '-b', '3', '--band-template',
+        '{dir}/tiny_LC80460282016177LGN00_B{b}.TIF'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as out:
+        assert out.count == 4
+
+    result = runner.invoke(cube, [
+        'tests/data/LC80460282016177LGN00_MTL.json', output, '-b', '2'])
+    assert result.exit_code == 2
+    assert 'not found' in result.output
+
+
+def test_cli_zarr(tmpdir):
+    zarr = pytest.importorskip('zarr')
+
+    output = str(tmpdir.join('toa.zarr'))
+    runner = CliRunner()
+    result = runner.invoke(reflectance, [
+        'tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+        'tests/data/LC80100202015018LGN00_MTL.json', output,
+        '--l8-bidx', '1', '-j', '2'])
+    assert result.exit_code == 0
+
+    arr = zarr.open_array(output, mode='r')
+    assert arr.attrs['scale_factor'] == 1 / 65535.0
+    assert arr[:].any()
+
+
+def test_cli_vrt_concat(tmpdir):
+    from rio_toa.scripts.cli import concat
+
+    output = str(tmpdir.join('toa.vrt'))
+    runner = CliRunner()
+    result = runner.invoke(reflectance, [
+        'tests/data/tiny_LC80100202015018LGN00_B1.TIF',
+        'tests/data/LC80100202015018LGN00_MTL.json', output,
+        '--l8-bidx', '1', '-j', '2'])
+    assert result.exit_code == 0
+    assert os.path.isdir(str(tmpdir.join('toa_tiles')))
+
+    tif = str(tmpdir.join('toa.tif'))
+    result = runner.invoke(concat, [output, tif])
+    assert result.exit_code == 0
+    with rasterio.open(output) as vrt, rasterio.open(tif) as src:
+        assert vrt.driver == 'VRT'
+        assert (src.read() == vrt.read()).all()
+
+
+def test_cli_radiance_bands(tmpdir):
+    output = str(tmpdir.join('toa_radiance.tif'))
+    runner = CliRunner()
+    result = runner.invoke(radiance, [
+        'tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+        'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+        'tests/data/tiny_LC80460282016177LGN00_B4.TIF',
+        'tests/data/LC80460282016177LGN00_MTL.json', output,
+        '--readtemplate', '.*/tiny_LC8.*\\_B{b}.TIF'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as out:
+        assert out.count == 3
+        assert [out.tags(b)['TOA_BAND'] for b in out.indexes] == \
+            ['2', '3', '4']
+
+
+def test_cli_reflectance_bundle(tmpdir):
+    import tarfile
+    src_bundle = str(tmpdir.join('LC80460282016177LGN00.tar.gz'))
+    with tarfile.open(src_bundle, 'w:gz') as tar:
+        for b in [2, 3]:
+            tar.add('tests/data/tiny_LC80460282016177LGN00_B%d.TIF' % b,
+                    arcname='LC80460282016177LGN00_B%d.TIF' % b)
+        tar.add('tests/data/LC80460282016177LGN00_MTL.json',
+                arcname='LC80460282016177LGN00_MTL.json')
+
+    output = str(tmpdir.join('toa_reflectance.tif'))
+    runner = CliRunner()
+    result = runner.invoke(reflectance, [src_bundle, output,
+                                         '--l8-bidx', '3', '--l8-bidx', '2'])
+    assert result.exit_code == 0
+    expected = str(tmpdir.join('expected.tif'))
+    result = runner.invoke(reflectance, [
+        'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+        'tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+        'tests/data/LC80460282016177LGN00_MTL.json', expected,
+        '--l8-bidx', '3', '--l8-bidx', '2'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as out, rasterio.open(expected) as exp:
+        assert out.count == 2
+        assert (out.read() == exp.read()).all()
+
+    result = runner.invoke(reflectance, [src_bundle, output])
+    assert result.exit_code == 2
+    assert '--l8-bidx' in result.output
+
+
+def test_cli_reflectance_outputs(tmpdir):
+    output = str(tmpdir.join('toa.tif'))
+    visual = str(tmpdir.join('visual.tif'))
+    runner = CliRunner()
+    result = runner.invoke(reflectance, [
+        'tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+        'tests/data/LC80460282016177LGN00_MTL.json', output,
+        '--dst-dtype', 'float32', '--l8-bidx', '2',
+        '--output', visual + ':uint8::clip'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as toa, rasterio.open(visual) as vis:
+        assert toa.dtypes[0] == 'float32'
+        assert vis.dtypes[0] == 'uint8'
+        assert vis.read().max() > 0
+
+    result = runner.invoke(reflectance, [
+        'tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+        'tests/data/LC80460282016177LGN00_MTL.json', output,
+        '--l8-bidx', '2', '--output', visual + ':int8::clip'])
+    assert result.exit_code == 2
+
+
+def test_cli_visual(tmpdir):
+    from rio_toa.scripts.cli import visual
+    output = str(tmpdir.join('visual.tif'))
+    runner = CliRunner()
+    result = runner.invoke(visual, [
+        'tests/data/tiny_LC80460282016177LGN00_B4.TIF',
+        'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+        'tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+        'tests/data/LC80460282016177LGN00_MTL.json', output,
+        '-t', '.*/tiny_LC8.*_B{b}.TIF', '--compress', 'webp',
+        '--color', 'gamma 1.5 saturation 1.1'])
+    assert result.exit_code == 0
+    with rasterio.open(output) as out:
+        assert out.count == 3
+        assert out.compression.value == 'WEBP'
+
+    result = runner.invoke(visual, [
+        'tests/data/tiny_LC80460282016177LGN00_B4.TIF',
+        'tests/data/LC80460282016177LGN00_MTL.json', output,
+        '-t', '.*/tiny_LC8.*_B{b}.TIF', '--color', 'gamma'])
+    assert result.exit_code == 2
+
+
+def test_cli_reflectance_remote_inputs(http_data, tmpdir):
+    import numpy as np
+
+    band = 'tiny_LC80460282016177LGN00_B2.TIF'
+    mtl = 'LC80460282016177LGN00_MTL.json'
+    template = '.*/tiny_LC8.*_B{b}.TIF'
+    local = str(tmpdir.join('local.tif'))
+    remote = str(tmpdir.join('remote.tif'))
+
+    runner = CliRunner()
+    result = runner.invoke(reflectance, [
+        'tests/data/' + band, 'tests/data/' + mtl, local, '-t', template])
+    assert result.exit_code == 0, result.output
+
+    # the band through /vsicurl/, the MTL as a plain URL
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR'):
+        result = runner.invoke(reflectance, [
+            http_data + band, http_data[len('/vsicurl/'):] + mtl, remote,
+            '-t', template])
+    assert result.exit_code == 0, result.output
+
+    with rasterio.open(local) as a, rasterio.open(remote) as b:
+        assert np.array_equal(a.read(), b.read())
+
+    result = runner.invoke(reflectance, [
+        'tests/data/missing_B2.TIF', 'tests/data/' + mtl, remote])
+    assert result.exit_code == 2
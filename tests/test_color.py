@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from rio_toa import color
+
+
+def test_parse_operations():
+    assert color.parse_operations(
+        'gamma 1.1 Sigmoidal 10 0.15 saturation 1.3') == \
+        [('gamma', (1.1, )), ('sigmoidal', (10.0, 0.15)),
+         ('saturation', (1.3, ))]
+    assert color.parse_operations('') == []
+
+    for ops in ['gamma', 'gamma x', 'sigmoidal 10', 'hue 3']:
+        with pytest.raises(ValueError):
+            color.parse_operations(ops)
+
+
+def test_gamma_sigmoidal_endpoints():
+    arr = np.linspace(0, 1, 11)
+    for out in [color.gamma(arr, 2.0), color.sigmoidal(arr, 10, 0.15)]:
+        assert out[0] == pytest.approx(0)
+        assert out[-1] == pytest.approx(1)
+        assert np.all(np.diff(out) > 0)
+    # brightens the midtones
+    assert color.gamma(arr, 2.0)[5] > 0.5
+    assert np.array_equal(color.sigmoidal(arr, 0, 0.5), arr)
+
+    with pytest.raises(ValueError):
+        color.gamma(arr, 0)
+    with pytest.raises(ValueError):
+        color.sigmoidal(arr, 10, 1.5)
+
+
+def test_saturation():
+    rgb = np.array([0.2, 0.4, 0.6]).reshape(3, 1, 1) * np.ones((3, 2, 2))
+    assert np.allclose(color.saturation(rgb, 1.0), rgb)
+    gray = color.saturation(rgb, 0.0)
+    assert np.allclose(gray, gray[0])
+    assert np.allclose(gray[0], np.tensordot(color.LUMA, rgb, axes=1))
+
+    with pytest.raises(ValueError):
+        color.saturation(rgb[:2], 1.2)
+
+
+def test_apply_operations_clips():
+    arr = np.array([-0.5, 0.0, 0.5, 1.5]).reshape(1, 1, 4)
+    out = color.apply_operations(arr, [('gamma', (1.0, ))])
+    assert out.ravel().tolist() == [0.0, 0.0, 0.5, 1.0]
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import cube, reflectance
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF']
+# two acquisitions on the grid of the tiny files
+mtls = ['tests/data/LC80460282016177LGN00_MTL.json',
+        'tests/data/LC80430302016140LGN00_MTL.json']
+
+
+def test_scene_paths():
+    assert cube.scene_paths('data/LC8_MTL.txt', [4, 5]) == \
+        ['data/LC8_B4.TIF', 'data/LC8_B5.TIF']
+    assert cube.scene_paths('data/LC8_MTL.json', [4],
+                            '{dir}/tiny_{scene}_B{b}.TIF') == \
+        ['data/tiny_LC8_B4.TIF']
+
+
+@pytest.mark.parametrize('pixel_sunangle', [False, True])
+def test_cube_matches_dates(tmpdir, pixel_sunangle):
+    dst_path = str(tmpdir.join('cube.tif'))
+    stats = cube.calculate_landsat_reflectance_cube(
+        [(src_paths, mtl) for mtl in mtls], dst_path, None, {}, [2, 3],
+        'uint16', 2, pixel_sunangle=pixel_sunangle, stats=True)
+
+    with rio.open(dst_path) as out:
+        stack = out.read()
+        assert out.count == 4
+        # sorted by acquisition date
+        assert out.tags()['TOA_DATES'] == '2016-05-19,2016-06-25'
+        assert [out.tags(b)['TOA_BAND'] for b in out.indexes] == \
+            ['2', '3', '2', '3']
+        assert out.tags(3)['TOA_DATE'] == '2016-06-25'
+    assert len(stats) == 4
+
+    for i, mtl in enumerate(reversed(mtls)):
+        path = str(tmpdir.join('%d.tif' % i))
+        reflectance.calculate_landsat_reflectance(
+            src_paths, mtl, path, None, {}, [2, 3], 'uint16', 1,
+            pixel_sunangle)
+        with rio.open(path) as single:
+            assert np.array_equal(single.read(), stack[2 * i:2 * i + 2])
+
+
+def test_cube_stacked_input(tmpdir):
+    stack_path = str(tmpdir.join('stack.tif'))
+    with rio.open(src_paths[0]) as a, rio.open(src_paths[1]) as b:
+        profile = a.profile
+        profile.update(count=2)
+        with rio.open(stack_path, 'w', **profile) as dst:
+            dst.write(np.concatenate([a.read(), b.read()]))
+
+    paths = [str(tmpdir.join(name)) for name in ('a.tif', 'b.tif')]
+    cube.calculate_landsat_reflectance_cube(
+        [([stack_path], mtls[0]), (src_paths, mtls[1])], paths[0], None, {},
+        [2, 3], 'uint16', 1)
+    cube.calculate_landsat_reflectance_cube(
+        [(src_paths, mtl) for mtl in mtls], paths[1], None, {}, [2, 3],
+        'uint16', 1)
+
+    with rio.open(paths[0]) as a, rio.open(paths[1]) as b:
+        assert np.array_equal(a.read(), b.read())
+
+
+def test_cube_grid_mismatch(tmpdir):
+    with pytest.raises(ValueError):
+        cube.calculate_landsat_reflectance_cube(
+            [(src_paths, mtls[0]),
+             (['tests/data/tiny_LC81390452014295LGN00_B5.TIF',
+               src_paths[1]], mtls[1])],
+            str(tmpdir.join('cube.tif')), None, {}, [2, 3], 'uint16', 1)
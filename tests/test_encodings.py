@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import encodings, reflectance
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B4.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+def test_parse_output():
+    assert encodings.parse_output('a.tif:uint8:200:clip') == \
+        ('a.tif', 'uint8', 200.0, True)
+    assert encodings.parse_output('a.tif:float32::noclip') == \
+        ('a.tif', 'float32', 1.0, False)
+    assert encodings.parse_output('s3://b/a.tif:uint16::true') == \
+        ('s3://b/a.tif', 'uint16', 65535, True)
+
+    for spec in ['a.tif', 'a.tif:int8::clip', 'a.tif:uint8:x:clip',
+                 'a.tif:uint8::maybe', ':uint8::clip']:
+        with pytest.raises(ValueError):
+            encodings.parse_output(spec)
+
+
+def _reflectance(dst_path, dtype, rescale_factor, clip, **kwargs):
+    return reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, rescale_factor, {}, [2, 3, 4], dtype,
+        2, True, clip, **kwargs)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_reflectance_outputs(tmpdir, processes):
+    singles = []
+    specs = [('float32', 1.0, False), ('uint8', 255, True),
+             ('uint16', 55000, True)]
+    for i, (dtype, rescale_factor, clip) in enumerate(specs):
+        path = str(tmpdir.join('single%d.tif' % i))
+        singles.append((path, _reflectance(path, dtype, rescale_factor,
+                                           clip, stats=True)))
+
+    paths = [str(tmpdir.join('out%d.tif' % i)) for i in range(3)]
+    result = reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, paths[0], 1.0, {}, [2, 3, 4], 'float32',
+        processes, True, False, stats=True,
+        outputs=[(p, ) + spec for p, spec in zip(paths[1:], specs[1:])])
+
+    assert len(result) == 3
+    for (single, stats), path, got in zip(singles, paths, result):
+        with rio.open(single) as a, rio.open(path) as b:
+            assert b.dtypes == a.dtypes
+            assert np.array_equal(a.read(), b.read())
+            assert b.scales == a.scales
+            assert float(b.tags(1)['STATISTICS_MEAN']) == pytest.approx(
+                float(a.tags(1)['STATISTICS_MEAN']))
+        assert got[0]['mean'] == pytest.approx(stats[0]['mean'])
+
+
+def test_reflectance_outputs_no_auto_rescale(tmpdir):
+    with pytest.raises(ValueError):
+        _reflectance(str(tmpdir.join('a.tif')), 'uint16', None, True,
+                     auto_rescale=(2, 98),
+                     outputs=[(str(tmpdir.join('b.tif')), 'uint8', 255,
+                               True)])
@@ -0,0 +1,202 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import executor, reflectance
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B4.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+def _shm_count():
+    if not os.path.isdir('/dev/shm'):
+        return 0
+    return len(os.listdir('/dev/shm'))
+
+
+@pytest.fixture
+def expected(tmpdir):
+    dst_path = str(tmpdir.join('single.tif'))
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, None, {}, [2, 3, 4], 'uint16', 1, True)
+
+    with rio.open(dst_path) as src:
+        return src.read()
+
+
+def test_executor_shared_memory(expected, tmpdir):
+    dst_path = str(tmpdir.join('shm.tif'))
+    before = _shm_count()
+
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, None, {}, [2, 3, 4], 'uint16', 2, True)
+
+    assert _shm_count() == before
+    with rio.open(dst_path) as src:
+        assert np.array_equal(src.read(), expected)
+
+
+def test_executor_pickled_results(expected, tmpdir, monkeypatch):
+    monkeypatch.setattr(executor, 'shared_memory', None)
+    dst_path = str(tmpdir.join('pickled.tif'))
+
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, None, {}, [2, 3, 4], 'uint16', 2, True)
+
+    with rio.open(dst_path) as src:
+        assert np.array_equal(src.read(), expected)
+
+
+def _double(data, window, ij, g_args):
+    return (data[0] * 2).astype(np.float64)
+
+
+def test_executor_oversized_result(tmpdir):
+    # float64 results do not fit slots sized for the uint16 output
+    dst_path = str(tmpdir.join('double.tif'))
+    with rio.open(src_paths[0]) as src:
+        options = src.profile
+        data = src.read()
+
+    with executor.Executor([src_paths[0]], dst_path, _double,
+                           options=options) as ex:
+        ex.run(2)
+
+    with rio.open(dst_path) as src:
+        assert np.array_equal(src.read(), (data * 2).astype(np.uint16))
+
+
+def test_executor_bad_mode():
+    with pytest.raises(ValueError):
+        executor.Executor(src_paths, 'out.tif', _double, mode='nope')
+
+
+def _lookup(data, window, ij, g_args):
+    # published arrays arrive as read-only views, not copies
+    assert not g_args['lut'].flags.writeable
+    return g_args['lut'][data[0]].astype(np.uint16)
+
+
+def test_executor_shared_global_args(tmpdir):
+    dst_path = str(tmpdir.join('lut.tif'))
+    lut = (np.arange(2 ** 17, dtype=np.float64) % 1000)
+
+    with rio.open(src_paths[0]) as src:
+        options = src.profile
+        data = src.read()
+
+    before = _shm_count()
+    with executor.Executor([src_paths[0]], dst_path, _lookup,
+                           options=options,
+                           global_args={'lut': lut}) as ex:
+        ex.run(2)
+
+    assert _shm_count() == before
+    with rio.open(dst_path) as src:
+        assert np.array_equal(src.read(), lut[data].astype(np.uint16))
+
+
+def test_executor_stats(expected, tmpdir):
+    dst_path = str(tmpdir.join('row.tif'))
+    with rio.open(src_paths[0]) as src:
+        options = src.profile
+        data = src.read()
+
+    for sched in ['cost', 'row']:
+        with executor.Executor([src_paths[0]], dst_path, _double,
+                               options=options, schedule=sched) as ex:
+            ex.run(2)
+
+        assert ex.stats['count'] == len(ex.windows)
+        assert ex.stats['max'] >= ex.stats['p50'] >= 0
+        with rio.open(dst_path) as src:
+            assert np.array_equal(src.read(), (data * 2).astype(np.uint16))
+
+    with pytest.raises(ValueError):
+        executor.Executor(src_paths, 'out.tif', _double, schedule='nope')
+
+
+def _fail_once(data, window, ij, g_args):
+    if ij == (3, 3):
+        raise ValueError('window %s failed' % (ij, ))
+    return data[0]
+
+
+def test_executor_worker_error_does_not_hang(tmpdir):
+    # a failing window used to leave the task feeder waiting for a free
+    # slot, so terminating the pool hung; run in a child to time it out
+    import subprocess
+    import sys
+    script = '\n'.join([
+        'from rasterio.windows import Window',
+        'from tests.test_executor import _fail_once, src_paths',
+        'from rio_toa.executor import Executor',
+        'windows = [[Window(c * 16, r * 16, 16, 16), (r, c)]',
+        '           for r in range(9) for c in range(11)]',
+        'with Executor(src_paths[:1], %r, _fail_once,' % str(
+            tmpdir.join('out.tif')),
+        '              windows=windows) as ex:',
+        '    ex.run(4)'])
+    proc = subprocess.run([sys.executable, '-c', script], timeout=120,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert proc.returncode == 1
+    assert b'window (3, 3) failed' in proc.stderr
+
+
+def test_executor_single_process_closes_inputs(tmpdir):
+    with executor.Executor(src_paths[:1], str(tmpdir.join('out.tif')),
+                           _double_uint16) as ex:
+        ex.run(1)
+    assert executor._srcs is None
+
+
+def _double_uint16(data, window, ij, g_args):
+    return data[0] * 2
+
+
+class _ListWriter(object):
+    def __init__(self):
+        self.windows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ext_t, ext_v, trace):
+        pass
+
+    def write(self, arr, window=None):
+        self.windows.append(window)
+
+
+def test_executor_writer_factory_windows(tmpdir):
+    from rasterio.windows import Window
+    windows = [[Window(c * 64, r * 64, 64, 64), (r, c)]
+               for r in range(2) for c in range(2)]
+    written = _ListWriter()
+
+    def create(path, profile, job_windows):
+        assert job_windows == windows
+        return written
+    create.windows = lambda profile: windows
+    create.ordered = True
+
+    with executor.Executor(src_paths[:1], str(tmpdir.join('out')),
+                           _double_uint16, writer=create) as ex:
+        assert ex.ordered
+        ex.run(2)
+    assert written.windows == [w for w, _ in windows]
+
+
+def test_output_writer():
+    assert executor.output_writer('out.tif', 'GTiff') is None
+    assert executor.output_writer('out.zarr', 'Zarr') is \
+        executor.zarr_output.create
+    assert executor.output_writer('s3://bucket/out.tif', 'GTiff') is \
+        executor.s3_output.create
+    with pytest.raises(ValueError):
+        executor.output_writer('s3://bucket/out.vrt', 'VRT')
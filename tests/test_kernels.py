@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+import numpy as np
+
+from rio_toa import kernels, radiance, reflectance, brightness_temp
+
+
+def test_kernels_reexported():
+    assert radiance.radiance is kernels.radiance
+    assert reflectance.reflectance is kernels.reflectance
+    assert brightness_temp.brightness_temp is kernels.brightness_temp
+
+
+def test_kernels_without_rasterio():
+    # block rasterio and riomucho, the kernel path must not need them
+    code = '\n'.join([
+        'import sys',
+        'sys.modules["rasterio"] = None',
+        'sys.modules["riomucho"] = None',
+        'import numpy as np',
+        'from rio_toa import kernels, toa_utils, sun_utils, qa_utils',
+        'from rio_toa import ang_utils',
+        'img = np.array([[0, 1], [2, 3]], dtype=np.uint16)',
+        'toa_utils.rescale(kernels.reflectance(img, 0.2, -0.1, 45.0),',
+        '                  55000, np.uint16)'])
+
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_kernels_import_without_loading_rasterio():
+    code = '\n'.join([
+        'import sys',
+        'import rio_toa.kernels',
+        'assert "rasterio" not in sys.modules, "rasterio was imported"'])
+
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_kernel_values():
+    band = np.array([[0, 1], [1, 0]]).astype('float32')
+
+    assert np.allclose(kernels.radiance(band, 0.2, -0.1),
+                       [[0., 0.1], [0.1, 0.]])
+    assert np.allclose(kernels.reflectance(band, 0.2, -0.1, 90.0),
+                       [[0., 0.1], [0.1, 0.]])
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import memmap_reader, radiance, toa_utils
+
+
+LAYOUTS = {
+    'striped': {},
+    'striped-band': {'interleave': 'band'},
+    'tiled': {'tiled': True, 'blockxsize': 64, 'blockysize': 64},
+    'tiled-band': {'tiled': True, 'blockxsize': 64, 'blockysize': 64,
+                   'interleave': 'band'},
+    'big-endian': {'endianness': 'big'}
+}
+
+WINDOWS = [Window(0, 0, 64, 64),
+           Window(64, 128, 64, 22),
+           Window(30, 50, 100, 70),
+           ((149, 150), (0, 200)),
+           None]
+
+
+def _write(path, count=2, **kwargs):
+    data = np.random.randint(0, 60000, (count, 150, 200)).astype(np.uint16)
+    with rio.open(path, 'w', driver='GTiff', width=200, height=150,
+                  count=count, dtype='uint16', **kwargs) as dst:
+        dst.write(data)
+    return data
+
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_memmap_reader(tmpdir, layout):
+    path = str(tmpdir.join('%s.tif' % layout))
+    _write(path, **LAYOUTS[layout])
+
+    with memmap_reader.MemmapReader(path) as mm, rio.open(path) as src:
+        for window in WINDOWS:
+            for indexes in [None, 1, 2, [2], [1, 2], [2, 1]]:
+                assert np.array_equal(
+                    mm.read(indexes, window=window),
+                    src.read(indexes, window=window))
+
+
+def test_memmap_reader_views(tmpdir):
+    path = str(tmpdir.join('tiled.tif'))
+    _write(path, **LAYOUTS['tiled-band'])
+
+    with memmap_reader.MemmapReader(path) as mm:
+        aligned = mm.read(1, window=Window(64, 64, 64, 64))
+        assert not aligned.flags.owndata
+        assert not aligned.flags.writeable
+
+        out = np.zeros((2, 10, 10), dtype=np.uint16)
+        assert mm.read(window=Window(60, 60, 10, 10), out=out) is out
+        assert out.any()
+
+
+def test_memmap_reader_pixel_interleaved_view(tmpdir):
+    path = str(tmpdir.join('striped.tif'))
+    data = _write(path)
+
+    with memmap_reader.MemmapReader(path) as mm:
+        arr = mm.read(window=Window(10, 20, 30, 40))
+        assert not arr.flags.owndata
+        assert np.array_equal(arr, data[:, 20:60, 10:40])
+
+
+def test_read_window_memmap_view(tmpdir):
+    path = str(tmpdir.join('single.tif'))
+    data = _write(path, count=1)
+
+    with memmap_reader.MemmapReader(path) as mm:
+        arr = toa_utils._read_window([mm], [(0, [1])], Window(10, 20, 30, 40),
+                                     'uint16')
+        assert not arr.flags.owndata
+        assert np.array_equal(arr, data[:, 20:60, 10:40])
+
+
+def test_memmap_reader_single_band(tmpdir):
+    path = str(tmpdir.join('single.tif'))
+    data = _write(path, count=1, tiled=True, blockxsize=32, blockysize=32)
+
+    with memmap_reader.MemmapReader(path) as mm:
+        assert np.array_equal(mm.read(), data)
+
+
+@pytest.mark.parametrize('kwargs', [{'compress': 'deflate'},
+                                    {'nbits': 12}])
+def test_open_dataset_fallback(tmpdir, kwargs):
+    path = str(tmpdir.join('fallback.tif'))
+    _write(path, **kwargs)
+
+    with pytest.raises(ValueError):
+        memmap_reader.MemmapReader(path)
+
+    with memmap_reader.open_dataset(path) as src:
+        assert isinstance(src, rio.io.DatasetReader)
+
+
+def test_open_dataset_not_local():
+    with pytest.raises(ValueError):
+        memmap_reader.MemmapReader('/vsicurl/http://localhost/missing.tif')
+
+
+def test_radiance_memmap_input(tmpdir):
+    src_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+    src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+    plain_path = str(tmpdir.join('plain.tif'))
+
+    with rio.open(src_path) as src:
+        profile = src.profile
+        profile.update(compress=None)
+        with rio.open(plain_path, 'w', **profile) as dst:
+            dst.write(src.read())
+
+    assert isinstance(memmap_reader.open_dataset(plain_path),
+                      memmap_reader.MemmapReader)
+
+    outputs = []
+    for path in [src_path, plain_path]:
+        outputs.append(str(tmpdir.join('out_%d.tif' % len(outputs))))
+        radiance.calculate_landsat_radiance(
+            path, src_mtl, outputs[-1], None, {}, 2, 'uint16', 2)
+
+    with rio.open(outputs[0]) as a, rio.open(outputs[1]) as b:
+        assert np.array_equal(a.read(), b.read())
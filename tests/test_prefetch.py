@@ -0,0 +1,59 @@
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import prefetch, reflectance
+
+
+def test_coalesce_windows():
+    windows = [[Window(0, 0, 256, 256), (0, 0)],
+               [Window(256, 0, 256, 256), (0, 1)],
+               [Window(512, 0, 100, 256), (0, 2)],
+               [Window(0, 256, 256, 100), (1, 0)],
+               [Window(256, 256, 256, 100), (1, 1)]]
+
+    groups = prefetch.coalesce_windows(windows)
+    assert [len(run) for _, run in groups] == [3, 2]
+    assert groups[0][0] == Window(0, 0, 612, 256)
+    assert groups[1][0] == Window(0, 256, 512, 100)
+
+    groups = prefetch.coalesce_windows(windows, max_blocks=2)
+    assert [len(run) for _, run in groups] == [2, 1, 2]
+
+
+def test_prefetcher():
+    src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+                 'tests/data/tiny_LC80460282016177LGN00_B3.TIF']
+
+    with rio.open(src_paths[0]) as src:
+        windows = [[w, ij] for ij, w in src.block_windows()]
+        expected = src.read()
+
+    seen = []
+    with prefetch.Prefetcher(src_paths, windows, depth=2, threads=2) as reads:
+        for data, window, ij in reads:
+            assert len(data) == 2
+            assert np.array_equal(data[0], expected[:, window.toslices()[0],
+                                                    window.toslices()[1]])
+            seen.append(ij)
+
+    assert seen == [ij for _, ij in windows]
+
+
+def test_calculate_landsat_reflectance_prefetch_http(http_data, tmpdir):
+    src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+    local_path = str(tmpdir.join('local.tif'))
+    remote_path = str(tmpdir.join('remote.tif'))
+
+    reflectance.calculate_landsat_reflectance(
+        ['tests/data/tiny_LC80460282016177LGN00_B2.TIF'], src_mtl,
+        local_path, None, {}, [2], 'uint16', 1, False)
+
+    with rio.Env(GDAL_DISABLE_READDIR_ON_OPEN='EMPTY_DIR'):
+        reflectance.calculate_landsat_reflectance(
+            [http_data + 'tiny_LC80460282016177LGN00_B2.TIF'], src_mtl,
+            remote_path, None, {}, [2], 'uint16', 2, False, prefetch=4)
+
+    with rio.open(local_path) as local:
+        with rio.open(remote_path) as remote:
+            assert np.array_equal(local.read(), remote.read())
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.enums import Resampling
+
+from rio_toa import preview, radiance, reflectance, toa_utils
+from rio_toa.kernels import radiance as radiance_kernel
+
+
+src_path = 'tests/data/tiny_LC81390452014295LGN00_B5.TIF'
+src_mtl = 'tests/data/LC81390452014295LGN00_MTL.json'
+
+
+@pytest.fixture
+def with_overviews(tmpdir):
+    path = str(tmpdir.join('ovr.tif'))
+    with rio.open(src_path) as src:
+        profile = src.profile
+        data = src.read()
+    with rio.open(path, 'w', **profile) as dst:
+        dst.write(data)
+        dst.build_overviews([2, 4], Resampling.average)
+    return path
+
+
+def test_parse_scale():
+    assert preview.parse_scale(None) is None
+    assert preview.parse_scale(1) is None
+    assert preview.parse_scale(8) == 8
+    with pytest.raises(ValueError):
+        preview.parse_scale(0)
+    with pytest.raises(ValueError):
+        preview.parse_scale(2.5)
+
+
+def test_preview_profile():
+    with rio.open(src_path) as src:
+        profile = src.profile
+        bounds = src.bounds
+
+    small = preview.preview_profile(profile, 8)
+    assert (small['height'], small['width']) == (49, 48)
+    assert small['transform'] * (0, 0) == (bounds.left, bounds.top)
+    assert small['transform'] * (48, 49) == pytest.approx(
+        (bounds.right, bounds.bottom))
+    assert profile['width'] == 381
+
+
+def test_tile_multiple():
+    assert preview.tile_multiple({'blockxsize': 256,
+                                  'blockysize': 256}) == 256
+    assert preview.tile_multiple({'blockxsize': 512,
+                                  'blockysize': 384}) == 1536
+    assert preview.tile_multiple({'blockxsize': 7,
+                                  'blockysize': 5}) == 35
+
+
+def test_decimated_reader_windows():
+    with preview.DecimatedReader(src_path, 4) as src:
+        whole = src.read()
+        assert whole.shape == (1, src.height, src.width)
+
+        out = np.zeros_like(whole)
+        for window, _ in preview.preview_windows(src.profile, 32):
+            (r0, r1), (c0, c1) = toa_utils._window_ranges(window)
+            src.read([1], window=window, out=out[:, r0:r1, c0:c1])
+        assert np.array_equal(out, whole)
+
+
+def test_radiance_preview_reads_overview(with_overviews, tmpdir):
+    dst_path = str(tmpdir.join('preview.tif'))
+    radiance.calculate_landsat_radiance(
+        with_overviews, src_mtl, dst_path, None, {}, 5, 'float32', 1,
+        clip=False, preview_scale=4)
+
+    with rio.open(with_overviews, OVERVIEW_LEVEL=1) as ovr:
+        expected = radiance_kernel(ovr.read(1), 0.0061714, -30.85696, None)
+    with rio.open(dst_path) as out:
+        assert out.tags()['TOA_PREVIEW_SCALE'] == '4'
+        assert out.shape == expected.shape
+        assert np.allclose(out.read(1), expected, atol=1e-5)
+
+
+def test_reflectance_preview_pixel_sunangle(tmpdir):
+    paths = [str(tmpdir.join('%d.tif' % p)) for p in (1, 2)]
+    for path, processes in zip(paths, (1, 2)):
+        reflectance.calculate_landsat_reflectance(
+            [src_path], src_mtl, path, None, {}, [5], 'uint16', processes,
+            True, preview_scale=8)
+
+    with rio.open(src_path) as src, rio.open(paths[0]) as a, \
+            rio.open(paths[1]) as b:
+        assert a.shape == (49, 48)
+        assert a.bounds == pytest.approx(src.bounds)
+        assert np.array_equal(a.read(), b.read())
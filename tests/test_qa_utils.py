@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import qa_utils, reflectance
+
+
+def test_qa_mask_single_bit():
+    qa = np.array([[0, 1, 2],
+                   [16, 17, 0]], dtype=np.uint16)
+
+    assert np.array_equal(qa_utils.qa_mask(qa, ['fill']),
+                          np.array([[False, True, False],
+                                    [False, True, False]]))
+
+    assert np.array_equal(qa_utils.qa_mask(qa, ['cloud']),
+                          np.array([[False, False, False],
+                                    [True, True, False]]))
+
+
+def test_qa_mask_confidence():
+    # cloud shadow confidence is bits 7-8, only high (3) is masked
+    qa = np.array([0, 1 << 7, 2 << 7, 3 << 7], dtype=np.uint16)
+
+    assert np.array_equal(qa_utils.qa_mask(qa, ['cloud-shadow']),
+                          np.array([False, False, False, True]))
+
+
+def test_qa_mask_combined():
+    qa = np.array([1, 16, 3 << 11, 0], dtype=np.uint16)
+
+    assert np.array_equal(qa_utils.qa_mask(qa, ['fill', 'cloud', 'cirrus']),
+                          np.array([True, True, True, False]))
+
+
+def test_qa_mask_bad_flag():
+    with pytest.raises(ValueError):
+        qa_utils.qa_mask(np.zeros((2, 2)), ['notaflag'])
+
+
+def test_apply_qa_mask():
+    arr = np.ones((2, 2, 2), dtype=np.uint16)
+    mask = np.array([[True, False], [False, False]])
+
+    out = qa_utils.apply_qa_mask(arr, mask)
+    assert out[:, 0, 0].tolist() == [0, 0]
+    assert out.sum() == 6
+
+
+def test_calculate_landsat_reflectance_qa_mask(tmpdir):
+    src_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+    src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+    qa_path = str(tmpdir.join('qa.tif'))
+    dst_path = str(tmpdir.join('refl.tif'))
+
+    with rio.open(src_path) as src:
+        profile = src.profile
+        shape = src.shape
+
+    # top half cloudy, which covers whole blocks
+    qa = np.zeros(shape, dtype=np.uint16)
+    qa[:512] = 16
+    with rio.open(qa_path, 'w', **profile) as dst:
+        dst.write(qa, 1)
+
+    reflectance.calculate_landsat_reflectance(
+        [src_path], src_mtl, dst_path, None, {}, [2], 'uint16', 1, False,
+        qa_path=qa_path, qa_flags=['cloud'])
+
+    with rio.open(dst_path) as out:
+        assert out.nodata == 0
+        data = out.read(1)
+
+    assert not data[:512].any()
+    assert data[512:].any()
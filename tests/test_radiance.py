@@ -137,3 +137,41 @@ def test_calculate_landsat_radiance(test_var, capfd):
         dst_dtype, processes)
     out, err = capfd.readouterr()
     assert os.path.exists(dst_path)
+
+
+def test_calculate_landsat_radiance_bands(tmpdir):
+    src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+                 'tests/data/tiny_LC80460282016177LGN00_B3.TIF']
+    src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+    expected = []
+    for path, band in zip(src_paths, [2, 3]):
+        dst_path = str(tmpdir.join('rad_%d.tif' % band))
+        radiance.calculate_landsat_radiance(
+            path, src_mtl, dst_path, 100, {}, band, 'uint16', 1)
+        with rio.open(dst_path) as src:
+            expected.append(src.read(1))
+
+    stack_path = str(tmpdir.join('stack.tif'))
+    with rio.open(src_paths[0]) as src:
+        profile = src.profile
+        profile.update(count=2)
+        with rio.open(stack_path, 'w', **profile) as dst:
+            dst.write(src.read(1), 1)
+            with rio.open(src_paths[1]) as src2:
+                dst.write(src2.read(1), 2)
+
+    for inputs in [src_paths, [stack_path]]:
+        dst_path = str(tmpdir.join('rad.tif'))
+        stats = radiance.calculate_landsat_radiance(
+            inputs, src_mtl, dst_path, 100, {}, [2, 3], 'uint16', 2,
+            stats=True)
+        assert len(stats) == 2
+        with rio.open(dst_path) as src:
+            assert src.count == 2
+            assert np.array_equal(src.read(), np.array(expected))
+            assert src.tags(2)['TOA_BAND'] == '3'
+
+    with pytest.raises(ValueError):
+        radiance.calculate_landsat_radiance(
+            src_paths, src_mtl, dst_path, 100, {}, [2], 'uint16', 1)
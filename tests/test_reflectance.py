@@ -294,3 +294,70 @@ def test_calculate_landsat_reflectance_stack_pixel(test_var, test_data, capfd):
     with rio.open(dst_path) as created:
         with rio.open(expected_path) as expected:
             assert flex_compare(created.read(), expected.read())
+
+
+def test_calculate_landsat_reflectance_multiband_input(test_var, tmpdir):
+    src_paths, src_mtl = list(test_var[:3]), test_var[3]
+    stack_path = str(tmpdir.join('stack.tif'))
+
+    with rio.open(src_paths[0]) as src:
+        profile = src.profile
+    profile.update(count=3, interleave='pixel')
+
+    with rio.open(stack_path, 'w', **profile) as dst:
+        for i, src_path in enumerate(src_paths, 1):
+            with rio.open(src_path) as src:
+                dst.write(src.read(1), i)
+
+    separate_path = str(tmpdir.join('separate.tif'))
+    stacked_path = str(tmpdir.join('stacked.tif'))
+
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, separate_path, None, {}, [2, 3, 4],
+        'uint16', 1, False)
+    reflectance.calculate_landsat_reflectance(
+        [stack_path], src_mtl, stacked_path, None, {}, [2, 3, 4],
+        'uint16', 1, False)
+
+    with rio.open(separate_path) as separate:
+        with rio.open(stacked_path) as stacked:
+            assert stacked.count == 3
+            assert np.array_equal(separate.read(), stacked.read())
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_calculate_landsat_reflectance_stacked_subset(test_var, tmpdir,
+                                                      prefetch):
+    src_paths, src_mtl = list(test_var[:3]), test_var[3]
+    stack_path = str(tmpdir.join('stack.tif'))
+
+    with rio.open(src_paths[0]) as src:
+        profile = src.profile
+    profile.update(count=3, interleave='pixel')
+
+    with rio.open(stack_path, 'w', **profile) as dst:
+        for i, src_path in enumerate(src_paths, 1):
+            with rio.open(src_path) as src:
+                dst.write(src.read(1), i)
+
+    separate_path = str(tmpdir.join('separate.tif'))
+    subset_path = str(tmpdir.join('subset.tif'))
+
+    reflectance.calculate_landsat_reflectance(
+        [src_paths[2], src_paths[0]], src_mtl, separate_path, None, {},
+        [4, 2], 'uint16', 1, False)
+    reflectance.calculate_landsat_reflectance(
+        [stack_path], src_mtl, subset_path, None, {}, [4, 2],
+        'uint16', 1, False, prefetch=prefetch, src_bands=[2, 3, 4])
+
+    with rio.open(separate_path) as separate:
+        with rio.open(subset_path) as subset:
+            assert subset.count == 2
+            assert np.array_equal(separate.read(), subset.read())
+
+
+def test_calculate_landsat_reflectance_band_mismatch(test_var, tmpdir):
+    with pytest.raises(ValueError):
+        reflectance.calculate_landsat_reflectance(
+            [test_var[0]], test_var[3], str(tmpdir.join('out.tif')),
+            None, {}, [2, 3], 'uint16', 1, False)
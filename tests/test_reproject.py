@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.warp import reproject as warp_reproject
+
+from rio_toa import radiance, reflectance, reproject
+
+
+src_path = 'tests/data/tiny_LC81390452014295LGN00_B5.TIF'
+src_mtl = 'tests/data/LC81390452014295LGN00_MTL.json'
+
+
+def test_parse_res():
+    assert reproject.parse_res(None) is None
+    assert reproject.parse_res(30) == (30.0, 30.0)
+    assert reproject.parse_res([10, 20]) == (10.0, 20.0)
+    with pytest.raises(ValueError):
+        reproject.parse_res([1, 2, 3])
+    with pytest.raises(ValueError):
+        reproject.parse_res(-5)
+
+
+def test_warped_profile_target_aligned():
+    with rio.open(src_path) as src:
+        profile = src.profile
+
+    warped = reproject.warped_profile(profile, 'EPSG:3857', 1000, True)
+    assert warped['crs'] == CRS.from_epsg(3857)
+    assert (warped['transform'].a, -warped['transform'].e) == (1000, 1000)
+    assert warped['transform'].c % 1000 == 0
+    assert warped['transform'].f % 1000 == 0
+
+    with pytest.raises(ValueError):
+        reproject.warped_profile(profile, 'EPSG:3857',
+                                 target_aligned_pixels=True)
+
+
+def test_warped_reader_windows():
+    with rio.open(src_path) as src:
+        profile = reproject.warped_profile(src.profile, 'EPSG:4326')
+
+    with reproject.WarpedReader(src_path,
+                                reproject.warp_options(profile)) as src:
+        whole = src.read(1)
+        assert whole.shape == (profile['height'], profile['width'])
+        half = profile['height'] // 2
+        assert np.array_equal(
+            src.read(1, window=((half, profile['height']),
+                                (0, profile['width']))),
+            whole[half:])
+
+
+def test_radiance_matches_warp_of_output(tmpdir):
+    """Nearest neighbour TOA of warped DNs is the warp of TOA"""
+    utm_path = str(tmpdir.join('utm.tif'))
+    merc_path = str(tmpdir.join('merc.tif'))
+    radiance.calculate_landsat_radiance(
+        src_path, src_mtl, utm_path, None, {}, 5, 'uint16', 1, stats=False)
+    radiance.calculate_landsat_radiance(
+        src_path, src_mtl, merc_path, None, {}, 5, 'uint16', 2,
+        stats=False, dst_crs='EPSG:3857', dst_res=500)
+
+    with rio.open(utm_path) as utm, rio.open(merc_path) as merc:
+        warped = np.zeros(merc.shape, dtype=np.uint16)
+        warp_reproject(utm.read(1), warped, src_transform=utm.transform,
+                       src_crs=utm.crs, dst_transform=merc.transform,
+                       dst_crs=merc.crs, resampling=Resampling.nearest)
+        out = merc.read(1)
+        assert merc.nodata == 0
+        assert (out == 0).any()
+
+    # the same source pixels are picked, but for rounding at edges
+    assert (out == warped).mean() > 0.99
+
+
+def test_reflectance_pixel_sunangle_output_grid(tmpdir):
+    paths = [str(tmpdir.join('%d.tif' % p)) for p in (1, 2)]
+    for path, processes in zip(paths, (1, 2)):
+        reflectance.calculate_landsat_reflectance(
+            [src_path], src_mtl, path, None, {}, [5], 'uint16', processes,
+            True, dst_crs='EPSG:3857', dst_res=1000,
+            target_aligned_pixels=True)
+
+    with rio.open(paths[0]) as a, rio.open(paths[1]) as b:
+        assert a.crs == CRS.from_epsg(3857)
+        assert a.transform.c % 1000 == 0
+        assert np.array_equal(a.read(), b.read())
@@ -0,0 +1,168 @@
+import struct
+
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.io import MemoryFile
+
+from rio_toa import reflectance, s3_output
+from rio_toa.executor import Executor
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B4.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+class Parts(object):
+    """Collects the parts of an upload in memory"""
+
+    def __init__(self):
+        self.parts = {}
+        self.order = []
+        self.completed = self.aborted = False
+
+    def upload_part(self, number, data):
+        self.parts[number] = data
+        self.order.append(number)
+
+    def complete(self):
+        self.completed = True
+
+    def abort(self):
+        self.aborted = True
+
+    def data(self):
+        return b''.join(self.parts[n] for n in sorted(self.parts))
+
+
+@pytest.fixture
+def expected(tmpdir):
+    dst_path = str(tmpdir.join('toa.tif'))
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, None,
+        {'tiled': True, 'blockxsize': 128, 'blockysize': 128,
+         'compress': 'deflate'}, [2, 3, 4], 'uint16', 1, True)
+    with rio.open(dst_path) as src:
+        return src.profile, src.read(), src.tags(), \
+            [src.tags(b) for b in src.indexes], src.scales
+
+
+def _stream(upload, profile, data, tags, band_tags, windows, **kwargs):
+    with s3_output.StreamWriter(upload, profile,
+                                s3_output.stream_windows(profile),
+                                **kwargs) as dst:
+        dst.update_tags(**tags)
+        for bidx, t in enumerate(band_tags, 1):
+            dst.update_tags(bidx, **t)
+        dst.set_scale_offset(1 / 65535.0, 0.0)
+        for window, _ in windows:
+            (r0, r1), (c0, c1) = window.toranges()
+            dst.write(data[:, r0:r1, c0:c1], window)
+
+
+def test_split_uri():
+    assert s3_output.is_s3_uri('s3://bucket/a/b.tif')
+    assert not s3_output.is_s3_uri('/tmp/b.tif')
+    assert s3_output.split_uri('s3://bucket/a/b.tif') == ('bucket',
+                                                          'a/b.tif')
+    with pytest.raises(ValueError):
+        s3_output.split_uri('s3://bucket')
+
+
+def test_ifd_roundtrip(expected):
+    profile, data = expected[:2]
+    with MemoryFile() as mem:
+        with mem.open(**profile) as dst:
+            dst.write(data)
+        bigtiff, entries = s3_output.read_ifd(mem.read())
+
+    assert not bigtiff
+    typ, count, value = entries[256]
+    assert struct.unpack('<H' if typ == 3 else '<I', value) == \
+        (profile['width'], )
+    assert s3_output.read_ifd(s3_output.write_ifd(bigtiff, entries)) == \
+        (bigtiff, entries)
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_stream_writer(expected, reverse):
+    profile, data, tags, band_tags, scales = expected
+    windows = s3_output.stream_windows(profile)
+
+    upload = Parts()
+    _stream(upload, profile, data, tags, band_tags,
+            windows[::-1] if reverse else windows, part_size=64 * 1024)
+
+    assert upload.completed and not upload.aborted
+    # the header part is uploaded last, once the tile offsets are known
+    assert upload.order[-1] == 1 and len(upload.parts) > 2
+    assert all(len(upload.parts[n]) >= 64 * 1024
+               for n in sorted(upload.parts)[:-1])
+
+    _, entries = s3_output.read_ifd(upload.data())
+    offsets = struct.unpack('<%dI' % len(windows),
+                            entries[s3_output.TILE_OFFSETS][2])
+    assert list(offsets) == sorted(offsets)
+    assert offsets[0] < len(upload.parts[1])
+
+    with MemoryFile(upload.data()) as mem:
+        with mem.open() as src:
+            assert src.crs == profile['crs']
+            assert src.transform == profile['transform']
+            assert src.block_shapes[0] == (128, 128)
+            assert src.compression.value == 'DEFLATE'
+            assert np.array_equal(src.read(), data)
+            assert src.tags() == tags
+            assert src.tags(1) == band_tags[0]
+            assert src.scales == (1 / 65535.0, ) * 3
+
+
+def test_stream_writer_aborts(expected):
+    profile, data, tags, band_tags, _ = expected
+    upload = Parts()
+    with pytest.raises(ValueError):
+        _stream(upload, profile, data, tags, band_tags,
+                s3_output.stream_windows(profile)[:-1])
+    assert upload.aborted and not upload.completed
+
+    with pytest.raises(ValueError):
+        s3_output.StreamWriter(Parts(), profile,
+                               s3_output.stream_windows(
+                                   dict(profile, blockxsize=64,
+                                        blockysize=64)))
+
+
+def test_executor_s3_no_shard(expected):
+    with pytest.raises(ValueError):
+        Executor(src_paths[:1], 's3://bucket/toa.tif', None,
+                 options=expected[0], shard=(0, 2))
+    with pytest.raises(ValueError):
+        Executor(src_paths[:1], 's3://bucket/toa.zarr', None,
+                 options=dict(expected[0], driver='Zarr'))
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_reflectance_s3(expected, monkeypatch, processes):
+    boto3 = pytest.importorskip('boto3')
+    moto = pytest.importorskip('moto')
+    mock = getattr(moto, 'mock_aws', None) or moto.mock_s3
+
+    for key in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']:
+        monkeypatch.setenv(key, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+
+    with mock():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='bucket')
+        reflectance.calculate_landsat_reflectance(
+            src_paths, src_mtl, 's3://bucket/toa.tif', None,
+            {'tiled': True, 'blockxsize': 128, 'blockysize': 128,
+             'compress': 'deflate'}, [2, 3, 4], 'uint16', processes, True)
+        body = client.get_object(Bucket='bucket', Key='toa.tif')['Body']
+
+        with MemoryFile(body.read()) as mem:
+            with mem.open() as src:
+                assert np.array_equal(src.read(), expected[1])
+                assert 'STATISTICS_MEAN' in src.tags(1)
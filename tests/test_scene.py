@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+import rasterio as rio
+
+import rio_toa
+from rio_toa import reflectance, toa_utils
+from rio_toa.scene import Scene
+
+
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+template = '{dir}/tiny_{scene}_B{b}.TIF'
+
+
+def test_scene_metadata():
+    assert rio_toa.Scene is Scene
+    scene = Scene(src_mtl, template=template)
+    metadata = toa_utils._load_mtl(src_mtl)['L1_METADATA_FILE']
+
+    assert scene.scene_id == 'LC80460282016177LGN00'
+    assert scene.sun_elevation == \
+        metadata['IMAGE_ATTRIBUTES']['SUN_ELEVATION']
+    assert list(scene.bounds) == toa_utils._get_bounds_from_metadata(
+        metadata['PRODUCT_METADATA'])
+
+    mult, add = scene.rescaling('REFLECTANCE', [2, 3])
+    assert mult.shape == (2, 1, 1) and mult.dtype == np.float32
+    assert add[1, 0, 0] == np.float32(
+        metadata['RADIOMETRIC_RESCALING']['REFLECTANCE_ADD_BAND_3'])
+    assert scene.rescaling('REFLECTANCE', [2, 3])[0] is mult
+
+    grid = scene.sun_elevation_grid((10, 20))
+    assert grid.shape == (10, 20)
+    assert scene.sun_elevation_grid((10, 20)) is grid
+    assert abs(grid.mean() - scene.sun_elevation) < 2
+
+
+def test_scene_datasets():
+    with Scene(src_mtl, template=template) as scene:
+        assert scene.band_path(2) == \
+            'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+        src = scene.dataset(2)
+        assert scene.dataset(2) is src
+        assert scene.band_profile(2)['width'] == src.width
+        profile = scene.profile([2, 3], 'uint8', {'compress': 'deflate'})
+        assert profile['dtype'] == 'uint8' and profile['count'] == 2
+        assert profile['compress'] == 'deflate'
+        assert scene.profile([2, 3], 'uint8', {'compress': 'deflate'}) \
+            is profile
+    assert src.closed
+
+    scene = Scene(toa_utils._load_mtl(src_mtl))
+    with pytest.raises(ValueError):
+        scene.band_path(2)
+    band_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+    scene = Scene(toa_utils._load_mtl(src_mtl), band_paths={2: band_path})
+    assert scene.band_paths([2]) == [scene.band_path(2)]
+
+
+def test_scene_reflectance(tmpdir):
+    expected = str(tmpdir.join('expected.tif'))
+    reflectance.calculate_landsat_reflectance(
+        ['tests/data/tiny_LC80460282016177LGN00_B%d.TIF' % b
+         for b in [2, 3]], src_mtl, expected, None, {}, [2, 3], 'uint16',
+        2, False)
+
+    scene = Scene(src_mtl, template=template)
+    paths = [str(tmpdir.join('a.tif')), str(tmpdir.join('b.tif'))]
+    for path in paths:
+        scene.reflectance(path, [2, 3], processes=2)
+
+    with rio.open(expected) as src:
+        data = src.read()
+    for path in paths:
+        with rio.open(path) as src:
+            assert np.array_equal(src.read(), data)
+    # the calculate functions work on a copy of the parsed MTL
+    assert scene.mtl == toa_utils._load_mtl(src_mtl)
+
+
+def test_scene_reuses_setup(tmpdir, monkeypatch):
+    band_paths = ['tests/data/tiny_LC80460282016177LGN00_B%d.TIF' % b
+                  for b in [2, 3]]
+    opened, looked_up = [], []
+    rio_open = rio.open
+    band_constants = toa_utils._band_constants
+
+    def counting_open(path, *args, **kwargs):
+        if path in band_paths:
+            opened.append(path)
+        return rio_open(path, *args, **kwargs)
+
+    def counting_constants(mtl, keys, bands, *args):
+        looked_up.append(keys[-1])
+        return band_constants(mtl, keys, bands, *args)
+
+    monkeypatch.setattr(rio, 'open', counting_open)
+    monkeypatch.setattr(toa_utils, '_band_constants', counting_constants)
+    with Scene(src_mtl, template=template) as scene:
+        for name in ['a.tif', 'b.tif']:
+            scene.reflectance(str(tmpdir.join(name)), [2, 3],
+                              processes=2, pixel_sunangle=True)
+            scene.radiance(str(tmpdir.join('rad_' + name)), [2, 3],
+                           processes=2)
+
+        assert sorted(opened) == band_paths
+        assert sorted(looked_up) == sorted([
+            'REFLECTANCE_MULT_BAND_', 'REFLECTANCE_ADD_BAND_',
+            'RADIANCE_MULT_BAND_', 'RADIANCE_ADD_BAND_'])
+        assert len(scene._sun_grids) == 1
+
+    with rio.open(str(tmpdir.join('a.tif'))) as src:
+        assert src.count == 2 and src.read().any()
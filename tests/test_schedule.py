@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import schedule
+
+
+@pytest.fixture
+def collar_path(tmpdir):
+    # nodata collar on the left half, noisy interior on the right
+    path = str(tmpdir.join('collar.tif'))
+    data = np.zeros((1, 256, 256), dtype=np.uint16)
+    data[0, :, 128:] = np.random.randint(1, 60000, (256, 128))
+
+    with rio.open(path, 'w', driver='GTiff', width=256, height=256, count=1,
+                  dtype='uint16', nodata=0, tiled=True, blockxsize=64,
+                  blockysize=64, compress='deflate') as dst:
+        dst.write(data)
+        dst.build_overviews([2, 4, 8])
+
+    return path
+
+
+def test_window_costs(collar_path):
+    with rio.open(collar_path) as src:
+        windows = list(src.block_windows(1))
+    windows = [[w, ij] for ij, w in windows]
+
+    costs = schedule.window_costs(collar_path, windows)
+
+    assert len(costs) == 16
+    for (window, ij), cost in zip(windows, costs):
+        if window.col_off < 128:
+            assert cost == 0
+        else:
+            assert cost > 0
+
+
+def test_window_costs_tuple_windows(collar_path):
+    windows = [[((0, 64), (192, 256)), (0, 3)],
+               [((0, 64), (0, 64)), (0, 0)],
+               [Window(64, 64, 64, 64), None]]
+
+    costs = schedule.window_costs(collar_path, windows)
+
+    assert costs[0] > 0
+    assert costs[1] == 0
+    assert costs[2] == 0
+
+
+def test_window_costs_without_overviews(tmpdir):
+    path = str(tmpdir.join('flat.tif'))
+    with rio.open(path, 'w', driver='GTiff', width=64, height=64, count=1,
+                  dtype='uint16') as dst:
+        dst.write(np.ones((1, 64, 64), dtype=np.uint16))
+
+    assert schedule.window_costs(path, [[Window(0, 0, 64, 64), (0, 0)]]) \
+        is None
+
+
+def test_order_windows():
+    windows = [['a', (0, 0)], ['b', (0, 1)], ['c', (0, 2)], ['d', (0, 3)]]
+    ordered = schedule.order_windows(windows, [1, 5, 1, 3])
+    assert [w for w, _ in ordered] == ['b', 'd', 'a', 'c']
+
+
+def test_latency_summary():
+    stats = schedule.latency_summary(np.arange(1, 101) / 100.0, 10.0, 2)
+
+    assert stats['count'] == 100
+    assert stats['max'] == 1.0
+    assert stats['p50'] == pytest.approx(0.505)
+    assert stats['p99'] == pytest.approx(0.9901)
+    assert stats['utilization'] == pytest.approx(50.5 / 20)
+
+
+def test_latency_summary_empty():
+    stats = schedule.latency_summary([], 0, 2)
+    assert stats['count'] == 0
+    assert stats['utilization'] == 0
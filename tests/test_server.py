@@ -0,0 +1,143 @@
+import threading
+
+try:
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import HTTPError, Request, urlopen
+
+import pytest
+import rasterio as rio
+
+from rio_toa import server
+
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture(scope='module')
+def job_server():
+    srv = server.JobServer(('127.0.0.1', 0), 1, token=TOKEN)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield 'http://127.0.0.1:%s' % srv.server_address[1]
+
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_submit_job(job_server, tmpdir):
+    output = str(tmpdir.join('toa_reflectance.tif'))
+
+    job = server.submit_job(
+        job_server, 'reflectance',
+        ['tests/data/tiny_LC81390452014295LGN00_B5.TIF',
+         'tests/data/LC81390452014295LGN00_MTL.json',
+         output, '--readtemplate', '.*/tiny_LC8.*\_B{b}.TIF'], token=TOKEN)
+
+    assert job['status'] == 'done'
+    with rio.open(output) as out:
+        assert out.count == 1
+        assert out.dtypes[0] == rio.uint16
+
+
+def test_submit_job_no_wait(job_server, tmpdir):
+    output = str(tmpdir.join('toa_radiance.tif'))
+
+    job = server.submit_job(
+        job_server, 'radiance',
+        ['tests/data/tiny_LC81390452014295LGN00_B5.TIF',
+         'tests/data/LC81390452014295LGN00_MTL.json',
+         output, '--readtemplate', '.*/tiny_LC8.*\_B{b}.TIF'], wait=False,
+        token=TOKEN)
+
+    assert job['status'] == 'pending'
+    job = server._request('%s/jobs/%s?wait=1' % (job_server, job['id']),
+                          token=TOKEN)
+    assert job['status'] == 'done'
+
+
+def test_submit_job_failed(job_server, tmpdir):
+    job = server.submit_job(
+        job_server, 'reflectance',
+        ['tests/data/tiny_LC81390452014295LGN00_B5.TIF',
+         'tests/data/LC81390452014295LGN00_MTL.json',
+         str(tmpdir.join('out.tif'))], token=TOKEN)
+
+    assert job['status'] == 'failed'
+    assert 'not a valid template' in job['error']
+
+
+def test_submit_job_bad_command(job_server):
+    with pytest.raises(Exception):
+        server.submit_job(job_server, 'serve', [], token=TOKEN)
+
+
+def test_fetched_jobs_are_forgotten(job_server, tmpdir):
+    output = str(tmpdir.join('toa_radiance.tif'))
+    job = server.submit_job(
+        job_server, 'radiance',
+        ['tests/data/tiny_LC81390452014295LGN00_B5.TIF',
+         'tests/data/LC81390452014295LGN00_MTL.json',
+         output, '--readtemplate', r'.*/tiny_LC8.*\_B{b}.TIF'], token=TOKEN)
+    assert job['status'] == 'done'
+
+    with pytest.raises(Exception) as e:
+        server._request('%s/jobs/%s' % (job_server, job['id']),
+                        token=TOKEN)
+    assert '404' in str(e.value)
+
+
+def test_expired_jobs_are_pruned(tmpdir):
+    srv = server.JobServer(('127.0.0.1', 0), 1, ttl=0)
+    try:
+        job_id = srv.submit('reflectance', ['missing.tif'], str(tmpdir))
+        srv.jobs[job_id][0].wait()
+        srv.submit('reflectance', ['missing.tif'], str(tmpdir))
+        assert job_id not in srv.jobs
+    finally:
+        srv.server_close()
+
+
+def test_remote_hosts_need_allow_remote():
+    assert server.is_loopback('localhost')
+    assert not server.is_loopback('0.0.0.0')
+    with pytest.raises(ValueError):
+        server.JobServer(('0.0.0.0', 0), 1)
+
+
+def _post(url, headers, body=b'{"command": "radiance", "args": []}'):
+    req = Request(url + '/jobs', data=body, headers=headers)
+    with pytest.raises(HTTPError) as e:
+        urlopen(req)
+    return e.value.code
+
+
+def test_jobs_need_the_token(job_server):
+    json_type = {'Content-Type': 'application/json'}
+    assert _post(job_server, json_type) == 401
+    assert _post(job_server, dict(json_type,
+                                  Authorization='Bearer wrong')) == 401
+    with pytest.raises(HTTPError) as e:
+        urlopen(job_server + '/jobs/x')
+    assert e.value.code == 401
+
+
+def test_jobs_need_json(job_server):
+    auth = {'Authorization': 'Bearer %s' % TOKEN}
+    for content_type in ['text/plain', 'application/x-www-form-urlencoded']:
+        assert _post(job_server, dict(auth,
+                                      **{'Content-Type': content_type})) == 415
+
+
+def test_jobs_need_a_loopback_host(job_server):
+    assert _post(job_server, {'Authorization': 'Bearer %s' % TOKEN,
+                              'Content-Type': 'application/json',
+                              'Host': 'rebind.example.com'}) == 403
+    assert server.is_loopback_name('localhost:8877')
+    assert server.is_loopback_name('127.0.0.1')
+    assert server.is_loopback_name('[::1]:8877')
+    assert not server.is_loopback_name('127.0.0.1.example.com')
+    assert not server.is_loopback_name('')
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import band_stats, reflectance, shards
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B4.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+def _run(dst_path, shard=None, processes=1, scale_offset=False):
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, None, {}, [2, 3, 4], 'uint16',
+        processes, True, shard=shard, scale_offset=scale_offset, stats=True)
+
+
+@pytest.fixture
+def expected(tmpdir):
+    dst_path = str(tmpdir.join('full.tif'))
+    _run(dst_path)
+    with rio.open(dst_path) as src:
+        return src.read(), src.transform
+
+
+@pytest.fixture
+def shard_paths(tmpdir):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmpdir.join('shard_%d.tif' % i)))
+        _run(paths[-1], shard=(i, 3), processes=1 + i % 2)
+    return paths
+
+
+def test_parse_shard():
+    assert shards.parse_shard('0/4') == (0, 4)
+    assert shards.parse_shard('3/4') == (3, 4)
+    for bad in ['4/4', '-1/4', '1/0', '1', 'a/b', None]:
+        with pytest.raises(ValueError):
+            shards.parse_shard(bad)
+
+
+def test_shard_windows():
+    windows = [[Window(c, r, 10, 10), (r // 10, c // 10)]
+               for r in range(0, 50, 10) for c in range(0, 20, 10)]
+
+    seen = []
+    stops = []
+    for i in range(3):
+        selected, (start, stop) = shards.shard_windows(windows, i, 3)
+        seen.extend(ij for _, ij in selected)
+        stops.append((start, stop))
+
+    assert sorted(seen) == sorted(ij for _, ij in windows)
+    assert stops == [(0, 20), (20, 40), (40, 50)]
+
+    with pytest.raises(ValueError):
+        shards.shard_windows(windows, 0, 6)
+
+
+def test_shard_outputs(shard_paths, expected):
+    data, transform = expected
+    row = 0
+    for i, path in enumerate(shard_paths):
+        with rio.open(path) as src:
+            assert src.tags()['TOA_SHARD'] == '%d/3' % i
+            assert src.transform == transform * \
+                rio.transform.Affine.translation(0, row)
+            assert np.array_equal(src.read(), data[:, row:row + src.height])
+            row += src.height
+
+    assert row == data.shape[1]
+
+
+@pytest.mark.parametrize('driver', ['GTiff', 'COG', 'VRT'])
+def test_merge_shards(shard_paths, expected, tmpdir, driver):
+    data, transform = expected
+    dst_path = str(tmpdir.join('merged.%s' % driver.lower()))
+
+    shards.merge_shards(shard_paths[::-1], dst_path, driver=driver)
+
+    with rio.open(dst_path) as src:
+        assert src.transform == transform
+        assert 'TOA_SHARD' not in src.tags()
+        assert np.array_equal(src.read(), data)
+
+
+@pytest.mark.parametrize('driver', ['GTiff', 'COG', 'VRT'])
+def test_merge_shards_stats(shard_paths, tmpdir, driver):
+    full_path = str(tmpdir.join('full.tif'))
+    _run(full_path)
+    dst_path = str(tmpdir.join('merged.%s' % driver.lower()))
+
+    shards.merge_shards(shard_paths, dst_path, driver=driver)
+
+    for merged, full in zip(band_stats.read_stats(dst_path),
+                            band_stats.read_stats(full_path)):
+        assert merged['count'] == full['count']
+        assert merged['histogram'] == full['histogram']
+        for key in ['min', 'max', 'valid_percent']:
+            assert merged[key] == full[key]
+        for key in ['mean', 'stddev']:
+            assert np.isclose(merged[key], full[key])
+
+    with rio.open(dst_path) as src, rio.open(full_path) as full:
+        for bidx in full.indexes:
+            assert set(src.tags(bidx)) == set(full.tags(bidx))
+
+
+@pytest.mark.parametrize('driver', ['GTiff', 'VRT'])
+def test_merge_shards_scale_offset(tmpdir, driver):
+    paths = []
+    for i in range(2):
+        paths.append(str(tmpdir.join('shard_%d.tif' % i)))
+        _run(paths[-1], shard=(i, 2), scale_offset=True)
+    with rio.open(paths[0]) as src:
+        scales, offsets = src.scales, src.offsets
+    assert scales != (1.0, ) * 3
+    dst_path = str(tmpdir.join('merged.%s' % driver.lower()))
+
+    shards.merge_shards(paths, dst_path, driver=driver)
+
+    with rio.open(dst_path) as src:
+        assert src.scales == scales
+        assert src.offsets == offsets
+
+    _run(paths[1], shard=(1, 2))
+    with pytest.raises(ValueError):
+        shards.merge_shards(paths, str(tmpdir.join('mixed.tif')))
+
+
+def test_merge_missing_shard(shard_paths, tmpdir):
+    with pytest.raises(ValueError):
+        shards.merge_shards(shard_paths[:2], str(tmpdir.join('out.tif')))
+
+
+def test_merge_not_a_shard(tmpdir):
+    with pytest.raises(ValueError):
+        shards.merge_shards(src_paths[:1], str(tmpdir.join('out.tif')))
@@ -0,0 +1,51 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from rio_toa import shared_state
+
+
+@pytest.fixture(params=[True, False], ids=['shm', 'memmap'])
+def use_shm(request):
+    if request.param and shared_state.shared_memory is None:
+        pytest.skip('multiprocessing.shared_memory is not available')
+    return request.param
+
+
+def test_publish_attach(use_shm):
+    grid = np.random.rand(512, 512)
+    g_args = {'E': 0.5, 'grid': grid, 'small': np.arange(4),
+              'poly': {'coefs': grid[:300]}}
+
+    published, publication = shared_state.publish(
+        g_args, min_bytes=1024, use_shm=use_shm)
+    try:
+        assert isinstance(published['grid'], shared_state.SharedArray)
+        assert isinstance(published['poly']['coefs'],
+                          shared_state.SharedArray)
+        assert published['small'] is g_args['small']
+        assert published['E'] == 0.5
+        # only descriptors cross the process boundary
+        assert len(pickle.dumps(published)) < 1024
+
+        attached = shared_state.attach(pickle.loads(pickle.dumps(published)))
+        assert np.array_equal(attached['grid'], grid)
+        assert np.array_equal(attached['poly']['coefs'], grid[:300])
+        assert not attached['grid'].flags.writeable
+        assert attached['E'] == 0.5
+    finally:
+        publication.close()
+
+    if not use_shm:
+        assert not os.path.exists(published['grid'].path)
+
+
+def test_publish_small_arrays_untouched():
+    g_args = {'lut': np.arange(16)}
+    published, publication = shared_state.publish(g_args)
+    assert published['lut'] is g_args['lut']
+    assert publication.blocks == []
+    assert publication.tmpdir is None
+    publication.close()
@@ -0,0 +1,169 @@
+import shutil
+
+import numpy as np
+import pytest
+import rasterio as rio
+import riomucho
+
+from rio_toa import radiance, reflectance, stretch, toa_utils
+from rio_toa.kernels import radiance as radiance_kernel
+
+
+src_path = 'tests/data/tiny_LC81390452014295LGN00_B5.TIF'
+src_mtl = 'tests/data/LC81390452014295LGN00_MTL.json'
+
+M, A = 0.012, -60.0
+
+
+def test_sample_windows():
+    windows = [[((r, r + 1), (0, 10)), (r, 0)] for r in range(100)]
+
+    sample = stretch.sample_windows(windows, 0.05)
+    assert sample == [windows[i] for i in (10, 30, 50, 70, 90)]
+
+    assert stretch.sample_windows(windows, 0.0) == [windows[50]]
+    assert stretch.sample_windows(windows[:3], 1.0) == windows[:3]
+
+
+def test_valid_windows(tmpdir):
+    fill_path = str(tmpdir.join('fill.tif'))
+    shutil.copy('tests/data/tiny_LC80460282016177LGN00_B2.TIF', fill_path)
+    windows = riomucho.utils.getWindows(fill_path)
+
+    # no overviews: the band is not read, and every window is kept
+    assert stretch.valid_windows(fill_path, windows) == windows
+
+    with rio.open(fill_path, 'r+') as src:
+        src.build_overviews([2, 4, 8])
+    valid = stretch.valid_windows(fill_path, windows)
+    assert windows[0] not in valid and windows[1] in valid
+    assert len(valid) < len(windows)
+
+
+def test_derive_stretch_fill_without_nodata(tmpdir):
+    # no nodata and a fill corner: DN 0 must not be sampled as data
+    fill_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+    fill_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+    dst_path = str(tmpdir.join('reflectance.tif'))
+    reflectance.calculate_landsat_reflectance(
+        [fill_path], fill_mtl, dst_path, None, {}, [2], 'uint16', 1, False,
+        auto_rescale=(2, 98), stats=False)
+
+    with rio.open(dst_path) as out:
+        tags = out.tags()
+
+    assert float(tags['TOA_STRETCH_MIN']) > 0
+    assert float(tags['TOA_RESCALE_FACTOR']) != 55000
+    assert tags['TOA_AUTO_RESCALE_SAMPLE'].startswith('1/')
+
+
+def test_rescale_stretch():
+    arr = np.array([-0.5, 0.0, 0.25, 0.5, 1.0], dtype=np.float32)
+
+    out = toa_utils.rescale(arr, 100, np.uint8, stretch=(0.0, 0.5))
+    assert out.tolist() == [0, 0, 50, 100, 100]
+
+    out = toa_utils.rescale(arr, 1.0, np.float32, stretch=(0.25, 0.5))
+    assert out.tolist() == [0.0, 0.0, 0.0, 1.0, 1.0]
+    assert arr.tolist() == [-0.5, 0.0, 0.25, 0.5, 1.0]
+
+
+def test_derive_stretch_matches_full_scene():
+    g_args = {'M': M, 'A': A, 'src_nodata': 0, 'rescale_factor': 65535,
+              'clip': True, 'dst_dtype': np.uint16, 'qa_flags': None,
+              'stretch': None}
+
+    (vmin, vmax), tags = stretch.derive_stretch(
+        [src_path], radiance._radiance_worker, g_args,
+        percentiles=(1, 99), fraction=1.0)
+
+    with rio.open(src_path) as src:
+        values = radiance_kernel(src.read(1), M, A, 0)
+    values = values[values != 0]
+
+    assert vmin == pytest.approx(np.percentile(values, 1), rel=1e-5)
+    assert vmax == pytest.approx(np.percentile(values, 99), rel=1e-5)
+    assert tags['TOA_STRETCH_PERCENTILES'] == '1.0,99.0'
+    assert float(tags['TOA_RESCALE_FACTOR']) == pytest.approx(
+        65535 / (vmax - vmin))
+    assert tags['TOA_AUTO_RESCALE_SAMPLE'].startswith('4/4 windows')
+
+
+def test_derive_stretch_samples_fraction():
+    g_args = {'M': M, 'A': A, 'src_nodata': 0, 'rescale_factor': 255,
+              'clip': True, 'dst_dtype': np.uint8, 'qa_flags': None,
+              'stretch': None}
+    windows = riomucho.utils.getWindows(src_path)
+
+    (vmin, vmax), tags = stretch.derive_stretch(
+        [src_path], radiance._radiance_worker, g_args, windows=windows,
+        fraction=0.01)
+
+    assert vmin == 0.0
+    assert tags['TOA_AUTO_RESCALE_SAMPLE'].startswith(
+        '1/%d windows' % len(windows))
+
+    with pytest.raises(ValueError):
+        stretch.derive_stretch([src_path], radiance._radiance_worker,
+                               g_args, percentiles=(50, 50))
+
+
+def test_derive_stretch_grows_without_resampling(monkeypatch):
+    g_args = {'M': M, 'A': A, 'src_nodata': 0, 'rescale_factor': 255,
+              'clip': True, 'dst_dtype': np.uint8, 'qa_flags': None,
+              'stretch': None}
+    windows = [[((r, r + 8), (0, 8)), (r // 8, 0)] for r in range(0, 64, 8)]
+    computed = []
+
+    def sample_values(inpaths, worker, global_args, sample, *args):
+        computed.extend(ij for _, ij in sample)
+        return np.ones(100, dtype=np.float32) * (len(computed) + 1)
+
+    # never enough pixels: the sample doubles until it holds every window
+    monkeypatch.setattr(stretch, 'sample_values', sample_values)
+    monkeypatch.setattr(stretch, 'MIN_PIXELS', 10 ** 6)
+    _, tags = stretch.derive_stretch(
+        [src_path], radiance._radiance_worker, g_args, windows=windows,
+        fraction=0.1)
+
+    assert sorted(computed) == sorted(ij for _, ij in windows)
+    assert tags['TOA_AUTO_RESCALE_SAMPLE'].startswith('8/8 windows')
+
+
+def test_derive_stretch_no_valid_pixels():
+    g_args = {'M': 0.0, 'A': 0.0, 'src_nodata': 0, 'rescale_factor': 255,
+              'clip': True, 'dst_dtype': np.uint8, 'qa_flags': None,
+              'stretch': None}
+
+    assert stretch.derive_stretch(
+        [src_path], radiance._radiance_worker, g_args) == (None, {})
+
+
+def test_calculate_radiance_auto_rescale(tmpdir):
+    dst_path = str(tmpdir.join('radiance.tif'))
+    radiance.calculate_landsat_radiance(
+        src_path, src_mtl, dst_path, None, {}, 5, 'uint16', 1,
+        auto_rescale=(0, 99), auto_sample=1.0)
+
+    with rio.open(dst_path) as out:
+        tags = out.tags()
+        arr = out.read(1)
+
+    assert float(tags['TOA_STRETCH_MIN']) == 0.0
+    assert arr.max() == 65535
+    # the top percent of valid pixels saturates, give or take ties
+    saturated = (arr == 65535).sum() / float((arr > 0).sum())
+    assert 0.01 <= saturated < 0.02
+
+
+def test_calculate_reflectance_auto_rescale_processes(tmpdir):
+    paths = [str(tmpdir.join('%d.tif' % p)) for p in (1, 2)]
+    for path, processes in zip(paths, (1, 2)):
+        reflectance.calculate_landsat_reflectance(
+            [src_path], src_mtl, path, None, {}, [5], 'uint8', processes,
+            False, auto_rescale=(2, 98), stats=False)
+
+    with rio.open(paths[0]) as a, rio.open(paths[1]) as b:
+        assert a.tags()['TOA_STRETCH_MAX'] == b.tags()['TOA_STRETCH_MAX']
+        assert float(a.tags()['TOA_STRETCH_MIN']) != 0.0
+        assert np.array_equal(a.read(), b.read())
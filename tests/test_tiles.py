@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import reflectance, tiles
+from rio_toa.executor import Executor
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B2.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B4.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+
+
+def _run(dst_path, processes, driver=None):
+    return reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, dst_path, None, {'compress': 'deflate'},
+        [2, 3, 4], 'uint16', processes, True, driver=driver, stats=True)
+
+
+def _identity_worker(data, window, ij, g_args):
+    return data[0]
+
+
+@pytest.fixture
+def expected(tmpdir):
+    dst_path = str(tmpdir.join('full.tif'))
+    _run(dst_path, 1)
+    with rio.open(dst_path) as src:
+        return src.read(), src.profile, src.tags(1), src.scales
+
+
+def test_tile_profile():
+    with rio.open(src_paths[0]) as src:
+        profile = src.profile
+    window = Window(256, 256, 100, 50)
+
+    tile = tiles.tile_profile(profile, window)
+    assert (tile['height'], tile['width']) == (50, 100)
+    assert tile['transform'] * (0, 0) == profile['transform'] * (256, 256)
+    assert 'blockxsize' not in tile
+    assert tiles.tile_path('d', window) == os.path.join('d', 'r256_c256.tif')
+    assert tiles.tiles_dir('out/toa.vrt') == 'out/toa_tiles'
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_reflectance_vrt(tmpdir, expected, processes):
+    data, profile, band_tags, scales = expected
+    dst_path = str(tmpdir.join('toa.vrt'))
+    _run(dst_path, processes, driver='VRT')
+
+    with rio.open(dst_path) as src:
+        assert src.driver == 'VRT'
+        assert src.transform == profile['transform']
+        assert src.crs == profile['crs']
+        assert np.array_equal(src.read(), data)
+        assert src.scales == scales
+        assert float(src.tags(1)['STATISTICS_MEAN']) == pytest.approx(
+            float(band_tags['STATISTICS_MEAN']))
+
+    tile_names = sorted(os.listdir(str(tmpdir.join('toa_tiles'))))
+    assert len(tile_names) > 1
+    with rio.open(str(tmpdir.join('toa_tiles', tile_names[0]))) as tile:
+        assert tile.compression.value == 'DEFLATE'
+
+
+def test_vrt_replaces_old_tiles(tmpdir):
+    dst_path = str(tmpdir.join('toa.vrt'))
+    os.makedirs(tiles.tiles_dir(dst_path))
+    stale = os.path.join(tiles.tiles_dir(dst_path), 'r9999_c9999.tif')
+    open(stale, 'w').close()
+
+    _run(dst_path, 1, driver='VRT')
+    assert not os.path.exists(stale)
+
+
+def test_concat_tiles(tmpdir, expected):
+    data, profile, _, scales = expected
+    vrt_path = str(tmpdir.join('toa.vrt'))
+    dst_path = str(tmpdir.join('toa.tif'))
+    _run(vrt_path, 2, driver='VRT')
+    tiles.concat_tiles(vrt_path, dst_path)
+
+    with rio.open(dst_path) as src:
+        assert src.driver == 'GTiff'
+        assert src.block_shapes[0] == (256, 256)
+        assert np.array_equal(src.read(), data)
+        assert src.scales == scales
+        assert 'STATISTICS_MEAN' in src.tags(1)
+
+
+def test_executor_vrt_no_shard(tmpdir):
+    with rio.open(src_paths[0]) as src:
+        profile = src.profile.copy()
+    profile.update(driver='VRT')
+    with pytest.raises(ValueError):
+        Executor([src_paths[0]], str(tmpdir.join('out.vrt')),
+                 _identity_worker, options=profile, shard=(0, 2))
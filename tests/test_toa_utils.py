@@ -4,7 +4,7 @@ import numpy as np
 from rio_toa.toa_utils import (
     _parse_bands_from_filename,
     _load_mtl_key, _load_mtl, rescale,
-    temp_rescale)
+    temp_rescale, _read_plan, _read_window)
 
 
 
@@ -155,3 +155,50 @@ def test_temp_rescale_error():
     arr = np.array(np.linspace(0.0, 1.5, num=9).reshape(3, 3))
     with pytest.raises(ValueError):
         temp_rescale(arr, 'FC')
+
+
+def test_read_plan():
+    assert _read_plan([1, 1, 1], [4, 3, 2]) == [(0, [1]), (1, [1]), (2, [1])]
+    assert _read_plan([3, 1], [4, 3, 2, 5]) == [(0, [1, 2, 3]), (1, [1])]
+
+
+def test_read_plan_subset():
+    assert _read_plan([3, 1], [4, 2, 5], [2, 3, 4, 5]) == \
+        [(0, [3, 1]), (1, [1])]
+    assert _read_plan([1, 3], [3, 2, 4], [2, 3, 4, 5]) == \
+        [(1, [1]), (0, [1]), (1, [2])]
+    with pytest.raises(ValueError):
+        _read_plan([3], [6], [2, 3, 4])
+
+
+def test_read_plan_mismatch():
+    with pytest.raises(ValueError):
+        _read_plan([3], [4, 3])
+
+
+def test_read_window_allocates_per_call():
+    import rasterio as rio
+
+    src_path = 'tests/data/tiny_LC80460282016177LGN00_B2.TIF'
+    window = ((0, 16), (0, 16))
+    with rio.open(src_path) as src:
+        first = _read_window([src], [(0, [1])], window, src.dtypes[0])
+        second = _read_window([src], [(0, [1])], window, src.dtypes[0])
+        assert first is not second
+        assert np.array_equal(first, src.read(window=window))
+
+        out = np.empty_like(first)
+        assert _read_window([src], [(0, [1])], window, src.dtypes[0],
+                            out=out) is out
+
+
+def test_load_mtl_cache(monkeypatch):
+    from rio_toa import toa_utils
+
+    monkeypatch.setattr(toa_utils, '_mtl_cache', {})
+    src_mtl = 'tests/data/LC80100202015018LGN00_MTL.json'
+
+    mtl = _load_mtl(src_mtl)
+    mtl['L1_METADATA_FILE'] = None
+    assert len(toa_utils._mtl_cache) == 1
+    assert _load_mtl(src_mtl)['L1_METADATA_FILE'] is not None
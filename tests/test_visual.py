@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rio_toa import reflectance, visual
+from rio_toa.color import apply_operations, parse_operations
+
+
+src_paths = ['tests/data/tiny_LC80460282016177LGN00_B4.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B3.TIF',
+             'tests/data/tiny_LC80460282016177LGN00_B2.TIF']
+src_mtl = 'tests/data/LC80460282016177LGN00_MTL.json'
+operations = 'gamma 1.2 sigmoidal 8 0.2 saturation 1.2'
+
+
+def test_visual_options():
+    assert visual.visual_options()['photometric'] == 'ycbcr'
+    assert visual.visual_options('webp', 75)['webp_level'] == 75
+    with pytest.raises(ValueError):
+        visual.visual_options('lzw')
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_visual_matches_separate_passes(tmpdir, processes):
+    toa_path = str(tmpdir.join('toa.tif'))
+    reflectance.calculate_landsat_reflectance(
+        src_paths, src_mtl, toa_path, 1.0, {}, [4, 3, 2], 'float32', 1,
+        False, False)
+    with rio.open(toa_path) as src:
+        expected = (apply_operations(src.read().astype(np.float64),
+                                     parse_operations(operations)) *
+                    255).astype(np.uint8)
+
+    dst_path = str(tmpdir.join('visual.tif'))
+    visual.calculate_landsat_visual(src_paths, src_mtl, dst_path,
+                                    processes=processes,
+                                    operations=operations,
+                                    compress='deflate')
+    with rio.open(dst_path) as src:
+        assert src.dtypes == ('uint8', ) * 3
+        assert src.block_shapes[0] == (256, 256)
+        assert src.scales == (1.0, ) * 3
+        # float32 storage of the reference rounds a few values
+        diff = np.abs(src.read().astype(int) - expected)
+        assert diff.max() <= 1
+        assert (diff > 0).mean() < 0.001
+
+
+def test_visual_jpeg(tmpdir):
+    dst_path = str(tmpdir.join('visual.tif'))
+    visual.calculate_landsat_visual(src_paths, src_mtl, dst_path,
+                                    processes=2, operations=operations)
+    with rio.open(dst_path) as src:
+        assert src.compression.value == 'JPEG'
+        assert src.photometric.value == 'YCbCr'
+        assert src.read().max() > 0
+
+    with pytest.raises(ValueError):
+        visual.calculate_landsat_visual(src_paths[:2], src_mtl, dst_path,
+                                        bands=[4, 3])
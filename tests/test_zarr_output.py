@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+import rasterio as rio
+from rasterio.windows import Window
+
+from rio_toa import radiance, zarr_output
+from rio_toa.executor import Executor
+
+zarr = pytest.importorskip('zarr')
+
+
+src_path = 'tests/data/tiny_LC81390452014295LGN00_B5.TIF'
+src_mtl = 'tests/data/LC81390452014295LGN00_MTL.json'
+
+
+def _identity_worker(data, window, ij, g_args):
+    return data[0]
+
+
+def test_window_chunks_aligned():
+    windows = [[Window(0, 0, 256, 256), (0, 0)],
+               [Window(256, 0, 125, 256), (0, 1)],
+               [Window(0, 256, 256, 133), (1, 0)]]
+    chunks = zarr_output.window_chunks(windows, 3)
+    assert chunks == (3, 256, 256)
+    assert zarr_output.aligned(windows, chunks)
+
+    assert not zarr_output.aligned(
+        windows + [[Window(100, 100, 256, 256), (9, 9)]], chunks)
+
+
+def test_zarr_writer_attrs(tmpdir):
+    path = str(tmpdir.join('out.zarr'))
+    with rio.open(src_path) as src:
+        profile = src.profile.copy()
+    profile.update(nodata=0)
+
+    with zarr_output.ZarrWriter(path, profile, (1, 128, 128)) as dst:
+        dst.write(np.ones((1, 10, 20), dtype=np.uint16),
+                  Window(5, 3, 20, 10))
+        dst.update_tags(TOA_TEST='a')
+        dst.update_tags(1, TOA_BAND=5)
+        dst.set_scale_offset(0.5, 1.0)
+
+    arr = zarr.open_array(path, mode='r')
+    assert arr.shape == (1, 389, 381)
+    assert arr.chunks == (1, 128, 128)
+    assert arr[0, 3:13, 5:25].all()
+    assert arr[0].sum() == 200
+
+    attrs = zarr_output.read_attrs(path)
+    assert attrs['_ARRAY_DIMENSIONS'] == ['band', 'y', 'x']
+    assert rio.crs.CRS.from_wkt(attrs['crs']) == profile['crs']
+    assert attrs['transform'] == list(profile['transform'])[:6]
+    assert attrs['nodata'] == 0
+    assert attrs['tags'] == {'TOA_TEST': 'a'}
+    assert attrs['band_tags'] == [{'TOA_BAND': '5'}]
+    assert (attrs['scale_factor'], attrs['add_offset']) == (0.5, 1.0)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_executor_zarr_matches_gtiff(tmpdir, processes):
+    with rio.open(src_path) as src:
+        profile = src.profile.copy()
+        expected = src.read()
+
+    path = str(tmpdir.join('out.zarr'))
+    profile.update(driver='Zarr')
+    with Executor([src_path], path, _identity_worker, options=profile,
+                  stats=(0, 65535)) as ex:
+        ex.run(processes)
+
+    arr = zarr.open_array(path, mode='r')
+    assert arr.chunks == (1, 256, 256)
+    assert np.array_equal(arr[:], expected)
+
+    tags = zarr_output.read_attrs(path)['band_tags'][0]
+    assert float(tags['STATISTICS_MAXIMUM']) == expected.max()
+
+
+def test_executor_zarr_no_shard(tmpdir):
+    with rio.open(src_path) as src:
+        profile = src.profile.copy()
+    profile.update(driver='Zarr')
+    with pytest.raises(ValueError):
+        Executor([src_path], str(tmpdir.join('out.zarr')), _identity_worker,
+                 options=profile, shard=(0, 2))
+
+
+def test_radiance_zarr(tmpdir):
+    tif = str(tmpdir.join('radiance.tif'))
+    path = str(tmpdir.join('radiance.zarr'))
+    for dst_path, driver in [(tif, None), (path, 'Zarr')]:
+        radiance.calculate_landsat_radiance(
+            src_path, src_mtl, dst_path, 1000, {}, 5, 'uint16', 2,
+            driver=driver)
+
+    with rio.open(tif) as src:
+        expected = src.read()
+        # GeoTIFFs get a scale and offset only when asked
+        assert src.scales == (1.0, )
+    assert np.array_equal(zarr.open_array(path, mode='r')[:], expected)
+
+    radiance.calculate_landsat_radiance(
+        src_path, src_mtl, tif, 1000, {}, 5, 'uint16', 2, scale_offset=True)
+    with rio.open(tif) as src:
+        assert src.scales == (0.001, )
+
+    attrs = zarr_output.read_attrs(path)
+    assert attrs['scale_factor'] == 0.001
+    assert attrs['add_offset'] == 0.0